@@ -0,0 +1,7 @@
+# This file is generated from setup.py
+version = '0.1.3'
+full_version = '0.1.3.dev1'
+git_revision = '0742beff8f55890c2fcdc0fb3231a53628383409'
+is_released = False
+if not is_released:
+    version = full_version
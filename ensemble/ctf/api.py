@@ -1,6 +1,7 @@
 from .base_color_function_component import ColorNode  # noqa
 from .color_function_component import ColorComponent  # noqa
 from .editor import CtfEditor  # noqa
+from .editor_2d import CtfEditor2D  # noqa
 from .function_component import FunctionComponent  # noqa
 from .function_node import FunctionNode  # noqa
 from .window_function_component import (  # noqa
@@ -11,4 +12,5 @@ from .manager import CtfManager  # noqa
 from .opacity_function_component import OpacityNode, OpacityComponent  # noqa
 from .piecewise import PiecewiseFunction  # noqa
 from .transfer_function import TransferFunction  # noqa
-from .utils import load_ctf, save_ctf  # noqa
+from .transfer_function_2d import GradientRegion, TransferFunction2D  # noqa
+from .utils import joint_histogram, load_ctf, save_ctf  # noqa
@@ -21,16 +21,13 @@ class ColorComponent(BaseColorComponent):
     def draw_contents(self, gc):
         """ Draw the component.
         """
-        r, g, b = self.node.color
-        screen_x, height = self.relative_to_screen(self.node.center, 1.0)
+        rect, fill_color = self.glyphs()[0]
 
         with gc:
             gc.set_line_width(1.0)
             gc.set_stroke_color((0.0, 0.0, 0.0, 1.0))
-            # FIXME: Bad choice of contrasting color for grays.
-            opposite_color = (1.0 - r, 1.0 - g, 1.0 - b, 1.0)
-            gc.set_fill_color(opposite_color)
-            gc.rect(screen_x - COMPONENT_WIDTH/2, 0, COMPONENT_WIDTH, height)
+            gc.set_fill_color(fill_color)
+            gc.rect(*rect)
             gc.draw_path()
 
     @classmethod
@@ -42,6 +39,16 @@ class ColorComponent(BaseColorComponent):
 
         return cls(node=nodes[0])
 
+    def glyphs(self):
+        """ Return the rectangles which `draw_contents` draws.
+        """
+        r, g, b = self.node.color
+        screen_x, height = self.relative_to_screen(self.node.center, 1.0)
+        rect = (screen_x - COMPONENT_WIDTH/2, 0, COMPONENT_WIDTH, height)
+        # FIXME: Bad choice of contrasting color for grays.
+        opposite_color = (1.0 - r, 1.0 - g, 1.0 - b, 1.0)
+        return [(rect, opposite_color)]
+
     def move(self, delta_x, delta_y):
         """ Move the component.
         """
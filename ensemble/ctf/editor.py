@@ -1,11 +1,15 @@
 from __future__ import division, unicode_literals
 
+from bisect import bisect_left, bisect_right, insort
+
 import numpy as np
 import six
 
 from enable.api import ColorTrait, Container
+from enable.base import empty_rectangle, intersect_bounds
 from pyface.action.api import Action
-from traits.api import Callable, Either, Instance, Tuple, on_trait_change
+from traits.api import (Any, Bool, Callable, Either, Instance, Tuple,
+                        on_trait_change)
 
 from .color_function_component import ColorNode, ColorComponent
 from .function_component import FunctionComponent
@@ -14,7 +18,8 @@ from .window_function_component import (
     DEFAULT_RADIUS
 )
 from .menu_tool import menu_tool_with_actions
-from .opacity_function_component import OpacityNode, OpacityComponent
+from .opacity_function_component import (OpacityNode, OpacityComponent,
+                                         BLACK)
 from .transfer_function import TransferFunction
 from .utils import build_screen_to_function
 
@@ -26,6 +31,90 @@ else:
     LINEAR_GRADIENT_ARGS = ('pad', 'userSpaceOnUse')
 
 
+def log_histogram(values, bin_edges):
+    """ Scale the logarithm of a histogram to the unit square.
+
+    Returns the scaled (bin_edges, levels) of the bins.
+    """
+    values = values.astype(float)
+    zeros = (values == 0)
+    min_nonzero = values[~zeros].min()
+    values[zeros] = min_nonzero / 2
+    levels = np.log(values)
+    levels -= levels.min()
+    if levels.max() > 0:
+        levels /= levels.max()
+
+    bin_edges = bin_edges - bin_edges.min()
+    bin_edges = bin_edges / bin_edges.max()
+    return bin_edges, levels
+
+
+def histogram_curve(bin_edges, levels, columns=None):
+    """ Compute the outline of a histogram from `log_histogram`, as an array
+    of (x, y) points.
+
+    If there are more bins than `columns`, the x axis is split into that many
+    columns and the outline only joins the lowest and highest level of the
+    bins in each column. This bounds the number of points by the number of
+    pixel columns the histogram is drawn on.
+    """
+    if columns is not None and levels.size > columns:
+        centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+        column = np.minimum((centers * columns).astype(int), columns - 1)
+        # Bins are sorted, so each column is a run of bins
+        starts = np.flatnonzero(np.concatenate([[True],
+                                                column[1:] != column[:-1]]))
+        lows = np.minimum.reduceat(levels, starts)
+        highs = np.maximum.reduceat(levels, starts)
+        x = np.repeat((column[starts] + 0.5) / columns, 2)
+        y = np.column_stack([lows, highs]).ravel()
+        return np.column_stack([x, y])
+
+    x = np.concatenate([bin_edges[:1],
+                        np.repeat(bin_edges[1:-1], 2),
+                        bin_edges[-1:]])
+    y = np.repeat(levels, 2)
+    return np.column_stack([x, y])
+
+
+class _ComponentIndex(object):
+    """ Components sorted by the left edge of their bounds, for finding the
+    components near a point or a range without checking all of them. Moving
+    a component only updates its own entry.
+    """
+
+    def __init__(self, components):
+        # Later components are on top
+        self.components = list(components)
+        self.ranks = dict((c, rank) for rank, c in enumerate(components))
+        self.lefts = dict((c, c.outer_position[0]) for c in components)
+        self.entries = sorted((self.lefts[c], self.ranks[c])
+                              for c in components)
+        # Never less than the widest component
+        self.max_width = max([c.outer_bounds[0] for c in components] + [0])
+
+    def candidates(self, low, high, topmost_first=True):
+        """ The components whose bounds might overlap [low, high] along x.
+        """
+        start = bisect_left(self.entries, (low - self.max_width,))
+        stop = bisect_right(self.entries, (high, len(self.components)))
+        ranks = sorted((rank for _, rank in self.entries[start:stop]),
+                       reverse=topmost_first)
+        return [self.components[rank] for rank in ranks]
+
+    def update(self, component):
+        """ Move the entry of a component which was moved or resized.
+        """
+        rank = self.ranks[component]
+        del self.entries[bisect_left(self.entries,
+                                     (self.lefts[component], rank))]
+        left = component.outer_position[0]
+        self.lefts[component] = left
+        insort(self.entries, (left, rank))
+        self.max_width = max(self.max_width, component.outer_bounds[0])
+
+
 class BaseCtfEditorAction(Action):
     container = Instance(Container)
     screen_to_function = Callable
@@ -105,6 +194,16 @@ class CtfEditor(Container):
     # The color to use when drawing the histogram
     histogram_color = ColorTrait('gray')
 
+    # If True, find the components under the mouse with an index of their
+    # positions instead of checking each of them, and reposition them once
+    # per layout instead of on every resize. For functions with many nodes.
+    use_spatial_index = Bool(False)
+
+    # If True, draw the nodes of the function with a few batched path calls
+    # instead of letting each component draw itself. For functions with many
+    # nodes.
+    batch_glyphs = Bool(False)
+
     # Add some padding to allow mouse interaction near the edge more pleasant.
     padding_left = 5
     padding_bottom = 5
@@ -112,10 +211,42 @@ class CtfEditor(Container):
     padding_right = 5
     fill_padding = True
 
+    # The (bin_edges, levels) of the histogram, from `log_histogram`
+    _histogram_levels = Any
+
+    # The outline of the histogram at the size of the editor. Computed when
+    # it is first drawn.
+    _histogram_points = Any
+
+    # The stops of the color bar gradient. Computed when it is first drawn.
+    _gradient_stops = Any
+
+    # The index of the components, from `_ComponentIndex`. Built when it is
+    # first used after the components moved.
+    _component_index = Any
+
+    # Were the components not repositioned since the editor was resized?
+    _components_stale = Bool(False)
+
     # -----------------------------------------------------------------------
     # Public interface
     # -----------------------------------------------------------------------
 
+    def components_at(self, x, y):
+        """ Return the components under a point, topmost first.
+        """
+        if not self.use_spatial_index:
+            return super(CtfEditor, self).components_at(x, y)
+
+        if not self.is_in(x, y):
+            return []
+
+        x -= self.position[0]
+        y -= self.position[1]
+        return [component
+                for component in self._get_component_index().candidates(x, x)
+                if component.is_in(x, y)]
+
     def add_function_component(self, component):
         self.add(component)
         component.add_function_nodes(self.function)
@@ -154,9 +285,24 @@ class CtfEditor(Container):
 
     def _bounds_changed(self, old, new):
         super(CtfEditor, self)._bounds_changed(old, new)
-        for child in self.components:
-            if isinstance(child, FunctionComponent):
-                child.parent_changed(self)
+        self._histogram_points = None
+        if self.use_spatial_index:
+            # Repositioned by the next layout
+            self._components_stale = True
+        else:
+            self._reposition_components()
+
+    @on_trait_change('_components,_components_items')
+    def _components_updated(self):
+        self._component_index = None
+
+    def _component_bounds_changed(self, component):
+        super(CtfEditor, self)._component_bounds_changed(component)
+        self._update_component_index(component)
+
+    def _component_position_changed(self, component):
+        super(CtfEditor, self)._component_position_changed(component)
+        self._update_component_index(component)
 
     def _function_changed(self, new):
         for child in self.components[:]:
@@ -172,15 +318,51 @@ class CtfEditor(Container):
     def _function_updated(self):
         self.request_redraw()
 
-    def _histogram_changed(self):
+    @on_trait_change('function.color._nodes.[center,radius,color]')
+    def _color_function_changed(self):
+        self._gradient_stops = None
+
+    def _batch_glyphs_changed(self):
+        self.request_redraw()
+
+    def _histogram_changed(self, histogram):
+        self._histogram_levels = None
+        if histogram is not None:
+            self._histogram_levels = log_histogram(*histogram)
+        self._histogram_points = None
         self.request_redraw()
 
     # -----------------------------------------------------------------------
     # Drawing
     # -----------------------------------------------------------------------
 
+    def _do_layout(self):
+        self._sync_components()
+
+    def _get_visible_components(self, bounds):
+        if self.batch_glyphs:
+            # The components are drawn by `_draw_glyphs`
+            return []
+        if not self.use_spatial_index or bounds is None:
+            return super(CtfEditor, self)._get_visible_components(bounds)
+
+        # Only check the components near the drawn bounds
+        x, _, width, _ = bounds
+        candidates = self._get_component_index().candidates(
+            x, x + width, topmost_first=False
+        )
+        return [component for component in candidates
+                if component.visible and
+                intersect_bounds(component.outer_position +
+                                 component.outer_bounds,
+                                 bounds) != empty_rectangle]
+
+    def _draw_container_overlay(self, gc, view_bounds=None, mode='normal'):
+        if self.batch_glyphs:
+            self._draw_glyphs(gc)
+        super(CtfEditor, self)._draw_container_overlay(gc, view_bounds, mode)
+
     def _draw_container_mainlayer(self, gc, *args, **kwargs):
-        color_nodes = self.function.color.values()
         alpha_nodes = self.function.opacity.values()
 
         gc.clear()
@@ -189,8 +371,8 @@ class CtfEditor(Container):
             # Move the origin to the lower left padding.
             gc.translate_ctm(self.padding_left, self.padding_bottom)
 
-            self._draw_colors(color_nodes, gc)
-            if self.histogram is not None:
+            self._draw_colors(gc)
+            if self._histogram_levels is not None:
                 self._draw_histogram(gc)
             self._draw_alpha(alpha_nodes, gc)
 
@@ -206,40 +388,61 @@ class CtfEditor(Container):
             gc.lines(points)
             gc.stroke_path()
 
-    def _draw_colors(self, color_nodes, gc):
+    def _draw_colors(self, gc):
         """ Draw the colorbar.
         """
         w, h = self.width, self.height
-        grad_stops = np.array([(x, r, g, b, 1.0)
-                               for x, r, g, b in color_nodes])
+        if self._gradient_stops is None:
+            color_nodes = self.function.color.values()
+            self._gradient_stops = np.array([(x, r, g, b, 1.0)
+                                             for x, r, g, b in color_nodes])
 
         with gc:
             gc.rect(0, 0, w, h)
 
-            gc.linear_gradient(0, 0, w, 0, grad_stops, *LINEAR_GRADIENT_ARGS)
+            gc.linear_gradient(0, 0, w, 0, self._gradient_stops,
+                               *LINEAR_GRADIENT_ARGS)
             gc.fill_path()
 
+    def _draw_glyphs(self, gc):
+        """ Draw the glyphs of all the function components, with one path for
+        each run of glyphs which share a fill color.
+        """
+        rects, colors = [], []
+        for child in self.components:
+            if isinstance(child, FunctionComponent):
+                for rect, color in child.glyphs():
+                    rects.append(rect)
+                    colors.append(color)
+        if len(rects) == 0:
+            return
+
+        rects = np.array(rects, dtype=float)
+        colors = np.array(colors, dtype=float)
+        # Split only where the color changes, so that overlapping glyphs
+        # stack in the order of the components.
+        changes = np.flatnonzero((colors[1:] != colors[:-1]).any(axis=1)) + 1
+        bounds = np.concatenate([[0], changes, [len(rects)]])
+
+        with gc:
+            gc.translate_ctm(*self.position)
+            gc.set_line_width(1.0)
+            gc.set_stroke_color(BLACK)
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                gc.set_fill_color(tuple(colors[start]))
+                gc.rects(rects[start:stop])
+                gc.draw_path()
+
     def _draw_histogram(self, gc):
         """ Draw the logarithm of the histogram.
         """
-        values, bin_edges = self.histogram
-        w, h = self.width, self.height
-        values = values.astype(float)
-        zeros = (values == 0)
-        min_nonzero = values[~zeros].min()
-        values[zeros] = min_nonzero / 2
-        log_values = np.log(values)
-        log_values -= log_values.min()
-        log_values /= log_values.max()
-
-        h_values = log_values * h
-        bin_edges = bin_edges - bin_edges.min()
-        bin_edges *= w / bin_edges.max()
-        x = np.concatenate([bin_edges[:1],
-                            np.repeat(bin_edges[1:-1], 2),
-                            bin_edges[-1:]])
-        y = np.repeat(h_values, 2)
-        points = np.column_stack([x, y])
+        if self._histogram_points is None:
+            # One pixel column per unit of width
+            columns = max(int(self.width), 1)
+            curve = histogram_curve(*self._histogram_levels, columns=columns)
+            scale = np.array([self.width, self.height], dtype=float)
+            self._histogram_points = curve * scale
+        points = self._histogram_points
 
         with gc:
             gc.set_line_width(1.0)
@@ -251,15 +454,38 @@ class CtfEditor(Container):
     # Private methods
     # -----------------------------------------------------------------------
 
-    def _add_components_for_new_function(self, function):
-        linked_colors, linked_opacities = [], []
-        if len(function.links) > 0:
-            linked_colors, linked_opacities = zip(*function.links)
+    def _get_component_index(self):
+        """ The up to date `_ComponentIndex` of the components.
+        """
+        self._sync_components()
+        if self._component_index is None:
+            self._component_index = _ComponentIndex(self._components)
+        return self._component_index
+
+    def _reposition_components(self):
+        self._components_stale = False
+        # Every component moves, so the index is rebuilt once instead
+        self._component_index = None
+        for child in self.components:
+            if isinstance(child, FunctionComponent):
+                child.parent_changed(self)
+
+    def _update_component_index(self, component):
+        index = self._component_index
+        if index is not None and component in index.ranks:
+            index.update(component)
 
+    def _sync_components(self):
+        """ Reposition the components if the editor was resized since.
+        """
+        if self._components_stale:
+            self._reposition_components()
+
+    def _add_components_for_new_function(self, function):
         for func in (function.color, function.opacity):
             last_index = func.size() - 1
             for idx, node in enumerate(func.nodes):
-                if node in linked_colors or node in linked_opacities:
+                if function.is_linked(node):
                     continue
                 component = FunctionComponent.from_function_nodes(node)
                 component._transfer_function = function
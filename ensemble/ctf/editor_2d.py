@@ -0,0 +1,173 @@
+from __future__ import division, unicode_literals
+
+import numpy as np
+
+from enable.api import ColorTrait, Component
+from traits.api import Any, Array, Enum, Instance, Tuple, on_trait_change
+
+from .transfer_function_2d import GradientRegion, TransferFunction2D
+from .utils import build_screen_to_function, clip_to_unit
+
+
+def histogram_image(counts):
+    """ Convert joint histogram counts into an RGBA image of log densities.
+
+    The first axis of `counts` is drawn horizontally and the second axis
+    vertically, with its first bin at the bottom.
+    """
+    log_counts = np.log1p(counts.astype(np.float32))
+    max_count = log_counts.max()
+    if max_count > 0:
+        log_counts /= max_count
+    gray = (log_counts.T[::-1] * 255).astype(np.uint8)
+    image = np.empty(gray.shape + (4,), dtype=np.uint8)
+    image[..., :3] = gray[..., np.newaxis]
+    image[..., 3] = 255
+    return image
+
+
+class CtfEditor2D(Component):
+    """ A widget for editing value x gradient magnitude transfer functions.
+
+    The horizontal axis is the data value and the vertical axis is the
+    gradient magnitude. Regions are drawn as rectangles over the joint
+    histogram of the data and can be dragged around.
+    """
+
+    # The function which is being edited
+    function = Instance(TransferFunction2D, ())
+
+    # Joint histogram counts with shape (value_bins, gradient_bins), if any
+    histogram = Array
+
+    # The color used to outline regions
+    outline_color = ColorTrait('white')
+
+    # Two states: idle, or dragging a region
+    event_state = Enum('normal', 'moving')
+
+    # The histogram as an image. Only rebuilt when the histogram changes.
+    _histogram_image = Any
+
+    # The region being dragged
+    _drag_region = Instance(GradientRegion)
+
+    # The relative position where the drag started
+    _drag_start = Tuple
+
+    # Add some padding to allow mouse interaction near the edge more pleasant.
+    padding_left = 5
+    padding_bottom = 5
+    padding_top = 5
+    padding_right = 5
+    fill_padding = True
+    bgcolor = 'black'
+
+    # -----------------------------------------------------------------------
+    # Public interface
+    # -----------------------------------------------------------------------
+
+    def region_at(self, x, y):
+        """ Return the topmost region containing the screen position (x, y),
+        or None.
+        """
+        rel_x, rel_y = self._screen_to_function(x, y)
+        for region in reversed(self.function.regions):
+            (v_low, v_high), (g_low, g_high) = (region.value_range,
+                                                region.gradient_range)
+            if v_low <= rel_x <= v_high and g_low <= rel_y <= g_high:
+                return region
+        return None
+
+    # -----------------------------------------------------------------------
+    # Traits notifications
+    # -----------------------------------------------------------------------
+
+    @on_trait_change('function:updated')
+    def _function_updated(self):
+        self.request_redraw()
+
+    def _function_changed(self):
+        self.request_redraw()
+
+    def _histogram_changed(self, new):
+        self._histogram_image = histogram_image(new) if new.size else None
+        self.request_redraw()
+
+    # -----------------------------------------------------------------------
+    # Enable event handlers
+    # -----------------------------------------------------------------------
+
+    def normal_left_down(self, event):
+        region = self.region_at(event.x, event.y)
+        if region is not None:
+            self._drag_region = region
+            self._drag_start = self._screen_to_function(event.x, event.y)
+            self.event_state = 'moving'
+            event.window.set_mouse_owner(self, event.net_transform())
+            event.handled = True
+
+    def moving_mouse_move(self, event):
+        region = self._drag_region
+        rel_x, rel_y = self._screen_to_function(event.x, event.y)
+        start_x, start_y = self._drag_start
+        dx = _clamp_delta(rel_x - start_x, region.value_range)
+        dy = _clamp_delta(rel_y - start_y, region.gradient_range)
+        region.value_range = tuple(v + dx for v in region.value_range)
+        region.gradient_range = tuple(g + dy for g in region.gradient_range)
+        self._drag_start = (start_x + dx, start_y + dy)
+        event.handled = True
+
+    def moving_left_up(self, event):
+        self.event_state = 'normal'
+        self._drag_region = None
+        event.window.set_mouse_owner(None)
+        event.handled = True
+
+    def moving_mouse_leave(self, event):
+        self.moving_left_up(event)
+
+    # -----------------------------------------------------------------------
+    # Drawing
+    # -----------------------------------------------------------------------
+
+    def _draw_mainlayer(self, gc, view_bounds=None, mode='default'):
+        with gc:
+            gc.translate_ctm(self.x, self.y)
+            if self._histogram_image is not None:
+                gc.draw_image(self._histogram_image,
+                              (0, 0, self.width, self.height))
+            self._draw_regions(gc)
+
+    def _draw_regions(self, gc):
+        """ Draw each region as a translucent, outlined rectangle.
+        """
+        w, h = self.width, self.height
+        with gc:
+            gc.set_line_width(1.0)
+            gc.set_stroke_color(self.outline_color_)
+            for region in self.function.regions:
+                (v_low, v_high), (g_low, g_high) = (region.value_range,
+                                                    region.gradient_range)
+                rect = (v_low * w, g_low * h,
+                        (v_high - v_low) * w, (g_high - g_low) * h)
+                gc.set_fill_color(region.color + (region.opacity * 0.5,))
+                gc.rect(*rect)
+                gc.draw_path()
+
+    # -----------------------------------------------------------------------
+    # Private methods
+    # -----------------------------------------------------------------------
+
+    def _screen_to_function(self, x, y):
+        func = build_screen_to_function(self)
+        return func((x - self.x, y - self.y))
+
+
+def _clamp_delta(delta, limits):
+    """ Limit `delta` so that the range `limits` stays inside [0, 1].
+    """
+    low, high = limits
+    if delta < 0:
+        return clip_to_unit(low + delta) - low
+    return min(delta, 1.0 - high)
@@ -57,6 +57,12 @@ class FunctionComponent(MovableComponent):
         factory = _function_component_class_registry[node.__class__]
         return factory.from_function_nodes(*nodes)
 
+    def glyphs(self):
+        """ Return the ((x, y, width, height), fill_color) rectangles which
+        `draw_contents` draws, in the coordinates of the parent.
+        """
+        raise NotImplementedError
+
     def node_limits(self, transfer_function):
         """ Compute the movement bounds of the function node.
         """
@@ -64,14 +64,13 @@ class OpacityComponent(FunctionComponent):
     def draw_contents(self, gc):
         """ Draw the component.
         """
-        x, y = self._get_screen_position()
+        rect, fill_color = self.glyphs()[0]
 
         with gc:
             gc.set_stroke_color(BLACK)
-            gc.set_fill_color(GRAY)
+            gc.set_fill_color(fill_color)
             gc.set_line_width(1.0)
-            gc.rect(x - COMPONENT_SIZE/2, y - COMPONENT_SIZE/2,
-                    COMPONENT_SIZE, COMPONENT_SIZE)
+            gc.rect(*rect)
             gc.draw_path()
 
     @classmethod
@@ -83,6 +82,14 @@ class OpacityComponent(FunctionComponent):
 
         return cls(node=nodes[0])
 
+    def glyphs(self):
+        """ Return the rectangles which `draw_contents` draws.
+        """
+        x, y = self._get_screen_position()
+        rect = (x - COMPONENT_SIZE/2, y - COMPONENT_SIZE/2,
+                COMPONENT_SIZE, COMPONENT_SIZE)
+        return [(rect, GRAY)]
+
     def move(self, delta_x, delta_y):
         """ Move the component.
         """
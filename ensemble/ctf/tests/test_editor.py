@@ -1,14 +1,17 @@
-from __future__ import unicode_literals
+from __future__ import division, unicode_literals
 import unittest
 
+import numpy as np
 import six
 
 from enable.testing import EnableTestAssistant
+from kiva.image import GraphicsContext
 from traits_enaml.testing.enaml_test_assistant import EnamlTestAssistant
 
-from ensemble.ctf.api import (CtfEditor, ColorNode, OpacityNode,
-                              WindowColorNode, WindowOpacityNode,
-                              WindowComponent)
+from ensemble.ctf.api import (CtfEditor, ColorNode, OpacityComponent,
+                              OpacityNode, TransferFunction, WindowColorNode,
+                              WindowOpacityNode, WindowComponent)
+from ensemble.ctf.editor import histogram_curve, log_histogram
 from ensemble.ctf.window_function_component import WindowTypeAction
 
 
@@ -122,5 +125,164 @@ enamldef MainView(MainWindow):
             action.perform(None)
 
 
+class TestEditorDrawing(unittest.TestCase):
+
+    def setUp(self):
+        self.editor = CtfEditor(bounds=(400, 100))
+        self.gc = GraphicsContext((410, 110))
+
+    def test_histogram_curve(self):
+        values = np.array([0, 1, 4])
+        bin_edges = np.array([10.0, 20.0, 30.0, 40.0])
+        points = histogram_curve(*log_histogram(values, bin_edges))
+
+        x = [0.0, 1/3, 1/3, 2/3, 2/3, 1.0]
+        y = [0.0, 0.0, 1/3, 1/3, 1.0, 1.0]
+        np.testing.assert_allclose(points, np.column_stack([x, y]))
+
+    def test_histogram_decimated_to_columns(self):
+        values = np.arange(1, 1001)
+        bin_edges, levels = log_histogram(values, np.arange(1001.0))
+        points = histogram_curve(bin_edges, levels, columns=100)
+
+        # The lowest and highest level of each column of 10 bins
+        self.assertEqual(points.shape, (200, 2))
+        np.testing.assert_allclose(points[::2, 1], levels[::10])
+        np.testing.assert_allclose(points[1::2, 1], levels[9::10])
+        np.testing.assert_allclose(points[::2, 0],
+                                   (np.arange(100) + 0.5) / 100)
+
+    def test_histogram_scaled_on_resize(self):
+        editor = self.editor
+        editor.histogram = (np.array([1, 2, 4]), np.arange(4.0))
+        editor.draw(self.gc)
+        points = editor._histogram_points
+        self.assertEqual(tuple(points.max(axis=0)), (400.0, 100.0))
+
+        # Redraws reuse the scaled points until the size changes
+        editor.draw(self.gc)
+        self.assertIs(editor._histogram_points, points)
+        editor.bounds = (200, 50)
+        editor.draw(self.gc)
+        self.assertEqual(tuple(editor._histogram_points.max(axis=0)),
+                         (200.0, 50.0))
+
+    def test_gradient_cached_until_colors_change(self):
+        editor = self.editor
+        editor.draw(self.gc)
+        stops = editor._gradient_stops
+        self.assertEqual(stops.shape, (2, 5))
+
+        editor.function.opacity.node_at(1).opacity = 0.5
+        editor.draw(self.gc)
+        self.assertIs(editor._gradient_stops, stops)
+
+        editor.function.color.insert(ColorNode(center=0.5,
+                                               color=(1.0, 0.0, 0.0)))
+        editor.draw(self.gc)
+        self.assertEqual(editor._gradient_stops.shape, (3, 5))
+
+    def test_batched_glyphs_match_components(self):
+        function = self.editor.function
+        function.color.insert(ColorNode(center=0.25, color=(1.0, 0.0, 0.0)))
+        function.opacity.insert(OpacityNode(center=0.5, opacity=0.5))
+        function.add_linked_nodes(
+            WindowColorNode(center=0.75, radius=0.05, color=(0.0, 1.0, 1.0)),
+            WindowOpacityNode(center=0.75, radius=0.05, opacity=0.5)
+        )
+        images = []
+        for batch_glyphs in (False, True):
+            editor = CtfEditor(bounds=(400, 100), batch_glyphs=batch_glyphs)
+            editor.function = function.copy()
+            gc = GraphicsContext((410, 110))
+            editor.draw(gc)
+            images.append(gc.bmp_array.copy())
+
+        np.testing.assert_array_equal(images[1], images[0])
+
+    def test_batched_glyphs_keep_stacking_order(self):
+        function = self.editor.function
+        # Overlapping color glyphs, where the last one shares the color of
+        # the first and has to stay on top of the middle one.
+        for center, color in ((0.5, (1.0, 0.0, 0.0)), (0.505, (0.0, 1.0, 0.0)),
+                              (0.51, (1.0, 0.0, 0.0))):
+            function.color.insert(ColorNode(center=center, color=color))
+        images = []
+        for batch_glyphs in (False, True):
+            editor = CtfEditor(bounds=(400, 100), batch_glyphs=batch_glyphs)
+            editor.function = function.copy()
+            gc = GraphicsContext((410, 110))
+            editor.draw(gc)
+            images.append(gc.bmp_array.copy())
+
+        np.testing.assert_array_equal(images[1], images[0])
+
+
+class TestEditorSpatialIndex(unittest.TestCase):
+
+    def setUp(self):
+        function = TransferFunction()
+        for center in np.linspace(0.05, 0.95, 50):
+            function.opacity.insert(OpacityNode(center=center, opacity=0.5))
+            function.color.insert(ColorNode(center=center,
+                                            color=(1.0, 0.0, 0.0)))
+        function.add_linked_nodes(
+            WindowColorNode(center=0.5, radius=0.1, color=(0.0, 1.0, 0.0)),
+            WindowOpacityNode(center=0.5, radius=0.1, opacity=0.7)
+        )
+        self.editors = []
+        for use_spatial_index in (False, True):
+            editor = CtfEditor(bounds=(400, 100),
+                               use_spatial_index=use_spatial_index)
+            editor.function = function.copy()
+            self.editors.append(editor)
+        self.gc = GraphicsContext((410, 110))
+
+    def _assert_same_components_at(self):
+        plain, indexed = self.editors
+        for x in np.linspace(0, 410, 83):
+            for y in np.linspace(0, 110, 23):
+                expected = [(type(c), c.position)
+                            for c in plain.components_at(x, y)]
+                found = [(type(c), c.position)
+                         for c in indexed.components_at(x, y)]
+                self.assertEqual(found, expected)
+
+    def test_components_at(self):
+        self._assert_same_components_at()
+
+    def test_components_at_after_changes(self):
+        for editor in self.editors:
+            editor.draw(self.gc)
+            editor.bounds = (300, 80)
+            node = editor.function.opacity.node_at(10)
+            component = [c for c in editor.components
+                         if getattr(c, 'node', None) is node][0]
+            component.move(25.0, 10.0)
+        self._assert_same_components_at()
+
+    def test_index_updated_for_moved_component(self):
+        indexed = self.editors[1]
+        indexed.components_at(0, 0)
+        index = indexed._component_index
+        for editor in self.editors:
+            component = [c for c in editor.components
+                         if isinstance(c, OpacityComponent)][10]
+            component.move(-40.0, 0.0)
+
+        # Only the entry of the moved component changed
+        self.assertIs(indexed._component_index, index)
+        self._assert_same_components_at()
+
+    def test_visible_components(self):
+        plain, indexed = self.editors
+        for bounds in [(0, 0, 410, 110), (100, 0, 30, 110), (405, 0, 5, 5)]:
+            expected = [(type(c), c.position)
+                        for c in plain._get_visible_components(bounds)]
+            found = [(type(c), c.position)
+                     for c in indexed._get_visible_components(bounds)]
+            self.assertEqual(found, expected)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,80 @@
+from __future__ import division, unicode_literals
+import unittest
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+
+from enable.testing import EnableTestAssistant
+from kiva.image import GraphicsContext
+
+from ensemble.ctf.api import CtfEditor2D, TransferFunction2D
+from ensemble.ctf.editor_2d import histogram_image
+from ensemble.ctf.transfer_function_2d import GradientRegion
+
+
+class TestHistogramImage(unittest.TestCase):
+
+    def test_axes(self):
+        counts = np.array([[0, 1], [3, 0], [0, 0]])
+        image = histogram_image(counts)
+
+        # Values run left to right and gradients bottom to top
+        self.assertEqual(image.shape, (2, 3, 4))
+        self.assertEqual(image.dtype, np.uint8)
+        assert_array_equal(image[..., 3], 255)
+        assert_array_equal(image[..., 0], [[127, 0, 0], [0, 255, 0]])
+        assert_array_equal(image[..., 0], image[..., 2])
+
+    def test_empty_counts(self):
+        image = histogram_image(np.zeros((4, 2), dtype=int))
+        assert_array_equal(image[..., :3], 0)
+
+
+class TestEditor2D(EnableTestAssistant, unittest.TestCase):
+
+    def setUp(self):
+        self.editor = CtfEditor2D(bounds=(200, 100))
+        self.editor.function = TransferFunction2D(regions=[
+            GradientRegion(value_range=(0.0, 0.5), gradient_range=(0.0, 0.5)),
+            GradientRegion(value_range=(0.25, 0.75),
+                           gradient_range=(0.25, 0.75)),
+        ])
+
+    def test_region_at(self):
+        editor = self.editor
+        first, second = editor.function.regions
+
+        self.assertIs(editor.region_at(25, 15), first)
+        # The later region is on top
+        self.assertIs(editor.region_at(65, 45), second)
+        self.assertIsNone(editor.region_at(190, 90))
+
+    def test_drag_region(self):
+        region = self.editor.function.regions[0]
+        self.press_move_release(self.editor,
+                                [(25, 15), (45, 25), (45, 25)])
+        assert_allclose(region.value_range, (0.1, 0.6))
+        assert_allclose(region.gradient_range, (0.1, 0.6))
+
+        # The region stays inside the unit square
+        self.press_move_release(self.editor,
+                                [(45, 25), (195, 95), (195, 95)])
+        assert_allclose(region.value_range, (0.5, 1.0))
+        assert_allclose(region.gradient_range, (0.5, 1.0))
+        self.assertEqual(self.editor.event_state, 'normal')
+
+    def test_histogram_image_cached(self):
+        editor = self.editor
+        editor.histogram = np.arange(6).reshape(3, 2)
+        self.assertEqual(editor._histogram_image.shape, (2, 3, 4))
+
+        gc = GraphicsContext((210, 110))
+        editor.draw(gc)
+
+        editor.histogram = np.empty((0, 0))
+        self.assertIsNone(editor._histogram_image)
+        editor.draw(gc)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import pytest
+
+from ensemble.ctf.api import (ColorNode, OpacityNode, TransferFunction,
+                              WindowColorNode, WindowOpacityNode)
+
+
+def _linked_function():
+    function = TransferFunction()
+    function.color.insert(ColorNode(center=0.2, color=(1.0, 0.0, 0.0)))
+    function.opacity.insert(OpacityNode(center=0.7, opacity=0.5))
+    pairs = []
+    for center in (0.8, 0.4, 0.6):
+        pair = (WindowColorNode(center=center, radius=0.05,
+                                color=(0.0, 1.0, center)),
+                WindowOpacityNode(center=center, radius=0.05, opacity=center))
+        function.add_linked_nodes(*pair)
+        pairs.append(pair)
+
+    return function, pairs
+
+
+def test_links_in_order_added():
+    function, pairs = _linked_function()
+
+    assert function.links == pairs
+    assert function.linked_indices == [(4, 4), (2, 1), (3, 2)]
+    for c_node, o_node in pairs:
+        assert function.is_linked(c_node) and function.is_linked(o_node)
+    assert not function.is_linked(function.color.node_at(1))
+
+
+def test_remove_linked_nodes():
+    function, pairs = _linked_function()
+
+    function.remove_linked_nodes(*pairs[1])
+    assert function.links == [pairs[0], pairs[2]]
+    assert function.linked_indices == [(3, 3), (2, 1)]
+    assert not function.is_linked(pairs[1][0])
+
+    # The nodes of different links are not linked with each other
+    with pytest.raises(ValueError):
+        function.remove_linked_nodes(pairs[0][0], pairs[2][1])
+    assert function.links == [pairs[0], pairs[2]]
+
+
+def test_serialization_round_trip():
+    function, _ = _linked_function()
+    dictionary = function.to_dict()
+    assert dictionary['links'] == [(4, 4), (2, 1), (3, 2)]
+
+    for other in (TransferFunction.from_dict(dictionary), function.copy()):
+        assert other.to_dict() == dictionary
+        for c_node, o_node in other.links:
+            assert c_node in other.color.nodes
+            assert o_node in other.opacity.nodes
+            assert other.is_linked(c_node) and other.is_linked(o_node)
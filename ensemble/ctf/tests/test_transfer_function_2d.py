@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+from traits.testing.unittest_tools import UnittestTools
+
+from ensemble.ctf.transfer_function_2d import (GradientRegion,
+                                               TransferFunction2D)
+
+
+class TestTransferFunction2D(UnittestTools, unittest.TestCase):
+
+    def setUp(self):
+        self.function = TransferFunction2D(regions=[
+            GradientRegion(value_range=(0.0, 0.5), gradient_range=(0.5, 1.0),
+                           color=(1.0, 0.0, 0.0), opacity=1.0),
+            GradientRegion(value_range=(0.25, 1.0), gradient_range=(0.0, 1.0),
+                           color=(0.0, 0.0, 1.0), opacity=0.5),
+        ])
+
+    def test_lookup_table(self):
+        axis = np.linspace(0.0, 1.0, 5)
+        table = self.function.lookup_table(axis, axis)
+
+        self.assertEqual(table.shape, (5, 5, 4))
+        self.assertEqual(table.dtype, np.float32)
+        # Outside of every region
+        assert_array_equal(table[0, 0], [0, 0, 0, 0])
+        # Only the first region
+        assert_array_equal(table[0, 4], [1, 0, 0, 1])
+        # Only the second region
+        assert_allclose(table[4, 0], [0, 0, 0.5, 0.5])
+        # The second region composited over the first
+        assert_allclose(table[1, 4], [0.5, 0, 0.5, 1.0])
+
+    def test_updated_fires(self):
+        with self.assertTraitChanges(self.function, 'updated'):
+            self.function.regions[0].opacity = 0.25
+        with self.assertTraitChanges(self.function, 'updated'):
+            self.function.regions.append(GradientRegion())
+
+    def test_dict_roundtrip(self):
+        function = TransferFunction2D.from_dict(self.function.to_dict())
+        self.assertEqual(function.to_dict(), self.function.to_dict())
+
+        copied = self.function.copy()
+        self.assertIsNot(copied.regions[0], self.function.regions[0])
+        self.assertEqual(copied.to_dict(), self.function.to_dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,7 @@ import unittest
 import numpy as np
 from numpy.testing import assert_array_equal
 
-from ensemble.ctf.utils import trapezoid_window
+from ensemble.ctf.utils import joint_histogram, trapezoid_window
 
 
 class TestTrapezoidWindow(unittest.TestCase):
@@ -21,3 +21,58 @@ class TestTrapezoidWindow(unittest.TestCase):
         assert_array_equal(window_center, np.ones((3)))
         self.assertEqual(window_start, 0)
         self.assertEqual(window_stop, 0)
+
+
+class TestJointHistogram(unittest.TestCase):
+
+    def test_matches_histogram2d(self):
+        values = np.random.uniform(0, 10, size=(8, 8, 8))
+        gradients = np.random.uniform(0, 3, size=(8, 8, 8))
+        counts, ranges = joint_histogram(values, gradients, bins=(16, 8))
+
+        expected, _, _ = np.histogram2d(values.ravel(), gradients.ravel(),
+                                        bins=(16, 8), range=ranges)
+        assert_array_equal(counts, expected)
+
+    def test_ignores_points_outside_ranges(self):
+        values = np.array([-1.0, 0.0, 0.5, 1.0, 2.0])
+        gradients = np.zeros(5)
+        ranges = ((0.0, 1.0), (0.0, 1.0))
+        counts, _ = joint_histogram(values, gradients, bins=(2, 1),
+                                    ranges=ranges)
+        assert_array_equal(counts, [[1], [2]])
+
+    def test_ignores_points_just_outside_ranges(self):
+        # Less than a bin outside of each end of the ranges
+        values = np.array([-0.05, 0.05, 0.95, 1.05])
+        gradients = np.array([0.5, -0.05, 1.05, 0.5])
+        ranges = ((0.0, 1.0), (0.0, 1.0))
+        counts, _ = joint_histogram(values, gradients, bins=(10, 10),
+                                    ranges=ranges)
+        self.assertEqual(counts.sum(), 0)
+
+        counts, _ = joint_histogram(values, np.full(4, 0.5), bins=(10, 10),
+                                    ranges=ranges)
+        self.assertEqual(counts.sum(), 2)
+        self.assertEqual(counts[0, 5], 1)
+        self.assertEqual(counts[9, 5], 1)
+
+    def test_single_value_range(self):
+        values = np.array([0.5, 1.0, 1.0, 2.0])
+        gradients = np.zeros(4)
+        counts, ranges = joint_histogram(values, gradients, bins=(4, 2),
+                                         ranges=((1.0, 1.0), (0.0, 0.0)))
+        # Only the points at the single value are counted
+        self.assertEqual(counts.sum(), 2)
+        self.assertEqual(counts[0, 0], 2)
+        self.assertGreater(ranges[0][1], 1.0)
+        self.assertGreater(ranges[1][1], 0.0)
+
+        # Constant data spans a single value as well
+        counts, _ = joint_histogram(np.full(4, 3.0), gradients, bins=(4, 2))
+        self.assertEqual(counts[0, 0], 4)
+
+    def test_reversed_range(self):
+        with self.assertRaises(ValueError):
+            joint_histogram(np.zeros(4), np.zeros(4),
+                            ranges=((1.0, 0.0), (0.0, 1.0)))
@@ -1,5 +1,8 @@
 from __future__ import unicode_literals
-from traits.api import HasStrictTraits, Event, Instance, List, Property
+from collections import OrderedDict
+
+from traits.api import (HasStrictTraits, Dict, Event, Instance, List,
+                        Property)
 
 from .piecewise import PiecewiseFunction
 
@@ -40,11 +43,21 @@ class TransferFunction(HasStrictTraits):
     linked_indices = Property(List, depends_on=['links', 'color', 'opacity'])
 
     # The nodes in `color` and `opacity` which exist as a pair.
-    links = List
+    links = Property(List, depends_on='_links_updated')
 
     # An event that should fire when the function is updated
     updated = Event
 
+    # The links in the order they were added, as the keys of an ordered dict
+    # so that a single link is removed in constant time.
+    _links = Instance(OrderedDict, ())
+
+    # Fired when `_links` is modified in place
+    _links_updated = Event
+
+    # The link containing each node in `links`
+    _link_table = Dict
+
     # -----------------------------------------------------------------------
     # Public interface
     # -----------------------------------------------------------------------
@@ -53,14 +66,28 @@ class TransferFunction(HasStrictTraits):
         self.color.insert(color_node)
         self.opacity.insert(opacity_node)
 
-        self.links.append(_get_link(color_node, opacity_node))
+        link = _get_link(color_node, opacity_node)
+        self._links[link] = None
+        self._add_to_link_table(link)
+        self._links_updated = True
 
     def remove_linked_nodes(self, color_node, opacity_node):
+        link = self._link_table.get(color_node)
+        if link != _get_link(color_node, opacity_node):
+            raise ValueError("Nodes are not linked.")
+
         self.color.remove(color_node)
         self.opacity.remove(opacity_node)
 
-        link = _get_link(color_node, opacity_node)
-        self.links.remove(link)
+        del self._links[link]
+        for node in link:
+            del self._link_table[node]
+        self._links_updated = True
+
+    def is_linked(self, node):
+        """ Is `node` one of a pair of linked nodes?
+        """
+        return node in self._link_table
 
     def copy(self):
         cls = type(self)
@@ -107,10 +134,31 @@ class TransferFunction(HasStrictTraits):
         return PiecewiseFunction.from_dict(OPACITY_DEFAULT)
 
     def _get_linked_indices(self):
-        return [(self.color.index_of(c), self.opacity.index_of(o))
-                for c, o in self.links]
+        # Index the nodes once instead of searching them for every link
+        color_indices = {node: i for i, node in enumerate(self.color.nodes)}
+        opacity_indices = {node: i
+                           for i, node in enumerate(self.opacity.nodes)}
+        return [(color_indices[c], opacity_indices[o]) for c, o in self.links]
+
+    def _get_links(self):
+        return list(self._links)
+
+    def _set_links(self, links):
+        self._links = OrderedDict((link, None) for link in links)
+        self._link_table = {}
+        for link in self._links:
+            self._add_to_link_table(link)
+        self._links_updated = True
 
     def _set_linked_indices(self, indices):
         color, opacity = self.color, self.opacity
         self.links = [(color.node_at(c_idx), opacity.node_at(o_idx))
                       for c_idx, o_idx in indices]
+
+    # -----------------------------------------------------------------------
+    # Private methods
+    # -----------------------------------------------------------------------
+
+    def _add_to_link_table(self, link):
+        for node in link:
+            self._link_table[node] = link
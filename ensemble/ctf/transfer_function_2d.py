@@ -0,0 +1,127 @@
+from __future__ import unicode_literals
+
+import numpy as np
+from traits.api import (HasStrictTraits, Event, Float, Instance, List, Range,
+                        Tuple, on_trait_change)
+
+# Convenience for the trait definitions below
+UnitPair = Tuple(Float(0.0), Float(1.0))
+
+
+class GradientRegion(HasStrictTraits):
+    """ A rectangle in (value, gradient magnitude) space with a single color
+    and opacity. Both axes use relative coordinates in [0, 1].
+    """
+
+    # The (low, high) data values covered by the region
+    value_range = UnitPair
+
+    # The (low, high) gradient magnitudes covered by the region
+    gradient_range = UnitPair
+
+    # The color of the region
+    color = Tuple(Float(1.0), Float(1.0), Float(1.0))
+
+    # The opacity of the region
+    opacity = Range(0.0, 1.0, value=1.0)
+
+    def copy(self):
+        """ Return a copy of this region.
+        """
+        return self.from_dict(self.to_dict())
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        """ Create an instance from the data in `dictionary`.
+        """
+        return cls(value_range=tuple(dictionary['value_range']),
+                   gradient_range=tuple(dictionary['gradient_range']),
+                   color=tuple(dictionary['color']),
+                   opacity=dictionary['opacity'])
+
+    def to_dict(self):
+        """ Create a dictionary which represents the state of the region.
+        """
+        return {
+            'value_range': self.value_range,
+            'gradient_range': self.gradient_range,
+            'color': self.color,
+            'opacity': self.opacity,
+        }
+
+
+class TransferFunction2D(HasStrictTraits):
+    """ A transfer function over data value and gradient magnitude, made of
+    rectangular regions. Later regions are composited over earlier ones.
+    """
+
+    # The regions of the function
+    regions = List(Instance(GradientRegion))
+
+    # An event that should fire when the function is updated
+    updated = Event
+
+    # -----------------------------------------------------------------------
+    # Public interface
+    # -----------------------------------------------------------------------
+
+    def copy(self):
+        cls = type(self)
+        return cls(regions=[r.copy() for r in self.regions])
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        """ Load a function from a dict.
+        """
+        region_dicts = dictionary.get('regions', [])
+        return cls(regions=[GradientRegion.from_dict(rd)
+                            for rd in region_dicts])
+
+    def lookup_table(self, values, gradients):
+        """ Evaluate the function on a grid.
+
+        Parameters
+        ----------
+        values : 1D array
+            Relative data values at which to evaluate the function.
+        gradients : 1D array
+            Relative gradient magnitudes at which to evaluate the function.
+
+        Returns
+        -------
+        table : array
+            Float32 RGBA values with shape (len(values), len(gradients), 4).
+        """
+        values = np.asarray(values, dtype=float)
+        gradients = np.asarray(gradients, dtype=float)
+        table = np.zeros((values.size, gradients.size, 4), dtype=np.float32)
+        for region in self.regions:
+            v_low, v_high = region.value_range
+            g_low, g_high = region.gradient_range
+            v_mask = (values >= v_low) & (values <= v_high)
+            g_mask = (gradients >= g_low) & (gradients <= g_high)
+            if not (v_mask.any() and g_mask.any()):
+                continue
+
+            # Regions are axis aligned, so they cover a sub-grid of the table
+            block = table[np.ix_(v_mask, g_mask)]
+            alpha = region.opacity
+            block[..., :3] = (np.array(region.color) * alpha +
+                              block[..., :3] * (1.0 - alpha))
+            block[..., 3] = alpha + block[..., 3] * (1.0 - alpha)
+            table[np.ix_(v_mask, g_mask)] = block
+        return table
+
+    def to_dict(self):
+        """ Flatten the function into a dictionary.
+        """
+        return {'regions': [region.to_dict() for region in self.regions]}
+
+    # -----------------------------------------------------------------------
+    # Traits
+    # -----------------------------------------------------------------------
+
+    @on_trait_change('regions,regions_items,'
+                     'regions:[value_range,gradient_range,color,opacity]')
+    def _regions_changed(self):
+        self.updated = True
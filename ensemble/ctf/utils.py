@@ -24,6 +24,71 @@ def clip(value, limits):
     return min(max(value, v_min), v_max)
 
 
+def joint_histogram(values, gradients, bins=(256, 128), ranges=None):
+    """ Compute the 2D histogram of data values and gradient magnitudes.
+
+    Unlike ``np.histogram2d``, this makes a single ``np.bincount`` pass over
+    the data and does not sort it.
+
+    Parameters
+    ----------
+    values : array
+        The data values.
+    gradients : array
+        The gradient magnitudes. Must have the same shape as `values`.
+    bins : tuple
+        The number of (value, gradient) bins.
+    ranges : tuple, optional
+        ((value_min, value_max), (gradient_min, gradient_max)). Defaults to
+        the extent of each input. Points outside of the ranges are ignored.
+        A range holding a single value is widened by a small epsilon, so
+        that only that value is counted, in the first bin.
+
+    Returns
+    -------
+    counts : array
+        Integer counts with shape `bins`.
+    ranges : tuple
+        The ranges covered by the histogram.
+    """
+    values = np.asarray(values).ravel(order='K')
+    gradients = np.asarray(gradients).ravel(order='K')
+    if ranges is None:
+        ranges = ((values.min(), values.max()),
+                  (gradients.min(), gradients.max()))
+
+    ranges = tuple(_histogram_range(limits, num_bins)
+                   for limits, num_bins in zip(ranges, bins))
+
+    indices = []
+    keep = np.ones(values.shape, dtype=bool)
+    for data, num_bins, (low, high) in zip((values, gradients), bins, ranges):
+        scale = num_bins / (high - low)
+        # Floor, so that values less than a bin below `low` are dropped
+        index = np.floor((data - low) * scale).astype(np.intp)
+        # Values equal to the upper limit go into the last bin
+        index[data == high] = num_bins - 1
+        keep &= (index >= 0) & (index < num_bins)
+        indices.append(index)
+
+    flat_index = indices[0] * bins[1] + indices[1]
+    if not keep.all():
+        flat_index = flat_index[keep]
+    counts = np.bincount(flat_index, minlength=bins[0] * bins[1])
+    return counts.reshape(bins), ranges
+
+
+def _histogram_range(limits, num_bins):
+    low, high = limits
+    if high < low:
+        raise ValueError("Histogram range ({}, {}) is reversed.".format(
+            low, high))
+    if high == low:
+        eps = np.finfo(np.float64).eps
+        high = low + max(abs(low), 1.0) * eps * num_bins
+    return (low, high)
+
+
 def load_ctf(filename):
     """ Load a TransferFunction from a file.
     """
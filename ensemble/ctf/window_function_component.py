@@ -191,6 +191,15 @@ class WindowComponent(BaseColorComponent):
 
         return cls(node=color_node, opacity_node=opacity_node)
 
+    def glyphs(self):
+        """ Return the rectangles which are drawn for the component, which
+        are those of its opacity widget.
+        """
+        x, y = self.position
+        widget_x, widget_y = self.opacity_widget.position
+        width, height = self.opacity_widget.bounds
+        return [((x + widget_x, y + widget_y, width, height), GRAY)]
+
     def move(self, delta_x, delta_y):
         """ Move the component.
         """
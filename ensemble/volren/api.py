@@ -1,8 +1,23 @@
+from .batch_renderer import (  # noqa
+    BatchRenderer, make_render_job, render_image
+)
+from .frame_capture import (  # noqa
+    FrameCapture, FrameWriter, camera_state, keyframe_path, turntable_path
+)
+from .reformat import (  # noqa
+    Reformatter, plane_axes, resample_polyline, trilinear_sample
+)
+from .render_server import (  # noqa
+    ABCRenderTarget, RenderClient, RenderServer, ViewerRenderTarget
+)
+from .slice_cache import SliceCache  # noqa
 from .volume_3d import Volume3D, volume3d  # noqa
 from .volume_axes import VolumeAxes  # noqa
 from .volume_bounding_box import VolumeBoundingBox  # noqa
 from .volume_cut_planes import VolumeCutPlanes  # noqa
 from .volume_data import VolumeData  # noqa
+from .volume_mask import ABCVolumeMask, BitMask, LabelMask  # noqa
 from .volume_renderer import VolumeRenderer  # noqa
 from .volume_scene_member import ABCVolumeSceneMember  # noqa
+from .volume_time_series import VolumeTimeSeries  # noqa
 from .volume_viewer import VolumeViewer  # noqa
@@ -0,0 +1,238 @@
+from __future__ import division, unicode_literals
+
+import multiprocessing
+
+import numpy as np
+import six
+from traits.api import HasStrictTraits, Any, Int, Tuple
+from tvtk.api import tvtk
+from tvtk.common import configure_input_data
+
+from ensemble.ctf.api import TransferFunction
+from .volume_data import VolumeData
+from .volume_renderer import (QUALITY_SETTINGS, apply_render_quality,
+                              build_transfer_functions)
+
+# The default (azimuth, elevation) view, matching `VolumeViewer`
+DEFAULT_VIEW = {'azimuth': 40.0, 'elevation': 80.0}
+
+# The render context of a worker process. Built once per process by
+# `_init_worker` and kept warm between jobs.
+_CONTEXT = {}
+
+
+def make_render_job(volume, transfer_function, camera=None,
+                    quality='default', size=(256, 256), spacing=None,
+                    volume_key=None):
+    """ Describe one image for `BatchRenderer.render`.
+
+    Parameters
+    ----------
+    volume : array or str
+        The volume to render, or the path of a ``.npy`` file which the
+        worker memory maps. Paths avoid sending the volume to the worker.
+    transfer_function : TransferFunction
+        The colors and opacities of the rendering.
+    camera : dict, optional
+        Either a camera state with 'position', 'focal_point' and 'view_up'
+        keys, or an 'azimuth' and 'elevation' in degrees, as for
+        ``mlab.view``.
+    quality : str
+        One of the keys of `QUALITY_SETTINGS`.
+    size : tuple
+        The (width, height) of the image.
+    spacing : tuple, optional
+        The spacing between grid points in each dimension.
+    volume_key : hashable, optional
+        Identifies the volume. Consecutive jobs with the same key which go to
+        the same worker reuse its prepared render data. Defaults to the path
+        of `volume`, if it is one.
+    """
+    if quality not in QUALITY_SETTINGS:
+        raise ValueError('Unknown render quality: {}'.format(quality))
+
+    if volume_key is None and isinstance(volume, six.string_types):
+        volume_key = volume
+    return {
+        'volume': volume,
+        'volume_key': volume_key,
+        'spacing': spacing,
+        'transfer_function': transfer_function.to_dict(),
+        'camera': DEFAULT_VIEW if camera is None else camera,
+        'quality': quality,
+        'size': tuple(size),
+    }
+
+
+def render_image(job):
+    """ Render a job from `make_render_job` with this process's offscreen
+    render context. Returns an RGB image of shape (height, width, 3).
+    """
+    if not _CONTEXT:
+        _init_worker()
+
+    renderer = _CONTEXT['renderer']
+    render_window = _CONTEXT['render_window']
+    mapper = _CONTEXT['mapper']
+    volume_property = _CONTEXT['volume_property']
+
+    volume_data, vmin, vmax = _volume_for_job(job)
+
+    def lerp(x):
+        return volume_data.render_values(vmin + x * (vmax - vmin))
+
+    function = TransferFunction.from_dict(job['transfer_function'])
+    color_tf, opacity_tf, _ = build_transfer_functions(
+        function.color, function.opacity, lerp
+    )
+    volume_property.set_color(color_tf)
+    volume_property.set_scalar_opacity(opacity_tf)
+    apply_render_quality(mapper, volume_property, job['quality'])
+
+    render_window.size = job['size']
+    _set_camera(renderer, job['camera'])
+    render_window.render()
+
+    image_filter = _CONTEXT['image_filter']
+    image_filter.modified()
+    image_filter.update()
+    image_data = image_filter.output
+    x, y, _ = image_data.dimensions
+    data = image_data.point_data.scalars.to_array().reshape(y, x, 3)
+    # VTK images start with the bottom row.
+    return np.flipud(data).copy()
+
+
+class BatchRenderer(HasStrictTraits):
+    """ Renders many volume images in parallel, without a GUI.
+
+    Each worker process keeps an offscreen render window, a volume mapper and
+    the most recently prepared volume between jobs.
+    """
+
+    # The number of worker processes. Defaults to the number of CPUs.
+    num_workers = Int
+
+    # The initial (width, height) of the workers' render windows
+    window_size = Tuple(Int(256), Int(256))
+
+    # The worker pool
+    _pool = Any
+
+    # -------------------------------------------------------------------------
+    # Public interface
+    # -------------------------------------------------------------------------
+
+    def close(self):
+        """ Shut down the worker processes.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def render(self, jobs):
+        """ Render jobs from `make_render_job`.
+
+        Yields (index, image) pairs as soon as each image is done, which is
+        not necessarily in the order of `jobs`.
+        """
+        if self._pool is None:
+            # Forked workers would share any OpenGL state of this process, so
+            # start fresh interpreters where possible.
+            context = multiprocessing
+            if hasattr(multiprocessing, 'get_context'):
+                context = multiprocessing.get_context('spawn')
+            self._pool = context.Pool(
+                self.num_workers, initializer=_init_worker,
+                initargs=(self.window_size,)
+            )
+
+        # Keep jobs with the same volume together, so that workers can reuse
+        # their prepared render data.
+        indexed_jobs = sorted(enumerate(jobs),
+                              key=lambda item: _sort_key(item[1]))
+        for result in self._pool.imap_unordered(_render_indexed_image,
+                                                indexed_jobs):
+            yield result
+
+    # -------------------------------------------------------------------------
+    # Traits handlers
+    # -------------------------------------------------------------------------
+
+    def _num_workers_default(self):
+        return multiprocessing.cpu_count()
+
+
+# -----------------------------------------------------------------------------
+# Worker functions
+# -----------------------------------------------------------------------------
+
+def _init_worker(window_size=(256, 256)):
+    render_window = tvtk.RenderWindow(off_screen_rendering=True,
+                                      size=window_size)
+    renderer = tvtk.Renderer(background=(0.0, 0.0, 0.0))
+    render_window.add_renderer(renderer)
+
+    mapper = tvtk.SmartVolumeMapper()
+    volume_property = tvtk.VolumeProperty(interpolation_type='linear')
+    volume = tvtk.Volume(mapper=mapper, property=volume_property)
+    renderer.add_volume(volume)
+
+    image_filter = tvtk.WindowToImageFilter(input=render_window,
+                                            read_front_buffer=False)
+    _CONTEXT.update(render_window=render_window, renderer=renderer,
+                    mapper=mapper, volume_property=volume_property,
+                    image_filter=image_filter, volume_key=None,
+                    volume=None)
+
+
+def _render_indexed_image(indexed_job):
+    index, job = indexed_job
+    return index, render_image(job)
+
+
+def _set_camera(renderer, camera):
+    renderer.reset_camera()
+    active_camera = renderer.active_camera
+    if 'position' in camera:
+        active_camera.trait_set(position=camera['position'],
+                                focal_point=camera['focal_point'],
+                                view_up=camera['view_up'])
+    else:
+        # Place the camera like mlab.view, on a sphere around the volume
+        azimuth = np.radians(camera['azimuth'])
+        elevation = np.radians(camera['elevation'])
+        focal_point = np.array(active_camera.focal_point)
+        distance = active_camera.distance
+        direction = np.array([np.sin(elevation) * np.cos(azimuth),
+                              np.sin(elevation) * np.sin(azimuth),
+                              np.cos(elevation)])
+        active_camera.trait_set(position=focal_point + distance * direction,
+                                view_up=(0.0, 0.0, 1.0))
+    renderer.reset_camera_clipping_range()
+
+
+def _sort_key(job):
+    key = job['volume_key']
+    return (key is None, repr(key))
+
+
+def _volume_for_job(job):
+    """ Return (volume_data, vmin, vmax) for a job, reusing the previous
+    job's volume if it has the same key.
+    """
+    key = job['volume_key']
+    if key is None or key != _CONTEXT['volume_key']:
+        volume = job['volume']
+        if isinstance(volume, six.string_types):
+            volume = np.load(volume, mmap_mode='r')
+        traits = {'raw_data': volume}
+        if job['spacing'] is not None:
+            traits['spacing'] = job['spacing']
+        volume_data = VolumeData(**traits)
+        raw_data = volume_data.raw_data
+        _CONTEXT['volume'] = (volume_data, raw_data.min(), raw_data.max())
+        _CONTEXT['volume_key'] = key
+        configure_input_data(_CONTEXT['mapper'], volume_data.render_data)
+    return _CONTEXT['volume']
@@ -0,0 +1,283 @@
+from __future__ import division, unicode_literals
+
+import os
+import threading
+
+import numpy as np
+from six.moves import queue
+from traits.api import (HasStrictTraits, Any, Enum, Instance, Int, List,
+                        Range, Unicode)
+from tvtk.api import tvtk
+from tvtk.common import configure_input_data
+
+from .volume_viewer import VolumeViewer
+
+# The camera traits which make up a point on a camera path
+CAMERA_KEYS = ('position', 'focal_point', 'view_up')
+
+
+def camera_state(camera):
+    """ Return the current state of a tvtk Camera as a camera path point.
+    """
+    return {key: tuple(getattr(camera, key)) for key in CAMERA_KEYS}
+
+
+def keyframe_path(keyframes, frames_per_segment):
+    """ Linearly interpolate between camera states.
+
+    Parameters
+    ----------
+    keyframes : sequence of dict
+        Camera states, as returned by `camera_state`.
+    frames_per_segment : int
+        The number of frames from one keyframe up to the next.
+
+    Returns
+    -------
+    path : list of dict
+        The camera state of each frame, ending with the last keyframe.
+    """
+    path = []
+    for start, end in zip(keyframes[:-1], keyframes[1:]):
+        for t in np.arange(frames_per_segment) / frames_per_segment:
+            path.append({
+                key: tuple((1 - t) * np.asarray(start[key]) +
+                           t * np.asarray(end[key]))
+                for key in CAMERA_KEYS
+            })
+    path.append(dict(keyframes[-1]))
+    return path
+
+
+def turntable_path(start, num_frames, degrees=360.0):
+    """ Rotate a camera state around its focal point.
+
+    The camera turns about its view up direction, so a full turn is an
+    azimuth sweep around the volume.
+
+    Parameters
+    ----------
+    start : dict
+        The initial camera state, as returned by `camera_state`.
+    num_frames : int
+        The number of frames in the path.
+    degrees : float
+        The total rotation. The last frame stops one step short of it, so a
+        full turn loops seamlessly.
+    """
+    focal_point = np.asarray(start['focal_point'], dtype=float)
+    offset = np.asarray(start['position'], dtype=float) - focal_point
+    axis = np.asarray(start['view_up'], dtype=float)
+    axis /= np.linalg.norm(axis)
+
+    path = []
+    for angle in np.radians(degrees) * np.arange(num_frames) / num_frames:
+        # Rodrigues' rotation formula
+        rotated = (offset * np.cos(angle) +
+                   np.cross(axis, offset) * np.sin(angle) +
+                   axis * np.dot(axis, offset) * (1 - np.cos(angle)))
+        path.append({
+            'position': tuple(focal_point + rotated),
+            'focal_point': tuple(focal_point),
+            'view_up': tuple(start['view_up']),
+        })
+    return path
+
+
+class FrameWriter(HasStrictTraits):
+    """ Writes frames to PNG files on a background thread.
+
+    Frames are rendered into buffers taken from a small pool with `acquire`
+    and handed over with `submit`. The pool holds one more buffer than the
+    queue, so rendering the next frame overlaps with encoding the previous
+    ones, and rendering waits when the writer falls behind.
+    """
+
+    # The maximum number of frames waiting to be written
+    queue_size = Int(2)
+
+    # The zlib compression level of the PNG files
+    compression_level = Range(0, 9, value=5)
+
+    # Frames waiting to be written, as (buffer, filename) pairs
+    _queue = Any
+
+    # Buffers which are free to be rendered into
+    _free_buffers = Any
+
+    # All buffers in the pool
+    _buffers = List
+
+    # The writer thread
+    _thread = Instance(threading.Thread)
+
+    # The first exception raised by the writer thread
+    _error = Any
+
+    # -------------------------------------------------------------------------
+    # Public interface
+    # -------------------------------------------------------------------------
+
+    def acquire(self, shape, dtype=np.uint8):
+        """ Return a free buffer for a frame, waiting for one if needed.
+        """
+        if self._thread is None:
+            self._start()
+
+        if len(self._buffers) <= self.queue_size:
+            buf = np.empty(shape, dtype=dtype)
+            self._buffers.append(buf)
+            return buf
+        return self._free_buffers.get()
+
+    def submit(self, buf, filename):
+        """ Queue a buffer from `acquire` to be written to `filename`.
+        """
+        self._check_error()
+        self._queue.put((buf, filename))
+
+    def close(self):
+        """ Wait until every queued frame has been written.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._buffers = []
+        self._check_error()
+
+    # -------------------------------------------------------------------------
+    # Private methods
+    # -------------------------------------------------------------------------
+
+    def _check_error(self):
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _start(self):
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._free_buffers = queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        writer = tvtk.PNGWriter(compression_level=self.compression_level)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            buf, filename = item
+            try:
+                if self._error is None:
+                    self._write(writer, buf, filename)
+            except Exception as error:
+                # Report the error from the rendering thread. Keep draining
+                # the queue so that it never blocks.
+                self._error = error
+            finally:
+                self._free_buffers.put(buf)
+
+    def _write(self, writer, buf, filename):
+        height, width = buf.shape[:2]
+        channels = buf.shape[2] if buf.ndim == 3 else 1
+        image_data = tvtk.ImageData(dimensions=(width, height, 1))
+        # VTK images start with the bottom row.
+        image_data.point_data.scalars = buf[::-1].reshape(-1, channels)
+        configure_input_data(writer, image_data)
+        writer.file_name = filename
+        writer.write()
+        if writer.error_code != 0:
+            raise IOError('Unable to write {}'.format(filename))
+
+
+class FrameCapture(HasStrictTraits):
+    """ Renders an animation of a `VolumeViewer` to a sequence of PNG files.
+
+    Frames are encoded and written by a `FrameWriter` while the following
+    frames render.
+    """
+
+    # The viewer to capture
+    viewer = Instance(VolumeViewer)
+
+    # The directory to write the frames to
+    directory = Unicode
+
+    # The file name of each frame, formatted with the frame index
+    filename_template = Unicode('frame_{:05d}.png')
+
+    # The factor by which to enlarge the frames, as for `screenshot`
+    magnification = Int(1)
+
+    # The kind of image
+    mode = Enum('rgb', 'rgba')
+
+    # Writes the frames
+    writer = Instance(FrameWriter, ())
+
+    # -------------------------------------------------------------------------
+    # Public interface
+    # -------------------------------------------------------------------------
+
+    def capture(self, camera_path=None, transfer_functions=None):
+        """ Render and write one frame per point of the given sequences.
+
+        Parameters
+        ----------
+        camera_path : sequence of dict, optional
+            The camera state of each frame. See `turntable_path` and
+            `keyframe_path`.
+        transfer_functions : sequence of TransferFunction, optional
+            The transfer function of each frame.
+
+        Returns
+        -------
+        filenames : list
+            The files which were written.
+        """
+        sequences = [seq for seq in (camera_path, transfer_functions)
+                     if seq is not None]
+        if not sequences:
+            return []
+
+        num_frames = len(sequences[0])
+        if any(len(seq) != num_frames for seq in sequences):
+            msg = 'The camera path and transfer functions differ in length'
+            raise ValueError(msg)
+
+        model = self.viewer.model
+        renderer = self.viewer.volume_renderer
+        filenames = []
+        shape = None
+        try:
+            for index in range(num_frames):
+                if camera_path is not None:
+                    model.camera.trait_set(**camera_path[index])
+                    model.renderer.reset_camera_clipping_range()
+                if transfer_functions is not None:
+                    function = transfer_functions[index]
+                    renderer.set_transfer_function(function.color,
+                                                   function.opacity)
+
+                filename = os.path.join(self.directory,
+                                        self.filename_template.format(index))
+                if shape is None:
+                    # Render the first frame to learn the frame size
+                    frame = self.viewer.screenshot(self.magnification,
+                                                   mode=self.mode)
+                    shape = frame.shape
+                    buf = self.writer.acquire(shape)
+                    buf[...] = frame
+                else:
+                    buf = self.writer.acquire(shape)
+                    self.viewer.screenshot(self.magnification, out=buf,
+                                           mode=self.mode)
+                self.writer.submit(buf, filename)
+                filenames.append(filename)
+        finally:
+            self.writer.close()
+
+        return filenames
@@ -0,0 +1,274 @@
+from __future__ import division, unicode_literals
+
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from traits.api import HasStrictTraits, Any, Float, Int, Tuple
+
+# The number of threads which sample an image
+REFORMAT_THREADS = 4
+
+# The number of pixels sampled at once. Small enough for the temporary arrays
+# to stay in the CPU cache.
+BAND_SIZE = 2 ** 14
+
+
+def plane_axes(normal, up):
+    """ Compute the unit (right, up) directions of an image on a plane.
+
+    Parameters
+    ----------
+    normal : sequence of 3 floats
+        The normal of the plane, pointing towards the viewer.
+    up : sequence of 3 floats
+        The direction which should point up in the image. Only its part
+        within the plane is used.
+    """
+    normal = np.asarray(normal, dtype=float)
+    normal /= np.linalg.norm(normal)
+    up = np.asarray(up, dtype=float)
+    up = up - np.dot(up, normal) * normal
+    length = np.linalg.norm(up)
+    if length < 1e-8:
+        raise ValueError('The up direction is normal to the plane')
+    up /= length
+    return np.cross(up, normal), up
+
+
+def resample_polyline(points, count):
+    """ Place `count` points at equal distances along a polyline.
+    """
+    points = np.asarray(points, dtype=float)
+    lengths = np.sqrt(((points[1:] - points[:-1]) ** 2).sum(axis=-1))
+    distance = np.concatenate([[0.0], np.cumsum(lengths)])
+    samples = np.linspace(0.0, distance[-1], count)
+    return np.stack([np.interp(samples, distance, points[:, axis])
+                     for axis in range(3)], axis=-1)
+
+
+def trilinear_sample(volume, points, fill_value=0.0):
+    """ Sample a 3D array at fractional index positions with trilinear
+    interpolation.
+
+    Parameters
+    ----------
+    volume : 3D array
+        The data to sample.
+    points : array
+        Index positions with shape (..., 3).
+    fill_value : float
+        The value of positions outside of the volume.
+
+    Returns
+    -------
+    values : array
+        Float32 values with shape ``points.shape[:-1]``.
+    """
+    points = np.asarray(points, dtype=np.float32)
+    out = np.empty(points.shape[:-1], dtype=np.float32)
+    flat_points = points.reshape(-1, 3)
+    _sample_flat(_FlatVolume(volume), flat_points[:, 0], flat_points[:, 1],
+                 flat_points[:, 2], fill_value, out.reshape(-1))
+    return out
+
+
+class Reformatter(HasStrictTraits):
+    """ Samples images on oblique planes and curved surfaces through a
+    volume, for multi-planar reformatting.
+
+    Positions are in world coordinates, where the point (i, j, k) of `data`
+    lies at (i, j, k) * `spacing`, as in `VolumeData`. Bands of rows of the
+    image are sampled in parallel.
+    """
+
+    # The 3D array to sample, such as `VolumeData.raw_data`
+    data = Any
+
+    # The spacing between grid points in each dimension
+    spacing = Tuple(Float(1.0), Float(1.0), Float(1.0))
+
+    # The value of pixels outside of the volume
+    fill_value = Float(0.0)
+
+    # The number of threads which sample an image
+    num_threads = Int(REFORMAT_THREADS)
+
+    # `data` prepared for sampling
+    _volume = Any
+
+    # The sampling threads
+    _pool = Any
+
+    # -------------------------------------------------------------------------
+    # Public interface
+    # -------------------------------------------------------------------------
+
+    def close(self):
+        """ Stop the sampling threads.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def sample_curve(self, polyline, direction, height, shape, out=None):
+        """ Sample a curved surface, for curved planar reformatting.
+
+        The columns of the image follow `polyline` at equal distances and its
+        rows are offsets from the curve along `direction`, covering `height`
+        with the curve in the middle.
+
+        Parameters
+        ----------
+        polyline : array
+            The world positions of the curve, with shape (N, 3).
+        direction : sequence of 3 floats
+            The direction of increasing rows.
+        height : float
+            The world distance covered by the rows.
+        shape : tuple
+            The (rows, columns) of the image.
+        out : array, optional
+            A C contiguous float32 array to write the image into.
+        """
+        rows, columns = shape
+        direction = np.asarray(direction, dtype=float)
+        direction /= np.linalg.norm(direction)
+        curve = resample_polyline(polyline, columns)
+        row_step = direction * height / max(rows - 1, 1)
+        first_row = curve - row_step * (rows - 1) / 2
+        return self._sample_rows(first_row, row_step, shape, out)
+
+    def sample_plane(self, center, normal, up, size, shape, out=None):
+        """ Sample an image on an arbitrary plane.
+
+        Parameters
+        ----------
+        center : sequence of 3 floats
+            The world position of the center of the image.
+        normal, up : sequence of 3 floats
+            The orientation of the image. See `plane_axes`.
+        size : tuple
+            The (width, height) of the image in world units.
+        shape : tuple
+            The (rows, columns) of the image. Row 0 is at the bottom.
+        out : array, optional
+            A C contiguous float32 array to write the image into.
+        """
+        rows, columns = shape
+        width, height = size
+        right, up = plane_axes(normal, up)
+        column_step = right * width / max(columns - 1, 1)
+        row_step = up * height / max(rows - 1, 1)
+        corner = (np.asarray(center, dtype=float) -
+                  column_step * (columns - 1) / 2 -
+                  row_step * (rows - 1) / 2)
+        first_row = corner + np.arange(columns)[:, np.newaxis] * column_step
+        return self._sample_rows(first_row, row_step, shape, out)
+
+    # -------------------------------------------------------------------------
+    # Traits handlers
+    # -------------------------------------------------------------------------
+
+    def _data_changed(self):
+        self._volume = None
+
+    def _num_threads_changed(self):
+        self.close()
+
+    # -------------------------------------------------------------------------
+    # Private methods
+    # -------------------------------------------------------------------------
+
+    def _sample_rows(self, first_row, row_step, shape, out):
+        """ Sample the pixels (r, c) at `first_row[c] + r * row_step`.
+        """
+        if out is None:
+            out = np.empty(shape, dtype=np.float32)
+        elif (out.shape != tuple(shape) or out.dtype != np.float32 or
+                not out.flags.c_contiguous):
+            msg = 'Expected a C contiguous float32 array of shape {}'
+            raise ValueError(msg.format(tuple(shape)))
+
+        if self._volume is None:
+            self._volume = _FlatVolume(self.data)
+        volume = self._volume
+
+        # Work in index coordinates
+        spacing = np.array(self.spacing)
+        first_row = (first_row / spacing).astype(np.float32)
+        row_step = (row_step / spacing).astype(np.float32)
+
+        rows, columns = shape
+        step = max(BAND_SIZE // max(columns, 1), 1)
+        bands = [(start, min(start + step, rows))
+                 for start in range(0, rows, step)]
+
+        def sample(band):
+            start, stop = band
+            offsets = np.arange(start, stop, dtype=np.float32)[:, np.newaxis]
+            x, y, z = [(first_row[:, axis] + offsets * row_step[axis]).ravel()
+                       for axis in range(3)]
+            _sample_flat(volume, x, y, z, self.fill_value,
+                         out[start:stop].reshape(-1))
+
+        if len(bands) == 1:
+            sample(bands[0])
+        else:
+            if self._pool is None:
+                self._pool = ThreadPool(self.num_threads)
+            self._pool.map(sample, bands)
+        return out
+
+
+class _FlatVolume(object):
+    """ A 3D array as a flat array and the flat index step along each axis.
+    """
+
+    def __init__(self, volume):
+        volume = np.asarray(volume)
+        if not (volume.flags.c_contiguous or volume.flags.f_contiguous):
+            volume = np.asfortranarray(volume)
+        self.flat = volume.ravel(order='K')
+        self.shape = volume.shape
+        strides = [stride // volume.itemsize for stride in volume.strides]
+        # Neighbours along an axis with a single point are the point itself
+        self.steps = [stride if size > 1 else 0
+                      for stride, size in zip(strides, volume.shape)]
+        self.strides = strides
+
+
+def _sample_flat(volume, x, y, z, fill_value, out):
+    """ Trilinearly interpolate `volume` at the index positions (x, y, z),
+    given as 1D float32 arrays, writing into `out`.
+    """
+    flat = volume.flat
+    inside = np.ones(x.shape, dtype=bool)
+    index = np.zeros(x.shape, dtype=np.intp)
+    fractions = []
+    for coords, size, stride in zip((x, y, z), volume.shape, volume.strides):
+        inside &= (coords >= 0) & (coords <= size - 1)
+        # Truncating is flooring for the positions inside the volume
+        base = coords.astype(np.intp)
+        np.clip(base, 0, max(size - 2, 0), out=base)
+        fractions.append(np.subtract(coords, base, dtype=np.float32))
+        base *= stride
+        index += base
+    fx, fy, fz = fractions
+    sx, sy, sz = volume.steps
+
+    def lerp(low, high, fraction):
+        low = low.astype(np.float32, copy=False)
+        high = high.astype(np.float32, copy=False)
+        return low + (high - low) * fraction
+
+    # Interpolate along x, then y, then z
+    c00 = lerp(flat[index], flat[index + sx], fx)
+    c10 = lerp(flat[index + sy], flat[index + sx + sy], fx)
+    c0 = lerp(c00, c10, fy)
+    index += sz
+    c01 = lerp(flat[index], flat[index + sx], fx)
+    c11 = lerp(flat[index + sy], flat[index + sx + sy], fx)
+    c1 = lerp(c01, c11, fy)
+    out[:] = lerp(c0, c1, fz)
+    out[~inside] = fill_value
@@ -0,0 +1,384 @@
+from __future__ import division, unicode_literals
+
+from abc import abstractmethod
+from collections import OrderedDict
+import json
+import os
+import select
+import socket
+import struct
+import zlib
+
+import numpy as np
+import six
+from traits.api import (ABCHasStrictTraits, HasStrictTraits, Any, Bool,
+                        Either, Enum, Instance, Int, Range, Tuple, Unicode)
+
+from ensemble.ctf.api import TransferFunction
+from .frame_capture import CAMERA_KEYS
+from .volume_renderer import QUALITY_SETTINGS
+from .volume_viewer import VolumeViewer
+
+# Each message starts with the byte lengths of its JSON header and payload.
+PREFIX_FORMAT = '>II'
+PREFIX_SIZE = struct.calcsize(PREFIX_FORMAT)
+
+# Commands which change the view. Only the latest of each kind is applied.
+VIEW_COMMANDS = ('camera', 'transfer_function', 'clip')
+
+
+def send_message(sock, header, payload=b''):
+    """ Send a JSON-serializable `header` and an optional bytes `payload`.
+    """
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix = struct.pack(PREFIX_FORMAT, len(header_bytes), len(payload))
+    sock.sendall(prefix + header_bytes)
+    if payload:
+        sock.sendall(payload)
+
+
+def receive_message(sock):
+    """ Receive a message sent by `send_message`.
+
+    Returns a (header, payload) tuple, or None if the connection was closed.
+    """
+    prefix = _receive_exactly(sock, PREFIX_SIZE)
+    if prefix is None:
+        return None
+
+    header_size, payload_size = struct.unpack(PREFIX_FORMAT, prefix)
+    header = json.loads(_receive_exactly(sock, header_size).decode('utf-8'))
+    payload = b''
+    if payload_size > 0:
+        payload = _receive_exactly(sock, payload_size)
+    return header, payload
+
+
+def _receive_exactly(sock, size):
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk:
+            if remaining == size:
+                return None
+            raise IOError('Connection closed in the middle of a message')
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def _make_socket(address):
+    if isinstance(address, six.string_types):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class ABCRenderTarget(ABCHasStrictTraits):
+    """ Something which a `RenderServer` can send commands to and render.
+    """
+
+    @abstractmethod
+    def apply_command(self, command):
+        """ Apply a 'camera', 'transfer_function' or 'clip' command dict.
+        """
+
+    @abstractmethod
+    def render(self, quality):
+        """ Render a frame with one of the `QUALITY_SETTINGS` and return it
+        as a uint8 image array.
+        """
+
+
+class ViewerRenderTarget(ABCRenderTarget):
+    """ Serves the scene of a `VolumeViewer`.
+    """
+
+    # The viewer to render
+    viewer = Instance(VolumeViewer)
+
+    # The frame buffer, reused between frames
+    _buffer = Any
+
+    def apply_command(self, command):
+        kind = command['type']
+        if kind == 'camera':
+            model = self.viewer.model
+            model.camera.trait_set(**{key: command[key] for key in CAMERA_KEYS
+                                      if key in command})
+            model.renderer.reset_camera_clipping_range()
+        elif kind == 'transfer_function':
+            function = TransferFunction.from_dict(command['function'])
+            self.viewer.volume_renderer.set_transfer_function(
+                function.color, function.opacity
+            )
+        elif kind == 'clip':
+            self.viewer.clip_bounds = command['bounds']
+
+    def render(self, quality):
+        renderer = self.viewer.volume_renderer
+        if renderer.render_quality != quality:
+            renderer.render_quality = quality
+        renderer.flush()
+        try:
+            self._buffer = self.viewer.screenshot(out=self._buffer)
+        except ValueError:
+            # The window was resized
+            self._buffer = self.viewer.screenshot()
+        return self._buffer
+
+
+class RenderServer(HasStrictTraits):
+    """ Serves rendered frames of a scene to one client at a time.
+
+    Clients send JSON commands with a 'type' of 'camera', 'transfer_function'
+    or 'clip', which change the scene, 'interaction' with an 'active' flag,
+    which switches between coarse and fine rendering, and 'ack' with the
+    number of the last frame received. The server answers with 'frame'
+    messages whose payload is the zlib compressed image.
+
+    Commands which arrive between two frames are coalesced, so only the
+    latest command of each kind is applied. No frame is rendered while the
+    client has `max_frames_in_flight` frames which it has not acknowledged,
+    so a slow client receives fewer, more recent frames instead of a backlog.
+    """
+
+    # What is rendered
+    target = Instance(ABCRenderTarget)
+
+    # A (host, port) tuple for TCP or a path for a Unix domain socket
+    address = Either(Tuple(Unicode, Int), Unicode)
+
+    # The quality of frames rendered while the client interacts
+    interactive_quality = Enum('performance', list(QUALITY_SETTINGS.keys()))
+
+    # The quality of frames rendered otherwise
+    still_quality = Enum('default', list(QUALITY_SETTINGS.keys()))
+
+    # How many unacknowledged frames the client may have
+    max_frames_in_flight = Int(2)
+
+    # The zlib compression level of frames
+    compression_level = Range(0, 9, value=1)
+
+    # Is the client interacting?
+    interacting = Bool(False)
+
+    # The number of the last frame sent
+    frame_number = Int(0)
+
+    # The listening socket
+    _listener = Any
+
+    # The connected client, if any
+    _client = Any
+
+    # View commands which have not been applied yet, by kind
+    _pending = Instance(OrderedDict, ())
+
+    # Does the view need a new frame?
+    _dirty = Bool(False)
+
+    # The number of the last frame acknowledged by the client
+    _acked = Int(0)
+
+    # Set to end `serve_forever`
+    _stopped = Bool(False)
+
+    # -------------------------------------------------------------------------
+    # Public interface
+    # -------------------------------------------------------------------------
+
+    def close(self):
+        """ Close the client connection and stop listening.
+        """
+        self._stopped = True
+        self._disconnect()
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            # Let a new server listen on the same Unix socket path
+            if (isinstance(self.address, six.string_types) and
+                    os.path.exists(self.address)):
+                os.unlink(self.address)
+
+    def listen(self):
+        """ Open the listening socket. Returns the address being listened on,
+        which gives the port when the requested port is 0.
+        """
+        address = self.address
+        self._listener = _make_socket(address)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(address)
+        self._listener.listen(1)
+        self.address = self._listener.getsockname()
+        return self.address
+
+    def poll(self, timeout=0.0):
+        """ Handle waiting connections and commands, and send a frame if one
+        is needed.
+
+        Call this repeatedly from the thread which owns the render window, for
+        example from a GUI timer, or use `serve_forever`.
+        """
+        if self._listener is None:
+            self.listen()
+
+        if self._client is None:
+            readable, _, _ = select.select([self._listener], [], [], timeout)
+            if readable:
+                self._accept()
+            return
+
+        readable, _, _ = select.select([self._client], [], [], timeout)
+        while readable:
+            try:
+                message = receive_message(self._client)
+                if message is not None:
+                    self._handle_command(message[0])
+            except (IOError, socket.error, KeyError, TypeError, ValueError):
+                # The connection broke or the client sent a malformed
+                # message. Drop the client and wait for the next one.
+                message = None
+            if message is None:
+                self._disconnect()
+                return
+            readable, _, _ = select.select([self._client], [], [], 0.0)
+
+        in_flight = self.frame_number - self._acked
+        if self._dirty and in_flight < self.max_frames_in_flight:
+            self._send_frame()
+
+    def serve_forever(self, poll_interval=0.01):
+        """ Serve clients until `close` is called.
+        """
+        self._stopped = False
+        while not self._stopped:
+            self.poll(timeout=poll_interval)
+
+    # -------------------------------------------------------------------------
+    # Private methods
+    # -------------------------------------------------------------------------
+
+    def _accept(self):
+        client, _ = self._listener.accept()
+        self._client = client
+        self.interacting = False
+        self._pending.clear()
+        self._acked = self.frame_number
+        # Send the current view right away
+        self._dirty = True
+
+    def _disconnect(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def _handle_command(self, command):
+        kind = command.get('type')
+        if kind == 'ack':
+            self._acked = max(self._acked, command['frame'])
+        elif kind == 'interaction':
+            self.interacting = bool(command['active'])
+            # Refine the view once the interaction stops
+            self._dirty = True
+        elif kind in VIEW_COMMANDS:
+            self._pending.pop(kind, None)
+            self._pending[kind] = command
+            self._dirty = True
+
+    def _send_frame(self):
+        for command in self._pending.values():
+            self.target.apply_command(command)
+        self._pending.clear()
+        self._dirty = False
+
+        quality = (self.interactive_quality if self.interacting
+                   else self.still_quality)
+        image = np.ascontiguousarray(self.target.render(quality))
+        payload = zlib.compress(image.data, self.compression_level)
+        self.frame_number += 1
+        header = {
+            'type': 'frame',
+            'frame': self.frame_number,
+            'quality': quality,
+            'shape': list(image.shape),
+            'dtype': image.dtype.str,
+        }
+        try:
+            send_message(self._client, header, payload)
+        except socket.error:
+            self._disconnect()
+
+
+class RenderClient(HasStrictTraits):
+    """ A client for `RenderServer`.
+    """
+
+    # The server's address. See `RenderServer.address`.
+    address = Either(Tuple(Unicode, Int), Unicode)
+
+    # Acknowledge each frame as it is received?
+    auto_ack = Bool(True)
+
+    # The connection
+    _socket = Any
+
+    # -------------------------------------------------------------------------
+    # Public interface
+    # -------------------------------------------------------------------------
+
+    def connect(self):
+        self._socket = _make_socket(self.address)
+        self._socket.connect(self.address)
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def ack(self, frame_number):
+        """ Tell the server that a frame was received.
+        """
+        self.send({'type': 'ack', 'frame': frame_number})
+
+    def receive_frame(self):
+        """ Wait for the next frame. Returns a (header, image) tuple, or None
+        if the server closed the connection.
+        """
+        message = receive_message(self._socket)
+        if message is None:
+            return None
+
+        header, payload = message
+        image = np.frombuffer(zlib.decompress(payload),
+                              dtype=np.dtype(header['dtype']))
+        image = image.reshape(header['shape'])
+        if self.auto_ack:
+            self.ack(header['frame'])
+        return header, image
+
+    def send(self, command):
+        """ Send a command dict.
+        """
+        send_message(self._socket, command)
+
+    def set_camera(self, **camera):
+        """ Send a camera command with any of 'position', 'focal_point' and
+        'view_up'.
+        """
+        command = {'type': 'camera'}
+        command.update({key: list(value) for key, value in camera.items()})
+        self.send(command)
+
+    def set_clip_bounds(self, bounds):
+        self.send({'type': 'clip', 'bounds': list(bounds)})
+
+    def set_interacting(self, active):
+        self.send({'type': 'interaction', 'active': active})
+
+    def set_transfer_function(self, function):
+        self.send({'type': 'transfer_function',
+                   'function': function.to_dict()})
@@ -0,0 +1,70 @@
+from __future__ import division, unicode_literals
+
+import math
+import time
+
+from pyface.timer.api import do_after
+from traits.api import Bool, Callable, Float, HasStrictTraits
+
+# One frame of a 60Hz display.
+FRAME_INTERVAL = 1.0 / 60
+
+
+class RenderThrottle(HasStrictTraits):
+    """ Coalesces bursts of update requests into at most one call of
+    `callback` per `interval`.
+
+    The first request after a quiet period is handled immediately. Requests
+    which arrive while the interval has not yet elapsed are collapsed into a
+    single deferred call, so the final state is always applied.
+    """
+
+    # The function to call.
+    callback = Callable
+
+    # The minimum time between two calls of `callback`, in seconds.
+    interval = Float(FRAME_INTERVAL)
+
+    # Is a deferred call scheduled?
+    _pending = Bool(False)
+
+    # When was `callback` last called?
+    _last_call = Float(-1.0)
+
+    # -------------------------------------------------------------------------
+    # Public interface
+    # -------------------------------------------------------------------------
+
+    def request(self):
+        """ Ask for `callback` to be called as soon as the rate limit allows.
+        """
+        if self._pending:
+            return
+
+        elapsed = time.time() - self._last_call
+        if self._last_call < 0 or elapsed >= self.interval:
+            self._fire()
+        else:
+            self._pending = True
+            delay = int(math.ceil((self.interval - elapsed) * 1000))
+            do_after(delay, self._deferred_fire)
+
+    def flush(self):
+        """ Immediately perform any pending call.
+        """
+        if self._pending:
+            self._fire()
+
+    # -------------------------------------------------------------------------
+    # Private methods
+    # -------------------------------------------------------------------------
+
+    def _deferred_fire(self):
+        # The pending call might have been flushed in the meantime.
+        if self._pending:
+            self._fire()
+
+    def _fire(self):
+        self._pending = False
+        self._last_call = time.time()
+        self.callback()
@@ -0,0 +1,251 @@
+from __future__ import division, unicode_literals
+
+from collections import OrderedDict
+import logging
+from multiprocessing.pool import ThreadPool
+import threading
+
+import numpy as np
+import six
+from traits.api import HasStrictTraits, Any, Bool, Instance, Int
+
+logger = logging.getLogger(__name__)
+
+
+def extract_slice(array, axis, index):
+    """ Return the slice `index` of a 3D array along `axis` as a Fortran
+    ordered 2D array, which is the layout of VTK image scalars.
+
+    Slices which already have that layout, such as the Z slices of a Fortran
+    ordered volume, are returned as views without copying.
+    """
+    slices = [slice(None)] * 3
+    slices[axis] = index
+    return np.asfortranarray(array[tuple(slices)])
+
+
+def is_memory_mapped(array):
+    """ Does `array` read its values from a memory mapped file?
+
+    Views of memory mapped arrays, such as the Fortran ordered arrays of
+    `VolumeData`, are plain ndarrays, so their bases are checked too.
+    """
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+class SliceCache(HasStrictTraits):
+    """ A least recently used cache of axis-aligned slices of a 3D array.
+
+    Slices can be read on a background thread, either on request with
+    `request_slice` or ahead of time with `prefetch`, so that stepping
+    through the volume finds them in the cache.
+
+    The data can be any 3D array-like object which supports slicing, such as
+    a memory mapped array or an h5py dataset. If it has a ``chunks``
+    attribute, as h5py datasets do, whole chunks are read at once and all of
+    their slices are cached.
+    """
+
+    # The 3D array to slice
+    data = Any
+
+    # Copy slices out of `data` when they are read. Set this for memory
+    # mapped data, so that it is read on the reading thread rather than when
+    # a slice is first used.
+    load_slices = Bool(False)
+
+    # The maximum number of slices kept
+    capacity = Int(32)
+
+    # The number of slices which `prefetch` reads ahead
+    prefetch_distance = Int(2)
+
+    # Cached slices by (axis, index), least recently used first
+    _slices = Instance(OrderedDict, ())
+
+    # The callbacks waiting for each (axis, chunk start) being read
+    _pending = Instance(dict, ())
+
+    # Guards `_slices` and `_pending`
+    _lock = Any
+
+    # Counts changes of `data`, so that reads of old data are not cached
+    _generation = Int(0)
+
+    # The reading thread
+    _pool = Any
+
+    # -------------------------------------------------------------------------
+    # Public interface
+    # -------------------------------------------------------------------------
+
+    def clear(self):
+        """ Forget all cached slices.
+        """
+        with self._lock:
+            self._generation += 1
+            self._slices.clear()
+            self._pending.clear()
+
+    def close(self):
+        """ Wait for any reads in progress and stop the reading thread.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def get_slice(self, axis, index):
+        """ Return the slice `index` along `axis`, reading it if it is not
+        cached.
+        """
+        key = (axis, index)
+        with self._lock:
+            cached = self._lookup(key)
+            generation = self._generation
+        if cached is not None:
+            return cached
+
+        start, stop = self._chunk_bounds(axis, index)
+        slices = self._read_chunk(axis, start, stop)
+        self._store(axis, slices, generation)
+        return slices[index]
+
+    def prefetch(self, axis, index, direction=0):
+        """ Read the slices after `index` along `axis` in the background.
+
+        A positive or negative `direction` reads ahead in that direction, as
+        when stepping through the volume. Zero reads on both sides.
+        """
+        if self.data is None:
+            return
+
+        distances = range(1, self.prefetch_distance + 1)
+        if direction > 0:
+            indices = [index + d for d in distances]
+        elif direction < 0:
+            indices = [index - d for d in distances]
+        else:
+            indices = [index + s * d for d in distances for s in (1, -1)]
+
+        size = self.data.shape[axis]
+        for i in indices:
+            if 0 <= i < size:
+                self._schedule(axis, i)
+
+    def request_slice(self, axis, index, callback):
+        """ Return the slice `index` along `axis` if it is cached. Otherwise
+        read it in the background and return None.
+
+        Once the slice is read, ``callback(axis, index, array)`` is called on
+        the reading thread. If reading the slice failed, the error is logged
+        and `array` is None.
+        """
+        return self._schedule(axis, index, callback)
+
+    # -------------------------------------------------------------------------
+    # Traits handlers
+    # -------------------------------------------------------------------------
+
+    def __lock_default(self):
+        return threading.Lock()
+
+    def _data_changed(self):
+        self.clear()
+
+    # -------------------------------------------------------------------------
+    # Private methods
+    # -------------------------------------------------------------------------
+
+    def _chunk_bounds(self, axis, index):
+        """ The [start, stop) slice indices of the chunk containing `index`.
+        """
+        length = 1
+        chunks = getattr(self.data, 'chunks', None)
+        if chunks and isinstance(chunks[axis], six.integer_types):
+            length = chunks[axis]
+        start = index - index % length
+        return start, min(start + length, self.data.shape[axis])
+
+    def _load_chunk(self, axis, start, stop, generation):
+        try:
+            slices = self._read_chunk(axis, start, stop)
+        except Exception:
+            # Nothing waits on the result of the reading thread
+            logger.exception('Failed to read slices %d to %d along axis %d',
+                             start, stop - 1, axis)
+            slices = None
+
+        with self._lock:
+            callbacks = self._pending.pop((axis, start), [])
+            is_current = generation == self._generation
+        if not is_current:
+            return
+
+        if slices is not None:
+            self._store(axis, slices, generation)
+        for index, callback in callbacks:
+            array = None if slices is None else slices[index]
+            callback(axis, index, array)
+
+    def _lookup(self, key):
+        """ Return a cached slice and mark it as recently used. Must be called
+        with the lock held.
+        """
+        cached = self._slices.pop(key, None)
+        if cached is not None:
+            self._slices[key] = cached
+        return cached
+
+    def _read_chunk(self, axis, start, stop):
+        """ Read the slices [start, stop) along `axis` with a single read of
+        `data`. Returns a dict of the slices by index.
+        """
+        chunk_slices = [slice(None)] * 3
+        chunk_slices[axis] = slice(start, stop)
+        chunk = self.data[tuple(chunk_slices)]
+        if self.load_slices:
+            chunk = np.array(chunk, order='F')
+        return {start + offset: extract_slice(chunk, axis, offset)
+                for offset in range(stop - start)}
+
+    def _schedule(self, axis, index, callback=None):
+        """ Read the chunk containing a slice in the background, unless the
+        slice is cached or already being read.
+        """
+        start, stop = self._chunk_bounds(axis, index)
+        with self._lock:
+            cached = self._lookup((axis, index))
+            if cached is not None:
+                return cached
+
+            callbacks = self._pending.get((axis, start))
+            is_new = callbacks is None
+            if is_new:
+                callbacks = self._pending[(axis, start)] = []
+            if callback is not None:
+                callbacks.append((index, callback))
+            generation = self._generation
+
+        if is_new:
+            if self._pool is None:
+                self._pool = ThreadPool(1)
+            self._pool.apply_async(self._load_chunk,
+                                   (axis, start, stop, generation))
+        return None
+
+    def _store(self, axis, slices, generation):
+        with self._lock:
+            if generation != self._generation:
+                # The data changed while the slices were read
+                return
+            for index, array in slices.items():
+                key = (axis, index)
+                self._slices.pop(key, None)
+                self._slices[key] = array
+            while len(self._slices) > self.capacity:
+                self._slices.popitem(last=False)
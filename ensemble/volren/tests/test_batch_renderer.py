@@ -0,0 +1,70 @@
+from __future__ import division, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ensemble.ctf.api import TransferFunction
+from ensemble.volren.batch_renderer import (BatchRenderer, make_render_job,
+                                            render_image)
+
+
+class BatchRendererTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.volume = np.random.uniform(size=(16, 16, 16))
+
+    def test_render_image(self):
+        job = make_render_job(self.volume, TransferFunction(), size=(40, 30),
+                              quality='performance', volume_key='volume')
+        image = render_image(job)
+
+        self.assertEqual(image.shape, (30, 40, 3))
+        self.assertEqual(image.dtype, np.uint8)
+        self.assertTrue(image.any())
+
+        # A camera state can be given instead of a view direction
+        job = make_render_job(self.volume, TransferFunction(), size=(40, 30),
+                              quality='performance', volume_key='volume',
+                              camera={'position': (8.0, 8.0, 60.0),
+                                      'focal_point': (8.0, 8.0, 8.0),
+                                      'view_up': (0.0, 1.0, 0.0)})
+        self.assertEqual(render_image(job).shape, (30, 40, 3))
+
+    def test_render_in_worker_processes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'volume.npy')
+        np.save(path, self.volume)
+        sizes = [(40, 30), (20, 10), (30, 20), (10, 40), (16, 16)]
+        volumes = [path, self.volume, path, self.volume * 2, path]
+        jobs = [make_render_job(volume, TransferFunction(), size=size,
+                                quality='performance')
+                for volume, size in zip(volumes, sizes)]
+
+        renderer = BatchRenderer(num_workers=2)
+        try:
+            results = dict(renderer.render(jobs))
+        finally:
+            renderer.close()
+
+        # Each image is paired with the index of its job
+        self.assertEqual(sorted(results), list(range(len(jobs))))
+        for index, (width, height) in enumerate(sizes):
+            image = results[index]
+            self.assertEqual(image.shape, (height, width, 3))
+            self.assertEqual(image.dtype, np.uint8)
+            self.assertTrue(image.any())
+            # The same image as rendering the job in this process
+            np.testing.assert_array_equal(image, render_image(jobs[index]))
+
+    def test_unknown_quality(self):
+        with self.assertRaises(ValueError):
+            make_render_job(self.volume, TransferFunction(), quality='ultra')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+from __future__ import division, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+from tvtk.api import tvtk
+
+from ensemble.volren.frame_capture import (FrameWriter, keyframe_path,
+                                           turntable_path)
+
+
+def read_png(filename):
+    reader = tvtk.PNGReader(file_name=filename)
+    reader.update()
+    image_data = reader.output
+    width, height, _ = image_data.dimensions
+    array = image_data.point_data.scalars.to_array()
+    return array.reshape(height, width, -1)[::-1]
+
+
+class CameraPathTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.start = {'position': (10.0, 0.0, 0.0),
+                      'focal_point': (0.0, 0.0, 0.0),
+                      'view_up': (0.0, 0.0, 1.0)}
+
+    def test_turntable_path(self):
+        path = turntable_path(self.start, 4)
+
+        self.assertEqual(len(path), 4)
+        assert_allclose(path[0]['position'], (10, 0, 0), atol=1e-12)
+        assert_allclose(path[1]['position'], (0, 10, 0), atol=1e-12)
+        assert_allclose(path[2]['position'], (-10, 0, 0), atol=1e-12)
+        for state in path:
+            self.assertEqual(state['focal_point'], (0.0, 0.0, 0.0))
+
+    def test_keyframe_path(self):
+        end = dict(self.start, position=(20.0, 0.0, 0.0))
+        path = keyframe_path([self.start, end], 4)
+
+        self.assertEqual(len(path), 5)
+        positions = [state['position'][0] for state in path]
+        assert_allclose(positions, [10, 12.5, 15, 17.5, 20])
+
+
+class FrameWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_frames(self):
+        writer = FrameWriter(queue_size=2)
+        frames = [np.random.randint(0, 256, size=(12, 16, 3)).astype(np.uint8)
+                  for _ in range(6)]
+        filenames = []
+        for index, frame in enumerate(frames):
+            buf = writer.acquire(frame.shape)
+            buf[...] = frame
+            filename = os.path.join(self.directory, '{}.png'.format(index))
+            writer.submit(buf, filename)
+            filenames.append(filename)
+            # The pool never holds more than one buffer past the queue
+            self.assertLessEqual(len(writer._buffers), 3)
+        writer.close()
+
+        for frame, filename in zip(frames, filenames):
+            assert_array_equal(read_png(filename), frame)
+
+    def test_errors_are_reported(self):
+        writer = FrameWriter()
+        buf = writer.acquire((4, 4, 3))
+        missing = os.path.join(self.directory, 'missing', 'frame.png')
+        writer.submit(buf, missing)
+        with self.assertRaises(IOError):
+            writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
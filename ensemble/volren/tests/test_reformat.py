@@ -0,0 +1,112 @@
+from __future__ import division, unicode_literals
+
+import unittest
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+from ensemble.volren.reformat import (Reformatter, plane_axes,
+                                      resample_polyline, trilinear_sample)
+
+
+def linear_volume(shape):
+    """ A volume whose values are a linear function of the indices, which
+    trilinear interpolation reproduces exactly.
+    """
+    x, y, z = np.indices(shape, dtype=np.float32)
+    return np.asfortranarray(2 * x + 3 * y - z)
+
+
+class TestTrilinearSample(unittest.TestCase):
+
+    def test_linear_function(self):
+        volume = linear_volume((8, 9, 10))
+        points = np.random.uniform(0, 7, size=(5, 20, 3))
+        values = trilinear_sample(volume, points)
+
+        self.assertEqual(values.shape, (5, 20))
+        expected = 2 * points[..., 0] + 3 * points[..., 1] - points[..., 2]
+        assert_allclose(values, expected, rtol=1e-5, atol=1e-4)
+
+    def test_outside(self):
+        volume = linear_volume((4, 4, 4)) + 100
+        points = [[-0.5, 1, 1], [1, 1, 3.5], [3, 3, 3]]
+        values = trilinear_sample(volume, points, fill_value=-1)
+        assert_allclose(values, [-1, -1, 100 + 12])
+
+    def test_flat_volume(self):
+        volume = linear_volume((5, 6, 1))
+        values = trilinear_sample(volume, [[1.5, 2.5, 0.0]])
+        assert_allclose(values, [2 * 1.5 + 3 * 2.5])
+
+
+class TestReformatter(unittest.TestCase):
+
+    def setUp(self):
+        self.volume = linear_volume((16, 12, 10))
+        self.reformatter = Reformatter(data=self.volume,
+                                       spacing=(1.0, 2.0, 0.5))
+
+    def tearDown(self):
+        self.reformatter.close()
+
+    def test_plane_axes(self):
+        right, up = plane_axes((0, 0, 2), (0, 1, 1))
+        assert_allclose(right, (1, 0, 0))
+        assert_allclose(up, (0, 1, 0))
+
+        with self.assertRaises(ValueError):
+            plane_axes((0, 0, 1), (0, 0, -1))
+
+    def test_axis_aligned_plane(self):
+        # A plane through the points of the slice z=4
+        image = self.reformatter.sample_plane(
+            center=(7.5, 11.0, 2.0), normal=(0, 0, 1), up=(0, 1, 0),
+            size=(15.0, 22.0), shape=(12, 16)
+        )
+        # Columns follow x, and rows follow y from the bottom
+        assert_allclose(image, self.volume[:, :, 4].T, atol=1e-4)
+
+    def test_oblique_plane(self):
+        normal = np.array([1.0, 1.0, 1.0])
+        image = self.reformatter.sample_plane(
+            center=(8.0, 10.0, 2.5), normal=normal, up=(0, 0, 1),
+            size=(4.0, 3.0), shape=(7, 9)
+        )
+        right, up = plane_axes(normal, (0, 0, 1))
+        columns = np.linspace(-2.0, 2.0, 9)
+        rows = np.linspace(-1.5, 1.5, 7)
+        world = (np.array([8.0, 10.0, 2.5]) +
+                 rows[:, None, None] * up + columns[None, :, None] * right)
+        expected = trilinear_sample(self.volume, world / (1.0, 2.0, 0.5))
+        assert_allclose(image, expected, atol=1e-4)
+
+    def test_curve(self):
+        polyline = [(2.0, 4.0, 1.0), (6.0, 4.0, 1.0), (6.0, 12.0, 1.0)]
+        image = self.reformatter.sample_curve(
+            polyline, direction=(0, 0, 1), height=2.0, shape=(5, 13)
+        )
+        curve = resample_polyline(polyline, 13)
+        assert_allclose(curve[[0, 4, 12]], [polyline[0], (6.0, 4.0, 1.0),
+                                            polyline[2]])
+        # The middle row follows the curve
+        expected = trilinear_sample(self.volume, curve / (1.0, 2.0, 0.5))
+        assert_allclose(image[2], expected, atol=1e-4)
+
+    def test_threads_and_output(self):
+        self.reformatter.num_threads = 3
+        out = np.empty((100, 200), dtype=np.float32)
+        args = ((8.0, 11.0, 2.5), (0, 1, 0), (0, 0, 1), (20.0, 10.0),
+                (100, 200))
+        result = self.reformatter.sample_plane(*args, out=out)
+        self.assertIs(result, out)
+
+        self.reformatter.num_threads = 1
+        assert_allclose(self.reformatter.sample_plane(*args), out)
+
+        with self.assertRaises(ValueError):
+            self.reformatter.sample_plane(*args, out=np.empty((100, 200)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+from __future__ import division, unicode_literals
+
+import os
+import select
+import shutil
+import socket
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+from numpy.testing import assert_array_equal
+from traits.api import Int, List
+
+from ensemble.volren.render_server import (ABCRenderTarget, RenderClient,
+                                           RenderServer)
+
+
+class DummyTarget(ABCRenderTarget):
+    """ Records commands and renders the number of frames rendered so far.
+    """
+
+    commands = List
+
+    qualities = List
+
+    renders = Int
+
+    def apply_command(self, command):
+        self.commands.append(command)
+
+    def render(self, quality):
+        self.qualities.append(quality)
+        self.renders += 1
+        return np.full((4, 6, 3), self.renders, dtype=np.uint8)
+
+
+class TestRenderServer(unittest.TestCase):
+
+    def setUp(self):
+        self.target = DummyTarget()
+        self.server = RenderServer(target=self.target,
+                                   address=('127.0.0.1', 0))
+        address = self.server.listen()
+        self.client = RenderClient(address=address)
+        self.client.connect()
+        # Accept the connection and send the initial frame
+        self.server.poll(timeout=1.0)
+        self.server.poll(timeout=0.0)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def _frame_waiting(self):
+        readable, _, _ = select.select([self.client._socket], [], [], 0.1)
+        return bool(readable)
+
+    def _poll(self):
+        # Give the client's messages time to arrive
+        self.server.poll(timeout=1.0)
+
+    def test_initial_frame(self):
+        header, image = self.client.receive_frame()
+        self.assertEqual(header['frame'], 1)
+        self.assertEqual(header['quality'], 'default')
+        assert_array_equal(image, np.ones((4, 6, 3), dtype=np.uint8))
+
+    def test_commands_are_coalesced(self):
+        self.client.receive_frame()
+        self.client.set_clip_bounds([0, 10, 0, 10, 0, 10])
+        for x in range(5):
+            self.client.set_camera(position=(x, 0, 0))
+        self._poll()
+
+        self.assertEqual([c['type'] for c in self.target.commands],
+                         ['clip', 'camera'])
+        self.assertEqual(self.target.commands[-1]['position'], [4, 0, 0])
+        header, _ = self.client.receive_frame()
+        self.assertEqual(header['frame'], 2)
+        self.assertFalse(self._frame_waiting())
+
+    def test_interactive_quality(self):
+        self.client.receive_frame()
+        self.client.set_interacting(True)
+        self.client.set_camera(position=(1, 0, 0))
+        self._poll()
+        header, _ = self.client.receive_frame()
+        self.assertEqual(header['quality'], 'performance')
+
+        # The view is refined once the interaction stops
+        self.client.set_interacting(False)
+        self._poll()
+        header, _ = self.client.receive_frame()
+        self.assertEqual(header['quality'], 'default')
+
+    def test_frames_dropped_for_slow_client(self):
+        self.client.auto_ack = False
+        self.server.max_frames_in_flight = 2
+        self.client.receive_frame()
+        self.client.set_camera(position=(1, 0, 0))
+        self._poll()
+
+        # Two frames are unacknowledged, so the next views are held back
+        for x in range(2, 5):
+            self.client.set_camera(position=(x, 0, 0))
+            self._poll()
+        self.assertEqual(self.target.renders, 2)
+
+        header, _ = self.client.receive_frame()
+        self.client.ack(header['frame'])
+        self._poll()
+        self.assertEqual(self.target.renders, 3)
+        self.assertEqual(self.target.commands[-1]['position'], [4, 0, 0])
+        header, image = self.client.receive_frame()
+        self.assertEqual(header['frame'], 3)
+        assert_array_equal(image, 3)
+
+    def _assert_serves_new_client(self):
+        self.client = RenderClient(address=self.server.address)
+        self.client.connect()
+        self.server.poll(timeout=1.0)
+        self.server.poll(timeout=0.0)
+        header, _ = self.client.receive_frame()
+        self.assertEqual(header['frame'], self.target.renders)
+
+    def test_client_reset(self):
+        self.client.receive_frame()
+        # Closing with unread data and no lingering resets the connection
+        sock = self.client._socket
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                        struct.pack('ii', 1, 0))
+        self.client.set_camera(position=(1, 0, 0))
+        self.client.close()
+        self._poll()
+        self.assertIsNone(self.server._client)
+
+        self._assert_serves_new_client()
+
+    def test_malformed_message(self):
+        self.client.receive_frame()
+        self.client.send({'type': 'ack'})
+        self._poll()
+        self.assertIsNone(self.server._client)
+        self.client.close()
+
+        self._assert_serves_new_client()
+
+
+class TestUnixRenderServer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_restart_on_same_path(self):
+        path = os.path.join(self.directory, 'render.sock')
+        for _ in range(2):
+            server = RenderServer(target=DummyTarget(), address=path)
+            server.listen()
+            client = RenderClient(address=path)
+            client.connect()
+            server.poll(timeout=1.0)
+            server.poll(timeout=0.0)
+            header, _ = client.receive_frame()
+            self.assertEqual(header['frame'], 1)
+            client.close()
+            server.close()
+            self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
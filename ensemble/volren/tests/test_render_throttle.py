@@ -0,0 +1,29 @@
+import unittest
+
+from ensemble.volren.render_throttle import RenderThrottle
+
+
+class RenderThrottleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.throttle = RenderThrottle(callback=lambda: self.calls.append(1),
+                                       interval=60.0)
+
+    def test_first_request_is_immediate(self):
+        self.throttle.request()
+        self.assertEqual(len(self.calls), 1)
+
+    def test_burst_is_coalesced(self):
+        for i in range(10):
+            self.throttle.request()
+        self.assertEqual(len(self.calls), 1)
+
+        # The trailing request is applied on flush, exactly once.
+        self.throttle.flush()
+        self.throttle.flush()
+        self.assertEqual(len(self.calls), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
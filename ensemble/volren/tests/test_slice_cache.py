@@ -0,0 +1,177 @@
+from __future__ import division, unicode_literals
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from ensemble.volren.slice_cache import (SliceCache, extract_slice,
+                                         is_memory_mapped)
+
+
+class ChunkedArray(object):
+    """ A stand-in for a chunked h5py dataset which records its reads.
+    """
+
+    def __init__(self, array, chunks):
+        self.array = array
+        self.chunks = chunks
+        self.shape = array.shape
+        self.reads = []
+
+    def __getitem__(self, index):
+        self.reads.append(index)
+        return self.array[index]
+
+
+class FailingArray(object):
+    """ An array-like object whose reads fail.
+    """
+
+    shape = (4, 5, 6)
+
+    def __getitem__(self, index):
+        raise IOError('Unreadable')
+
+
+class TestSliceCache(unittest.TestCase):
+
+    def setUp(self):
+        data = np.arange(4 * 5 * 6, dtype=np.float32).reshape(4, 5, 6)
+        self.data = np.asfortranarray(data)
+        self.cache = SliceCache(data=self.data, capacity=4)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_extract_slice(self):
+        for axis in range(3):
+            slices = [slice(None)] * 3
+            slices[axis] = 2
+            array = extract_slice(self.data, axis, 2)
+            assert_array_equal(array, self.data[tuple(slices)])
+            self.assertTrue(array.flags.f_contiguous)
+
+        # Z slices of Fortran ordered data are not copied
+        self.assertTrue(np.shares_memory(extract_slice(self.data, 2, 3),
+                                         self.data))
+
+    def test_get_slice_is_cached(self):
+        array = self.cache.get_slice(0, 1)
+        self.assertIs(self.cache.get_slice(0, 1), array)
+
+    def test_least_recently_used_evicted(self):
+        first = self.cache.get_slice(2, 0)
+        for index in range(1, 4):
+            self.cache.get_slice(2, index)
+        # Use the first slice again, so that the second one is evicted
+        self.assertIs(self.cache.get_slice(2, 0), first)
+        self.cache.get_slice(2, 4)
+
+        self.assertEqual(list(self.cache._slices),
+                         [(2, 2), (2, 3), (2, 0), (2, 4)])
+
+    def test_prefetch(self):
+        self.cache.prefetch(1, 2, direction=1)
+        self.cache.prefetch(2, 0)
+        self.cache.close()
+
+        self.assertEqual(sorted(self.cache._slices),
+                         [(1, 3), (1, 4), (2, 1), (2, 2)])
+        assert_array_equal(self.cache.get_slice(1, 3), self.data[:, 3])
+
+    def test_request_slice(self):
+        results = []
+
+        def callback(axis, index, array):
+            results.append((axis, index, array))
+
+        self.assertIsNone(self.cache.request_slice(0, 2, callback))
+        self.cache.close()
+
+        self.assertEqual(len(results), 1)
+        axis, index, array = results[0]
+        self.assertEqual((axis, index), (0, 2))
+        assert_array_equal(array, self.data[2])
+        # Now it is cached
+        self.assertIs(self.cache.request_slice(0, 2, callback), array)
+        self.assertEqual(len(results), 1)
+
+    def test_request_slice_read_error(self):
+        results = []
+
+        def callback(axis, index, array):
+            results.append((axis, index, array))
+
+        records = []
+        handler = logging.Handler(level=logging.ERROR)
+        handler.emit = records.append
+        logger = logging.getLogger('ensemble.volren.slice_cache')
+        logger.addHandler(handler)
+        try:
+            self.cache.data = FailingArray()
+            self.assertIsNone(self.cache.request_slice(0, 2, callback))
+            self.cache.close()
+        finally:
+            logger.removeHandler(handler)
+
+        # The error is logged, the caller is told, and the slice can be
+        # requested again
+        self.assertEqual(len(records), 1)
+        self.assertEqual(results, [(0, 2, None)])
+        self.assertEqual(self.cache._pending, {})
+        self.assertEqual(self.cache._slices, {})
+
+    def test_is_memory_mapped(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'volume.npy')
+            np.save(filename, np.asfortranarray(self.data))
+            mapped = np.load(filename, mmap_mode='r')
+            self.assertTrue(is_memory_mapped(mapped))
+            # Fortran ordered views of the map are plain arrays
+            view = np.asfortranarray(mapped)
+            self.assertNotIsInstance(view, np.memmap)
+            self.assertTrue(is_memory_mapped(view))
+            self.assertTrue(is_memory_mapped(view[1:3]))
+            del mapped, view
+        finally:
+            shutil.rmtree(tmpdir)
+
+        self.assertFalse(is_memory_mapped(self.data))
+        self.assertFalse(is_memory_mapped(ChunkedArray(self.data, None)))
+
+    def test_chunk_aligned_reads(self):
+        source = ChunkedArray(self.data, chunks=(2, 5, 4))
+        cache = SliceCache(data=source, capacity=8, prefetch_distance=1)
+
+        assert_array_equal(cache.get_slice(2, 5), self.data[:, :, 5])
+        # The whole chunk was read at once
+        self.assertEqual(source.reads, [(slice(None), slice(None),
+                                         slice(4, 6))])
+        self.assertEqual(sorted(cache._slices), [(2, 4), (2, 5)])
+
+        cache.prefetch(0, 0, direction=1)
+        cache.close()
+        self.assertEqual(len(source.reads), 2)
+        assert_array_equal(cache.get_slice(0, 1), self.data[1])
+        self.assertEqual(len(source.reads), 2)
+
+    def test_load_slices(self):
+        self.cache.load_slices = True
+        array = self.cache.get_slice(2, 3)
+        self.assertFalse(np.shares_memory(array, self.data))
+        assert_array_equal(array, self.data[:, :, 3])
+
+    def test_data_change_clears_cache(self):
+        self.cache.get_slice(0, 0)
+        self.cache.data = self.data * 2
+        assert_array_equal(self.cache.get_slice(0, 0), self.data[0] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+
+import numpy as np
+
+from ensemble.ctf.api import TransferFunction
+from ensemble.volren.update_scheduler import UpdateScheduler
+from ensemble.volren.volume_data import VolumeData
+from ensemble.volren.volume_renderer import VolumeRenderer
+from ensemble.volren.volume_viewer import VolumeViewer
+
+
+class UpdateSchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.scheduler = UpdateScheduler()
+        for name, depends_on in [('a', ()), ('b', ('a',)), ('c', ()),
+                                 ('d', ('b', 'c'))]:
+            self.scheduler.add_task(name, self._recorder(name),
+                                    depends_on=depends_on)
+
+    def _recorder(self, name):
+        return lambda: self.calls.append(name)
+
+    def test_invalidate_runs_dependents(self):
+        self.scheduler.invalidate('a')
+        self.assertEqual(self.calls, ['a', 'b', 'd'])
+
+        del self.calls[:]
+        self.scheduler.invalidate('c')
+        self.assertEqual(self.calls, ['c', 'd'])
+
+    def test_batch_runs_each_task_once(self):
+        with self.scheduler.batch():
+            self.scheduler.invalidate('c')
+            self.scheduler.invalidate('b')
+            with self.scheduler.batch():
+                self.scheduler.invalidate('a', 'c')
+            self.assertEqual(self.calls, [])
+        self.assertEqual(self.calls, ['a', 'b', 'c', 'd'])
+
+    def test_task_invalidates_later_task(self):
+        self.scheduler.add_task('e', self._recorder('e'))
+        self.scheduler.add_task('f', lambda: self.scheduler.invalidate('e'),
+                                depends_on=('a',))
+        self.scheduler.invalidate('f')
+        self.assertEqual(self.calls, ['e'])
+
+    def test_unknown_task(self):
+        with self.assertRaises(ValueError):
+            self.scheduler.invalidate('z')
+        with self.assertRaises(ValueError):
+            self.scheduler.add_task('e', self._recorder('e'),
+                                    depends_on=('z',))
+
+
+class VolumeRendererUpdatesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        function = TransferFunction()
+        volume = np.arange(4 * 5 * 6, dtype=np.float32).reshape(4, 5, 6)
+        self.volume_data = VolumeData(raw_data=volume)
+        self.renderer = VolumeRenderer(data=self.volume_data,
+                                       colors=function.color,
+                                       opacities=function.opacity)
+        self.calls = []
+        for name in ('data_range', 'render_data', 'transfer_function'):
+            probe = 'probe_' + name
+            self.renderer.scheduler.add_task(
+                probe, lambda name=name: self.calls.append(name),
+                depends_on=(name,)
+            )
+
+    def test_raw_data_change(self):
+        self.volume_data.raw_data = np.ones((4, 5, 6), dtype=np.float32) * 3
+        self.assertEqual(self.calls,
+                         ['data_range', 'render_data', 'transfer_function'])
+        self.assertEqual((self.renderer.vmin, self.renderer.vmax), (3, 3))
+
+    def test_mask_change_keeps_transfer_function(self):
+        self.volume_data.mask_data = np.ones((4, 5, 6), dtype=np.uint8)
+        self.assertEqual(self.calls, ['render_data'])
+
+    def test_batched_changes(self):
+        with self.renderer.scheduler.batch():
+            self.volume_data.raw_data = np.ones((4, 5, 6), dtype=np.float32)
+            self.volume_data.quantization_window = 'percentile'
+            self.renderer.global_alpha = 0.5
+        self.assertEqual(self.calls,
+                         ['data_range', 'render_data', 'transfer_function'])
+
+
+class VolumeViewerUpdatesTestCase(unittest.TestCase):
+
+    def test_renderer_created_with_histogram(self):
+        volume = np.arange(4 * 5 * 6, dtype=np.uint8).reshape(4, 5, 6)
+        viewer = VolumeViewer()
+        viewer.trait_setq(volume_data=VolumeData(raw_data=volume),
+                          histogram_bins=12)
+
+        # Creating the renderer computes the histogram without reading
+        # volume_renderer again
+        viewer.volume_renderer
+        counts, bin_edges = viewer.ctf_editor.histogram
+        np.testing.assert_array_equal(counts, 10)
+        self.assertEqual((bin_edges[0], bin_edges[-1]), (0, 119))
+
+
+if __name__ == "__main__":
+    unittest.main()
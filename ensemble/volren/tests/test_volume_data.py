@@ -0,0 +1,324 @@
+from __future__ import division, unicode_literals
+
+import unittest
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+from traits.testing.unittest_tools import UnittestTools
+
+from ensemble.volren.volume_data import VolumeData, _brick_ranges
+from ensemble.volren.volume_data import _array_from_image_data
+from ensemble.volren.volume_mask import BitMask, LabelMask
+
+
+class BrickRangesTestCase(unittest.TestCase):
+
+    def test_brick_ranges_partial_bricks(self):
+        array = np.asfortranarray(np.random.uniform(size=(37, 20, 33)))
+        ranges = _brick_ranges(array, 16)
+
+        self.assertEqual(ranges.shape, (3, 2, 3, 2))
+        brick = array[16:32, 0:16, 32:]
+        self.assertEqual(ranges[1, 0, 2, 0], brick.min())
+        self.assertEqual(ranges[1, 0, 2, 1], brick.max())
+
+    def test_visible_bounds(self):
+        volume = np.zeros((32, 32, 32), dtype=np.uint8)
+        volume[8:16, 8:16, 8:16] = 200
+        volume_data = VolumeData(raw_data=volume)
+
+        bounds = volume_data.visible_bounds(lambda lows, highs: highs > 100)
+        self.assertIsNotNone(bounds)
+        # Only the middle of the volume has visible data.
+        full_bounds = volume_data.render_data.bounds
+        self.assertGreater(bounds[0], full_bounds[0])
+        self.assertLess(bounds[1], full_bounds[1])
+
+        none_visible = volume_data.visible_bounds(
+            lambda lows, highs: np.zeros_like(lows, dtype=bool)
+        )
+        self.assertIsNone(none_visible)
+
+    def test_brick_ranges_invalidated(self):
+        volume = np.zeros((32, 32, 32), dtype=np.uint8)
+        volume_data = VolumeData(raw_data=volume)
+        ranges = volume_data.brick_ranges
+        assert_array_equal(ranges, 0.0)
+
+        volume_data.raw_data = np.ones((32, 32, 32), dtype=np.uint8)
+        self.assertTrue((volume_data.brick_ranges[..., 1] > 0.5).all())
+
+
+class UpdateRegionTestCase(UnittestTools, unittest.TestCase):
+
+    def test_update_region_matches_full_rebuild(self):
+        volume = np.random.uniform(size=(40, 32, 24))
+        volume_data = VolumeData(raw_data=volume)
+        render_data = volume_data.render_data
+        new_slice = np.random.uniform(size=(40, 32))
+
+        with self.assertTraitChanges(volume_data, 'region_updated'):
+            volume_data.update_region((slice(None), slice(None), 10),
+                                      new_slice)
+
+        # The render data is updated in place
+        self.assertIs(volume_data.render_data, render_data)
+
+        volume[:, :, 10] = new_slice
+        expected = VolumeData(raw_data=volume).render_data
+        assert_allclose(_array_from_image_data(render_data),
+                        _array_from_image_data(expected))
+
+    def test_update_region_before_render_data(self):
+        volume_data = VolumeData(raw_data=np.zeros((8, 8, 8)))
+        volume_data.update_region(np.s_[2:4, :, :], 1.0)
+
+        self.assertEqual(volume_data.raw_data[2:4].min(), 1.0)
+        self.assertEqual(volume_data.raw_data[4:].max(), 0.0)
+
+    def test_update_region_writes_assigned_array(self):
+        volume = np.zeros((8, 8, 8), order='F')
+        volume_data = VolumeData(raw_data=volume)
+        volume_data.update_region(np.s_[2:4, :, :], 1.0)
+
+        self.assertEqual(volume[2:4].min(), 1.0)
+
+    def test_update_region_keeps_quantization_window(self):
+        volume = np.random.uniform(0.0, 10.0, size=(24, 24, 24))
+        volume_data = VolumeData(raw_data=volume, render_dtype='uint16')
+        render_data = volume_data.render_data
+        window = volume_data.render_window
+
+        volume_data.update_region(np.s_[:, :, 5], 5.0)
+        self.assertEqual(volume_data.render_window, window)
+        self.assertIs(volume_data.render_data, render_data)
+
+    def test_update_region_widens_quantization_window(self):
+        volume = np.random.uniform(0.0, 10.0, size=(24, 24, 24))
+        volume_data = VolumeData(raw_data=volume, render_dtype='uint16')
+        render_data = volume_data.render_data
+
+        with self.assertTraitChanges(volume_data, 'region_updated') as result:
+            volume_data.update_region(np.s_[:, :, 5], 20.0)
+
+        # The new values are not clipped to the old window
+        self.assertEqual(volume_data.render_window[1], 20.0)
+        self.assertIsNone(result.events[0][-1][1])
+        self.assertIsNot(volume_data.render_data, render_data)
+        volume[:, :, 5] = 20.0
+        expected = VolumeData(raw_data=volume, render_dtype='uint16')
+        assert_array_equal(_array_from_image_data(volume_data.render_data),
+                           _array_from_image_data(expected.render_data))
+
+
+class QuantizationTestCase(unittest.TestCase):
+
+    def test_native_keeps_values(self):
+        volume = np.random.uniform(-10.0, 10.0, size=(16, 16, 16))
+        volume_data = VolumeData(raw_data=volume, render_dtype='native')
+
+        self.assertIsNone(volume_data.render_window)
+        render_array = _array_from_image_data(volume_data.render_data)
+        self.assertEqual(render_array.dtype, np.float64)
+
+    def test_auto_quantizes_floats_by_default(self):
+        # Linear, so that the cubic resampling does not overshoot the window
+        x, y, z = np.indices((16, 16, 16))
+        volume = 0.5 * x + 0.25 * y - z - 0.1
+        volume_data = VolumeData(raw_data=volume)
+
+        render_array = _array_from_image_data(volume_data.render_data)
+        self.assertEqual(render_array.dtype, np.uint16)
+        low, high = volume_data.render_window
+        self.assertEqual((low, high), (volume.min(), volume.max()))
+        assert_allclose(volume_data.render_values([low, high]),
+                        [0, np.iinfo(np.uint16).max])
+
+        # The values are off by less than a step of the render type. The
+        # last render grid points lie past the raw data.
+        native = VolumeData(raw_data=volume, render_dtype='native')
+        native_array = _array_from_image_data(native.render_data)
+        inside = np.s_[:240, :240, :240]
+        assert_allclose(render_array[inside],
+                        volume_data.render_values(native_array[inside]),
+                        atol=1.0)
+
+    def test_auto_keeps_small_integers(self):
+        volume = np.zeros((16, 16, 16), dtype=np.uint8)
+        volume_data = VolumeData(raw_data=volume, render_dtype='auto')
+
+        self.assertIsNone(volume_data.render_window)
+        self.assertEqual(volume_data.render_values(42), 42)
+        render_array = _array_from_image_data(volume_data.render_data)
+        self.assertEqual(render_array.dtype, np.uint8)
+
+    def test_percentile_window(self):
+        volume = np.arange(16 ** 3, dtype=float).reshape((16, 16, 16))
+        volume_data = VolumeData(raw_data=volume, render_dtype='uint8',
+                                 quantization_window='percentile',
+                                 quantization_percentiles=(10.0, 90.0))
+
+        low, high = volume_data.render_window
+        self.assertGreater(low, volume.min())
+        self.assertLess(high, volume.max())
+
+    def test_constant_volume(self):
+        volume = np.full((16, 16, 16), 3.0)
+        volume_data = VolumeData(raw_data=volume, render_dtype='uint16')
+
+        # The value is in the middle of the render type's range
+        self.assertEqual(volume_data.render_window, (2.5, 3.5))
+        max_value = np.iinfo(np.uint16).max
+        assert_allclose(volume_data.render_values(3.0), max_value / 2)
+        # The last render grid points lie past the raw data
+        render_array = _array_from_image_data(volume_data.render_data)
+        assert_array_equal(render_array[:240, :240, :240],
+                           np.rint(max_value / 2))
+
+
+class CompactMaskTestCase(UnittestTools, unittest.TestCase):
+
+    def test_toggle_labels_reuses_resampled_data(self):
+        labels = np.zeros((256, 256, 256), dtype=np.uint8)
+        labels[:128] = 1
+        labels[128:] = 2
+        mask = LabelMask.from_array(labels)
+        volume_data = VolumeData(raw_data=np.ones((32, 32, 32)), mask=mask)
+        # The last render grid points lie past the raw data
+        inside = np.s_[:, :240, :240]
+        render_array = _array_from_image_data(volume_data.render_data)
+        self.assertTrue((render_array[inside][:240] > 0).all())
+        resampled_data = volume_data._resampled_data
+
+        with self.assertTraitChanges(volume_data, 'mask_updated'):
+            mask.enabled_labels.remove(2)
+
+        render_array = _array_from_image_data(volume_data.render_data)
+        self.assertTrue((render_array[inside][:128] > 0).all())
+        self.assertFalse(render_array[128:].any())
+        self.assertIs(volume_data._resampled_data, resampled_data)
+
+    def test_label_mask_resampled_once(self):
+        labels = np.random.randint(0, 5, size=(30, 17, 23)).astype(np.uint8)
+        mask = LabelMask.from_array(labels, enabled_labels={1, 3})
+        mask_bounds = (3.0, 20.0, -4.0, 30.0, 0.0, 40.0)
+        volume_data = VolumeData(raw_data=np.ones((32, 32, 32)), mask=mask,
+                                 mask_bounds=mask_bounds)
+        volume_data.render_data
+        render_labels = volume_data._render_labels
+
+        for enabled_labels in ({1, 3}, {4}, set()):
+            mask.enabled_labels = enabled_labels
+            render_mask = volume_data._get_render_mask()
+            self.assertIs(volume_data._render_labels, render_labels)
+
+            # The same as resampling the dense mask
+            dense = VolumeData(raw_data=np.ones((32, 32, 32)),
+                               mask=BitMask.from_array(mask.to_array()),
+                               mask_bounds=mask_bounds)
+            assert_array_equal(render_mask, dense._get_render_mask())
+
+
+class MaskResamplingTestCase(unittest.TestCase):
+
+    def test_raw_resolution_mask(self):
+        volume_data = VolumeData(raw_data=np.ones((32, 32, 32)))
+        mask = np.zeros((32, 32, 32), dtype=np.uint8)
+        mask[8:24, 8:24, 8:24] = 255
+        volume_data.mask_data = mask
+
+        render_array = _array_from_image_data(volume_data.render_data)
+        self.assertEqual(render_array.shape, (256, 256, 256))
+        self.assertEqual(np.count_nonzero(render_array), 128 ** 3)
+        self.assertTrue(render_array[64:192, 64:192, 64:192].all())
+
+    def test_max_pooling_keeps_thin_features(self):
+        volume_data = VolumeData(raw_data=np.ones((32, 32, 32)))
+        mask = np.zeros((512, 512, 512), dtype=bool)
+        mask[101, 200, 300] = True
+
+        volume_data.mask_data = mask
+        render_array = _array_from_image_data(volume_data.render_data)
+        self.assertEqual(np.count_nonzero(render_array), 0)
+
+        volume_data.mask_resampling = 'max'
+        render_array = _array_from_image_data(volume_data.render_data)
+        self.assertEqual(np.count_nonzero(render_array), 1)
+        self.assertTrue(render_array[50, 100, 150])
+
+    def test_mask_bounds(self):
+        volume_data = VolumeData(raw_data=np.ones((32, 32, 32)))
+        # A mask covering only the lower half of the volume along x
+        volume_data.mask_bounds = (0.0, 16.0, 0.0, 32.0, 0.0, 32.0)
+        volume_data.mask_data = np.ones((4, 4, 4))
+
+        render_array = _array_from_image_data(volume_data.render_data)
+        # The last render grid points lie past the raw data
+        self.assertTrue(render_array[:128, :240, :240].all())
+        self.assertFalse(render_array[128:].any())
+
+    def test_resampled_mask_is_cached(self):
+        volume_data = VolumeData(raw_data=np.ones((32, 32, 32)),
+                                 mask_data=np.ones((32, 32, 32)))
+        volume_data.render_data
+        render_mask = volume_data._render_mask
+
+        volume_data.render_dtype = 'uint8'
+        volume_data.render_data
+        self.assertIs(volume_data._render_mask, render_mask)
+
+
+class GradientTestCase(unittest.TestCase):
+
+    def test_gradients_of_ramp(self):
+        ramp = np.arange(32, dtype=float)[:, np.newaxis, np.newaxis]
+        volume = np.tile(ramp, (1, 32, 32))
+        volume_data = VolumeData(raw_data=volume)
+
+        magnitude = volume_data.gradient_magnitude
+        self.assertEqual(magnitude.shape, (256, 256, 256))
+        # Away from the edges, where the cubic resampling and the render
+        # points past the raw data distort the ramp
+        interior = (slice(16, -16),) * 3
+        assert_allclose(magnitude[interior], magnitude[interior].mean(),
+                        rtol=1e-3)
+
+    def test_gradients_are_cached(self):
+        volume_data = VolumeData(raw_data=np.random.uniform(size=(8, 8, 8)))
+        magnitude = volume_data.gradient_magnitude
+        self.assertIs(volume_data.gradient_magnitude, magnitude)
+
+        volume_data.raw_data = np.zeros((8, 8, 8))
+        self.assertIsNot(volume_data.gradient_magnitude, magnitude)
+
+    def test_gradient_histogram_axes(self):
+        ramp = np.linspace(0, 255, 32).astype(np.uint8)
+        volume = np.tile(ramp[:, np.newaxis, np.newaxis], (1, 32, 32))
+        volume_data = VolumeData(raw_data=volume)
+
+        counts, ranges = volume_data.gradient_histogram(bins=(16, 8))
+        value_range, gradient_range = ranges
+        self.assertEqual(counts.shape, (16, 8))
+        # Every point of the render grid is counted
+        self.assertEqual(counts.sum(), 256 ** 3)
+        self.assertEqual(tuple(value_range), (0, 255))
+        max_gradient = volume_data.gradient_magnitude.max()
+        self.assertEqual(gradient_range, (0.0, max_gradient))
+        # The ramp only has points at its lowest and highest gradients
+        self.assertTrue(counts[:, 0].any())
+        self.assertTrue(counts[:, -1].any())
+
+    def test_gradient_histogram_of_quantized_data(self):
+        ramp = np.linspace(-1.0, 1.0, 32)
+        volume = np.tile(ramp[:, np.newaxis, np.newaxis], (1, 32, 32))
+        volume_data = VolumeData(raw_data=volume, render_dtype='uint16')
+
+        counts, ranges = volume_data.gradient_histogram(bins=(16, 8))
+        value_range, _ = ranges
+        # The value axis is in quantized units
+        self.assertEqual(tuple(value_range), (0.0, 65535.0))
+        self.assertEqual(counts.sum(), 256 ** 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
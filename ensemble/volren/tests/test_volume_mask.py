@@ -0,0 +1,79 @@
+from __future__ import unicode_literals
+
+import unittest
+
+import numpy as np
+from numpy.testing import assert_array_equal
+from traits.testing.unittest_tools import UnittestTools
+
+from ensemble.volren.volume_mask import BitMask, LabelMask
+
+
+class BitMaskTestCase(unittest.TestCase):
+
+    def test_roundtrip(self):
+        dense = np.random.uniform(size=(7, 5, 3)) > 0.5
+        mask = BitMask.from_array(dense.astype(np.uint8) * 255)
+
+        self.assertEqual(mask.shape, (7, 5, 3))
+        self.assertEqual(mask.packed.size, 14)
+        result = mask.to_array()
+        self.assertEqual(result.dtype, bool)
+        self.assertTrue(result.flags.f_contiguous)
+        assert_array_equal(result, dense)
+
+
+class LabelMaskTestCase(UnittestTools, unittest.TestCase):
+
+    def setUp(self):
+        labels = np.zeros((4, 4, 4), dtype=np.uint16)
+        labels[0] = 1
+        labels[1] = 2
+        labels[2] = 500
+        self.labels = labels
+
+    def test_all_labels_enabled_by_default(self):
+        mask = LabelMask.from_array(self.labels)
+
+        self.assertEqual(mask.enabled_labels, {1, 2, 500})
+        assert_array_equal(mask.to_array(), self.labels != 0)
+
+    def test_toggle_labels(self):
+        mask = LabelMask.from_array(self.labels, enabled_labels={2})
+        assert_array_equal(mask.to_array(), self.labels == 2)
+
+        with self.assertTraitChanges(mask, 'updated'):
+            mask.enabled_labels.add(500)
+        assert_array_equal(mask.to_array(), np.isin(self.labels, [2, 500]))
+
+        with self.assertTraitChanges(mask, 'updated'):
+            mask.enabled_labels = set()
+        self.assertFalse(mask.to_array().any())
+
+    def test_sparse_large_labels(self):
+        # Too wide a range of labels for a lookup table
+        labels = self.labels.astype(np.int64) * 10 ** 9
+        mask = LabelMask.from_array(labels, enabled_labels={2 * 10 ** 9})
+        assert_array_equal(mask.to_array(), self.labels == 2)
+
+    def test_negative_labels(self):
+        labels = np.zeros((4, 4, 4), dtype=np.int8)
+        labels[0] = 1
+        labels[1] = 2
+        labels[2] = 100
+        labels[3] = -100
+        mask = LabelMask.from_array(labels, enabled_labels={-100, 2})
+        assert_array_equal(mask.to_array(), np.isin(labels, [-100, 2]))
+
+    def test_select_resampled_labels(self):
+        mask = LabelMask.from_array(self.labels, enabled_labels={1, 500})
+        # The labels of every other voxel
+        labels = self.labels[::2, ::2, ::2]
+        assert_array_equal(mask.select(labels), np.isin(labels, [1, 500]))
+
+        mask.labels = self.labels + 1
+        assert_array_equal(mask.to_array(), self.labels == 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,19 +1,28 @@
 from __future__ import division, unicode_literals
 
 import os
+import shutil
+import tempfile
 import unittest
 
 import numpy as np
 import six
 
 import vtk
+from traits.api import List
 from traits_enaml.testing.enaml_test_assistant import EnamlTestAssistant
 from tvtk.api import tvtk
 
+from ensemble.ctf.api import TransferFunction2D
+from ensemble.ctf.transfer_function_2d import GradientRegion
+from ensemble.volren.render_server import ViewerRenderTarget
 from ensemble.volren.volume_axes import VolumeAxes
 from ensemble.volren.volume_bounding_box import VolumeBoundingBox
 from ensemble.volren.volume_cut_planes import VolumeCutPlanes
 from ensemble.volren.volume_data import VolumeData
+from ensemble.volren.volume_renderer import (VolumeRenderer,
+                                             TRANSFER_FUNCTION_2D_SHAPE)
+from ensemble.volren.volume_scene_member import ABCVolumeSceneMember
 from ensemble.volren.volume_viewer import VolumeViewer, CLIP_MAX
 
 
@@ -27,6 +36,41 @@ def count_types(type_class, obj_list):
     return sum(int(isinstance(obj, type_class)) for obj in obj_list)
 
 
+class AddOnlySceneMember(ABCVolumeSceneMember):
+    """ A scene member which only implements `add_actors_to_scene`.
+    """
+
+    def add_actors_to_scene(self, scene_model, volume_actor):
+        pass
+
+
+class RecordingSceneMember(AddOnlySceneMember):
+    """ A scene member which records the volume data it is updated for.
+    """
+
+    volume_data = List
+
+    def update_for_volume(self, scene_model, volume_actor, volume_data):
+        self.volume_data.append(volume_data)
+
+
+def ramp_volume_data():
+    """ A volume whose values rise from 0 to 255 along the first axis.
+    """
+    ramp = np.linspace(0, 255, 32).astype(np.uint8)
+    volume = np.tile(ramp[:, np.newaxis, np.newaxis], (1, 32, 32))
+    return VolumeData(raw_data=volume)
+
+
+def low_values_function():
+    """ A 2D transfer function which shows the lower half of the values.
+    """
+    return TransferFunction2D(regions=[
+        GradientRegion(value_range=(0.0, 0.5), gradient_range=(0.0, 1.0),
+                       color=(1.0, 0.0, 0.0), opacity=1.0),
+    ])
+
+
 # We use a newer version of VTK (8) which needs a newer version of OpenGL 3.2
 # which is not available on Travis CI at the moment
 @unittest.skipIf(os.environ.get('IS_CI', None), "Travis OpenGL issues")
@@ -119,15 +163,41 @@ enamldef MainView(Container): view:
         # to VTK, see `volume_data._resample_data`.
         self.assertEqual(points_without_mask, 256 * 256 * 256)
 
-        # Now apply mask
+        # Now apply mask. It is given at the raw data's resolution and is
+        # resampled onto the render grid.
         mask_data = self._example_volume_mask(volume)
         self.viewer.volume_data.mask_data = mask_data
         points_with_mask = volume_data.render_data.number_of_points
-        self.assertEqual(points_with_mask, mask_data.size)
+        self.assertEqual(points_with_mask, 256 * 256 * 256)
 
     def test_renderer_clipping_bounds(self):
         self.assertEqual(self.viewer.volume_renderer.clip_bounds, CLIP_BOUNDS)
 
+    def test_clip_bounds_update_mapper_planes(self):
+        renderer = self.viewer.volume_renderer
+        renderer.skip_empty_space = False
+        mapper = renderer.volume.volume.mapper
+        planes = list(mapper.clipping_planes)
+        self.assertEqual(len(planes), 6)
+        for plane in planes:
+            self.assertIsInstance(plane, tvtk.Plane)
+
+        self.viewer.clip_bounds = [CLIP_MAX // 4, CLIP_MAX // 2] * 3
+        renderer.flush()
+
+        # The same planes are moved to a quarter and half of the volume
+        updated = list(mapper.clipping_planes)
+        self.assertEqual(len(updated), 6)
+        for plane, updated_plane in zip(planes, updated):
+            self.assertIs(updated_plane, plane)
+        bounds = renderer.data.bounds
+        for axis in range(3):
+            min_plane, max_plane = planes[2*axis:2*axis+2]
+            self.assertAlmostEqual(min_plane.origin[axis], bounds[axis] / 4)
+            self.assertAlmostEqual(max_plane.origin[axis], bounds[axis] / 2)
+            self.assertEqual(min_plane.normal[axis], 1.0)
+            self.assertEqual(max_plane.normal[axis], -1.0)
+
     def test_renderer_screenshot(self):
         # With default resolution
         image_array = self.viewer.screenshot()
@@ -143,6 +213,187 @@ enamldef MainView(Container): view:
         self.assertTrue(image_array.shape[-1] == 3)
         self.assertEqual(s2 / s1, magnification * magnification)
 
+    def test_renderer_screenshot_into_buffer(self):
+        image_array = self.viewer.screenshot()
+        out = np.zeros_like(image_array)
+        result = self.viewer.screenshot(out=out)
+        self.assertIs(result, out)
+        np.testing.assert_array_equal(out, image_array)
+
+        with self.assertRaises(ValueError):
+            self.viewer.screenshot(out=np.zeros((1, 1, 3), dtype=np.uint8))
+
+    def test_renderer_screenshot_modes(self):
+        rgb = self.viewer.screenshot()
+        height, width, _ = rgb.shape
+
+        rgba = self.viewer.screenshot(mode='rgba')
+        self.assertEqual(rgba.shape, (height, width, 4))
+
+        depth = self.viewer.screenshot(mode='depth')
+        self.assertEqual(depth.shape, (height, width))
+        self.assertEqual(depth.dtype, np.float32)
+
+    def test_renderer_export_screenshot(self):
+        image_array = self.viewer.screenshot()
+        height, width, _ = image_array.shape
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'image.npy')
+            image = self.viewer.export_screenshot(filename, magnification=2)
+            self.assertEqual(image.shape, (2 * height, 2 * width, 3))
+            del image
+
+            loaded = np.load(filename)
+            self.assertEqual(loaded.shape, (2 * height, 2 * width, 3))
+            self.assertTrue(loaded.any())
+        finally:
+            shutil.rmtree(tmpdir)
+
+        # The camera is restored afterwards
+        np.testing.assert_array_equal(self.viewer.screenshot(), image_array)
+
+    def test_render_target(self):
+        target = ViewerRenderTarget(viewer=self.viewer)
+        target.apply_command({'type': 'clip', 'bounds': [0, 10, 0, 10, 0, 10]})
+        self.assertEqual(self.viewer.clip_bounds, [0, 10, 0, 10, 0, 10])
+
+        image = target.render('performance')
+        self.assertEqual(self.viewer.volume_renderer.render_quality,
+                         'performance')
+        self.assertEqual(image.shape, self.viewer.screenshot().shape)
+        # The frame buffer is reused
+        self.assertIs(target.render('default'), image)
+
+    def test_cut_plane_properties_render_once(self):
+        cut_planes = self.viewer.scene_members['cut_planes']
+        render_window = self.viewer.model.scene.render_window
+        renders = []
+        render_window.add_observer('StartEvent',
+                                   lambda obj, event: renders.append(event))
+
+        cut_planes.cut_brightness = 0.5
+        cut_planes._render_throttle.flush()
+        self.assertEqual(len(renders), 1)
+
+    def test_volume_data_swap_updates_members(self):
+        bbox = self.viewer.scene_members['bbox']
+        axes = self.viewer.scene_members['axes']
+        outline = bbox.outline
+        cube_axes = axes.cube_axes
+
+        volume = np.zeros((16, 32, 64), dtype=np.uint8)
+        volume[0, 0, 0] = 255
+        self.viewer.volume_data = VolumeData(raw_data=volume,
+                                             spacing=(4.0, 2.0, 1.0))
+
+        # The actors are reused, with the bounds of the new volume
+        bounds = self.viewer.volume_renderer.actor.bounds
+        self.assertIs(bbox.outline, outline)
+        self.assertIs(axes.cube_axes, cube_axes)
+        np.testing.assert_allclose(outline.output.bounds, bounds)
+        np.testing.assert_allclose(cube_axes.bounds, bounds)
+
+    def test_volume_data_swap_updates_raw_cut_planes(self):
+        cut_planes = self.viewer.scene_members['cut_planes']
+        cut_planes.slice_mode = 'raw'
+        # The viewer gives the cut planes its volume data
+        self.assertIs(cut_planes.volume_data, self.viewer.volume_data)
+        self.assertEqual(sorted(cut_planes._raw_slice_actors), ['x', 'y', 'z'])
+
+        volume_data = ramp_volume_data()
+        self.viewer.volume_data = volume_data
+        self.assertIs(cut_planes.volume_data, volume_data)
+        self.assertIs(cut_planes.slice_cache.data, volume_data.raw_data)
+
+        cut_planes.slice_mode = 'resampled'
+        self.assertEqual(cut_planes._raw_slice_actors, {})
+        self.assertTrue(cut_planes.image_plane_widget_x.ipw.texture_visibility)
+
+    def test_oblique_cut_plane(self):
+        x, y, z = np.indices((32, 32, 32), dtype=float)
+        self.viewer.volume_data = VolumeData(raw_data=2 * x + 3 * y - z)
+        cut_planes = self.viewer.scene_members['cut_planes']
+        cut_planes.slice_mode = 'oblique'
+
+        # Tilt the plane and let it follow, as a drag would
+        ipw = cut_planes.image_plane_widget_z.ipw
+        ipw.trait_set(origin=(0, 0, 0), point1=(31, 0, 31), point2=(0, 31, 0))
+        ipw.invoke_event('InteractionEvent')
+
+        actor = cut_planes._raw_slice_actors['z']
+        np.testing.assert_allclose(actor.bounds, (0, 31, 0, 31, 0, 31))
+        image = actor.input
+        values = image.point_data.scalars.to_array()
+        columns, rows, _ = image.dimensions
+        column, row = np.divmod(np.arange(values.size), columns)[::-1]
+        points = np.column_stack([column * image.spacing[0],
+                                  row * image.spacing[1],
+                                  np.zeros(values.size),
+                                  np.ones(values.size)])
+        x, y, z, _ = actor.user_matrix.to_array().dot(points.T)
+        np.testing.assert_allclose(values, 2 * x + 3 * y - z, atol=1e-3)
+
+    def test_add_only_scene_member(self):
+        # The update and removal of the actors are optional
+        self.viewer.scene_members['other'] = AddOnlySceneMember()
+        self.viewer.volume_data = ramp_volume_data()
+        del self.viewer.scene_members['other']
+
+    def test_scene_members_updated_for_volume_data(self):
+        member = RecordingSceneMember()
+        self.viewer.scene_members['other'] = member
+        self.assertEqual(member.volume_data, [self.viewer.volume_data])
+
+        volume_data = ramp_volume_data()
+        self.viewer.volume_data = volume_data
+        self.assertIs(member.volume_data[-1], volume_data)
+
+        # Cut planes added later slice the current data
+        cut_planes = VolumeCutPlanes(slice_mode='raw')
+        self.viewer.scene_members['cut_planes'] = cut_planes
+        self.assertIs(cut_planes.volume_data, volume_data)
+        self.assertEqual(sorted(cut_planes._raw_slice_actors), ['x', 'y', 'z'])
+
+    def test_remove_scene_member(self):
+        scene_model = self.viewer.model
+        del self.viewer.scene_members['axes']
+        axes_count = count_types(AXES_ACTOR_CLASS, scene_model.renderer.actors)
+        self.assertEqual(axes_count, 0)
+
+        cut_planes = self.viewer.scene_members['cut_planes']
+        cut_planes.slice_mode = 'raw'
+        self.assertIsNotNone(cut_planes.slice_cache._pool)
+        del self.viewer.scene_members['cut_planes']
+        self.assertIsNone(cut_planes.image_plane_widget_x)
+        self.assertIsNone(cut_planes.slice_cache._pool)
+        cutplane_count = count_types(CUT_PLANE_ACTOR_CLASS,
+                                     scene_model.actor_list)
+        self.assertEqual(cutplane_count, 0)
+
+    def test_transfer_function_2d_given_to_volume_property(self):
+        renderer = self.viewer.volume_renderer
+        renderer.transfer_function_2d = low_values_function()
+
+        volume_property = tvtk.to_vtk(renderer.volume.volume_property)
+        if not hasattr(volume_property, 'GetTransferFunction2D'):
+            self.skipTest('2D transfer functions need a newer VTK')
+        self.assertEqual(volume_property.GetTransferFunctionMode(),
+                         volume_property.TF_2D)
+        image = tvtk.to_tvtk(volume_property.GetTransferFunction2D())
+        self.assertEqual(tuple(image.dimensions),
+                         TRANSFER_FUNCTION_2D_SHAPE + (1,))
+        # The value axis varies fastest in the image
+        scalars = image.point_data.scalars.to_array()
+        table = scalars.reshape(TRANSFER_FUNCTION_2D_SHAPE[::-1] + (4,))
+        np.testing.assert_allclose(table.transpose(1, 0, 2),
+                                   renderer._transfer_function_2d_table())
+
+        renderer.transfer_function_2d = None
+        self.assertEqual(volume_property.GetTransferFunctionMode(),
+                         volume_property.TF_1D)
+
     def test_data_update(self):
         # Changing the raw data should update the `vmin` and `vmax` values
         new_volume = 42 * np.ones_like(self.viewer.volume_data.raw_data)
@@ -157,5 +408,39 @@ enamldef MainView(Container): view:
         self.assertEqual(self.viewer.volume_renderer.vmax, new_max)
 
 
+class TransferFunction2DTableTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.renderer = VolumeRenderer(
+            data=ramp_volume_data(), global_alpha=0.5,
+            transfer_function_2d=low_values_function()
+        )
+
+    def test_table_axes(self):
+        renderer = self.renderer
+        values, gradients = renderer._transfer_function_2d_axes()
+
+        # The data range maps onto the function's [0, 1] value axis
+        np.testing.assert_allclose(values, np.linspace(0.0, 1.0, 256))
+        # The largest gradient magnitude of the render data is one quarter
+        # of the scalar range per unit of spacing in VTK's gradient units
+        render_data = renderer.data.render_data
+        max_gradient = renderer.data.gradient_magnitude.max()
+        spacing = np.mean(render_data.spacing)
+        np.testing.assert_allclose(
+            gradients,
+            np.linspace(0.0, 1.0, 128) * 0.25 * 255 / (spacing * max_gradient)
+        )
+
+    def test_table_contents(self):
+        table = self.renderer._transfer_function_2d_table()
+
+        self.assertEqual(table.shape, TRANSFER_FUNCTION_2D_SHAPE + (4,))
+        # The lower half of the values is red, with the global alpha applied
+        red = np.tile([1.0, 0.0, 0.0, 0.5], (128, 128, 1))
+        np.testing.assert_allclose(table[:128], red)
+        np.testing.assert_array_equal(table[129:], 0.0)
+
+
 if __name__ == "__main__":
     unittest.main()
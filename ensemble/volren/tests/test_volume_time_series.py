@@ -0,0 +1,136 @@
+from __future__ import division, unicode_literals
+
+import threading
+import time
+import unittest
+
+import numpy as np
+from numpy.testing import assert_array_equal
+from pyface.api import GUI
+
+from ensemble.ctf.api import TransferFunction
+from ensemble.volren.volume_renderer import VolumeRenderer
+from ensemble.volren.volume_time_series import VolumeTimeSeries
+
+
+def wait_until(condition, timeout=5.0):
+    """ Process GUI events until `condition()` is true.
+    """
+    gui = GUI()
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('Timed out')
+        gui.process_events()
+        time.sleep(0.005)
+
+
+class VolumeTimeSeriesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.frames = [np.full((8, 8, 8), i, dtype=np.uint8)
+                       for i in range(5)]
+        self.series = VolumeTimeSeries.from_arrays(self.frames, cache_size=3,
+                                                   prefetch_count=1)
+
+    def tearDown(self):
+        self.series.close()
+
+    def _step(self):
+        """ Step to the next frame once it is prepared.
+        """
+        series = self.series
+        frame = series.current_frame
+
+        def stepped():
+            series.step()
+            return series.current_frame != frame
+
+        wait_until(stepped)
+
+    def test_step_follows_frames(self):
+        assert_array_equal(self.series.data.raw_data, self.frames[0])
+        self._step()
+        assert_array_equal(self.series.data.raw_data, self.frames[1])
+
+        self.series.direction = -1
+        self._step()
+        self._step()
+        self.assertEqual(self.series.current_frame, 4)
+        self.assertEqual(self.series.data_frame, 4)
+        assert_array_equal(self.series.data.raw_data, self.frames[4])
+
+    def test_cache_is_bounded(self):
+        for i in range(10):
+            self._step()
+            self.assertLessEqual(len(self.series._cache), 3)
+            self.assertIn(self.series.current_frame, self.series._cache)
+
+    def test_frames_are_not_waited_for(self):
+        release = threading.Event()
+
+        def load_frame(index):
+            if index == 3:
+                release.wait()
+            return self.frames[index]
+
+        self.series.close()
+        self.series = VolumeTimeSeries(num_frames=5, load_frame=load_frame,
+                                       prefetch_count=0)
+        first = self.series.data
+
+        # The previous frame is shown while the frame is prepared
+        self.series.current_frame = 3
+        self.assertIs(self.series.data, first)
+        self.assertEqual(self.series.data_frame, 0)
+
+        # Playback holds at the current frame
+        self.series.current_frame = 2
+        wait_until(lambda: self.series.data_frame == 2)
+        self.series.step()
+        self.assertEqual(self.series.current_frame, 2)
+
+        release.set()
+        wait_until(lambda: self.series.current_frame == 3 or
+                   self.series.step())
+        self.assertEqual(self.series.data_frame, 3)
+        assert_array_equal(self.series.data.raw_data, self.frames[3])
+
+
+class FixedRangeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        frames = [np.full((8, 8, 8), i, dtype=np.uint8) for i in range(3)]
+        self.series = VolumeTimeSeries.from_arrays(frames,
+                                                   fixed_range=(0.0, 10.0))
+        function = TransferFunction()
+        self.renderer = VolumeRenderer(time_series=self.series,
+                                       colors=function.color,
+                                       opacities=function.opacity)
+        self.calls = []
+        self.renderer.scheduler.add_task(
+            'probe', lambda: self.calls.append('transfer_function'),
+            depends_on=('transfer_function',)
+        )
+
+    def tearDown(self):
+        self.series.close()
+
+    def test_frames_share_range(self):
+        renderer = self.renderer
+        self.assertEqual((renderer.vmin, renderer.vmax), (0.0, 10.0))
+
+        self.series.current_frame = 2
+        wait_until(lambda: self.series.data_frame == 2)
+        self.assertIs(renderer.data, self.series.data)
+        self.assertEqual((renderer.vmin, renderer.vmax), (0.0, 10.0))
+        # The transfer function is not rebuilt for the new frame
+        self.assertEqual(self.calls, [])
+
+        self.series.fixed_range = None
+        self.assertEqual((renderer.vmin, renderer.vmax), (2.0, 2.0))
+        self.assertEqual(self.calls, ['transfer_function'])
+
+
+if __name__ == "__main__":
+    unittest.main()
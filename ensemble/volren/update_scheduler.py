@@ -0,0 +1,103 @@
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from traits.api import Bool, Dict, HasStrictTraits, Instance, Int
+
+
+class UpdateScheduler(HasStrictTraits):
+    """ Runs the computations derived from some data at most once per burst
+    of changes, in dependency order.
+
+    Tasks are added with the names of the tasks whose results they use, which
+    must have been added before them. `invalidate` marks tasks and everything
+    depending on them as out of date. Outside of `batch`, the invalid tasks
+    run right away. Inside, they run once the outermost batch ends, however
+    often they were invalidated. A running task may invalidate tasks which
+    were added after it.
+    """
+
+    # The tasks by name, in the order they were added
+    _tasks = Instance(OrderedDict, ())
+
+    # The names of the tasks which use the result of each task
+    _dependents = Dict
+
+    # The names of the tasks which need to run
+    _invalid = Instance(set, ())
+
+    # The number of nested `batch` blocks
+    _batch_depth = Int(0)
+
+    # Are tasks being run?
+    _running = Bool(False)
+
+    # -------------------------------------------------------------------------
+    # Public interface
+    # -------------------------------------------------------------------------
+
+    def add_task(self, name, function, depends_on=()):
+        """ Add a task which calls `function` with no arguments.
+        """
+        if name in self._tasks:
+            raise ValueError('Task already added: {}'.format(name))
+        for dependency in depends_on:
+            if dependency not in self._tasks:
+                raise ValueError('Unknown task: {}'.format(dependency))
+
+        self._tasks[name] = function
+        self._dependents[name] = []
+        for dependency in depends_on:
+            self._dependents[dependency].append(name)
+
+    @contextmanager
+    def batch(self):
+        """ Collect the invalidations of a block and run the invalid tasks
+        once at its end.
+        """
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+        if self._batch_depth == 0:
+            self.run()
+
+    def has_task(self, name):
+        """ Was a task of this name added?
+        """
+        return name in self._tasks
+
+    def invalidate(self, *names):
+        """ Mark tasks and the tasks depending on them as out of date.
+        """
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name not in self._tasks:
+                raise ValueError('Unknown task: {}'.format(name))
+            if name not in self._invalid:
+                self._invalid.add(name)
+                stack.extend(self._dependents[name])
+
+        if self._batch_depth == 0:
+            self.run()
+
+    def run(self):
+        """ Run the invalid tasks.
+        """
+        if self._running:
+            # Called from a task. The tasks invalidated meanwhile are picked
+            # up by the outer call.
+            return
+
+        self._running = True
+        try:
+            while self._invalid:
+                name = next(name for name in self._tasks
+                            if name in self._invalid)
+                self._invalid.discard(name)
+                self._tasks[name]()
+        finally:
+            self._running = False
@@ -1,5 +1,5 @@
 from __future__ import unicode_literals
-from traits.api import Bool, Enum, Float, Tuple, Unicode
+from traits.api import Bool, Enum, Float, Instance, Tuple, Unicode
 from tvtk.api import tvtk
 
 from .volume_scene_member import ABCVolumeSceneMember
@@ -34,6 +34,9 @@ class VolumeAxes(ABCVolumeSceneMember):
     fly_mode = Enum(('static_triad', 'closest_triad', 'furthest_triad',
                      'outer_edges', 'static_edges'))
 
+    # The axes actor, if any scale is visible
+    cube_axes = Instance(tvtk.CubeAxesActor)
+
     # -------------------------------------------------------------------------
     # ABCVolumeSceneMember interface
     # -------------------------------------------------------------------------
@@ -70,6 +73,16 @@ class VolumeAxes(ABCVolumeSceneMember):
                 z_label_format=z_format,
             )
             scene_model.renderer.add_actor(cube_axes)
+            self.cube_axes = cube_axes
+
+    def update_for_volume(self, scene_model, volume_actor, volume_data):
+        if self.cube_axes is not None:
+            self.cube_axes.bounds = volume_actor.bounds
+
+    def remove_actors(self, scene_model):
+        if self.cube_axes is not None:
+            scene_model.renderer.remove_actor(self.cube_axes)
+            self.cube_axes = None
 
     # -------------------------------------------------------------------------
     # Default values
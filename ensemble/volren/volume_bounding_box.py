@@ -14,6 +14,9 @@ class VolumeBoundingBox(ABCVolumeSceneMember):
     # The number of points should be 8 after the bounding box is computed
     outline = Instance(tvtk.OutlineFilter)
 
+    # The actor showing the outline
+    outline_actor = Instance(tvtk.Actor)
+
     # -------------------------------------------------------------------------
     # ABCVolumeSceneMember interface
     # -------------------------------------------------------------------------
@@ -30,3 +33,17 @@ class VolumeBoundingBox(ABCVolumeSceneMember):
         outline_actor = tvtk.Actor(mapper=outline_mapper)
         outline_actor.property.opacity = 0.3
         scene_model.renderer.add_actor(outline_actor)
+        self.outline_actor = outline_actor
+
+    def update_for_volume(self, scene_model, volume_actor, volume_data):
+        if self.outline is None:
+            return
+
+        configure_input_data(self.outline, volume_actor.mapper.input)
+        self.outline.update()
+
+    def remove_actors(self, scene_model):
+        if self.outline_actor is not None:
+            scene_model.renderer.remove_actor(self.outline_actor)
+            self.outline_actor = None
+            self.outline = None
@@ -1,11 +1,21 @@
 from __future__ import division, unicode_literals
 
 from collections import OrderedDict
+from contextlib import contextmanager
 
+import numpy as np
 from mayavi import mlab
 from mayavi.core.api import PipelineBase
-from traits.api import Enum, Instance, List, Range, on_trait_change, Unicode
+from pyface.api import GUI
+from traits.api import (Any, Dict, Enum, Instance, Int, List, Range,
+                        on_trait_change, Unicode)
+from tvtk.api import tvtk
+from tvtk.common import configure_input_data
 
+from .reformat import Reformatter, plane_axes
+from .render_throttle import RenderThrottle
+from .slice_cache import SliceCache, extract_slice, is_memory_mapped
+from .volume_data import VolumeData, _array_from_image_data
 from .volume_scene_member import ABCVolumeSceneMember
 
 
@@ -15,6 +25,42 @@ CUT_COLORMAPS = OrderedDict([
     ('RdBu', 'RdBu'),
 ])
 
+AXIS_NAMES = 'xyz'
+
+# The largest number of pixels along either side of an oblique slice
+OBLIQUE_SLICE_MAX_SIZE = 1024
+
+
+def _cut_range(data_range, brightness, contrast):
+    """ Compute the lookup table range for a brightness and contrast.
+    """
+    data_low, data_high = data_range
+    data_level = (data_low + data_high) / 2
+    data_radius = (data_high - data_low) / 2
+    level = data_level - data_radius * brightness
+    radius = data_radius * pow(2, -contrast)
+    return (level - radius, level + radius)
+
+
+def _nearest_index(position, spacing, size):
+    """ The index of the grid point nearest to `position` along an axis.
+    """
+    return int(min(max(round(position / spacing), 0), size - 1))
+
+
+def _slice_image_data(array, axis, index, spacing):
+    """ Wrap a slice from `extract_slice` in an ImageData object placed at
+    its position in the volume, without copying it.
+    """
+    dimensions = list(array.shape)
+    dimensions.insert(axis, 1)
+    origin = [0.0, 0.0, 0.0]
+    origin[axis] = index * spacing[axis]
+    image_data = tvtk.ImageData(dimensions=dimensions, origin=origin,
+                                spacing=spacing)
+    image_data.point_data.scalars = array.ravel('F')
+    return image_data
+
 
 class VolumeCutPlanes(ABCVolumeSceneMember):
     """ An object which adds image cut planes to a scene containing a Volume.
@@ -36,6 +82,43 @@ class VolumeCutPlanes(ABCVolumeSceneMember):
     cut_brightness = Range(-1.0, 1.0, value=0.0)
     cut_contrast = Range(-1.0, 1.0, value=0.0)
 
+    # How the cut planes show the data. 'resampled' shows the render grid.
+    # 'raw' shows slices of `volume_data.raw_data` at full resolution, with
+    # the image plane widgets only used to move the planes. 'oblique' samples
+    # the raw data on the planes of the widgets with `reformatter`, so that
+    # the planes can also be tilted.
+    slice_mode = Enum('resampled', 'raw', 'oblique')
+
+    # The data shown in 'raw' mode
+    volume_data = Instance(VolumeData)
+
+    # An optional array-like object to read the raw slices from instead of
+    # `volume_data.raw_data`, such as a memory mapped array or an h5py
+    # dataset. It is indexed in the same (x, y, z) order and covers the same
+    # bounds, but might have a higher resolution.
+    raw_source = Any
+
+    # The raw slices which were shown recently or will likely be shown next
+    slice_cache = Instance(SliceCache, ())
+
+    # Samples the raw data on the planes in 'oblique' mode
+    reformatter = Instance(Reformatter, ())
+
+    # The actors showing raw slices, by axis name
+    _raw_slice_actors = Dict(Unicode, Any)
+
+    # The raw slice index shown along each axis
+    _raw_slice_indices = Dict(Unicode, Int)
+
+    # The ids of the interaction observers of the raw slices, by axis name
+    _raw_slice_observers = Dict(Unicode, Int)
+
+    # The lookup table of the raw slices, which are not in render data units
+    _raw_lookup_table = Instance(tvtk.LookupTable, ())
+
+    # Renders property changes of all planes at once, at most once per frame
+    _render_throttle = Instance(RenderThrottle)
+
     # -------------------------------------------------------------------------
     # ABCVolumeSceneMember interface
     # -------------------------------------------------------------------------
@@ -55,44 +138,122 @@ class VolumeCutPlanes(ABCVolumeSceneMember):
             ipw.ipw.texture_plane_property.opacity = self.slicer_alpha
             ipw.visible = False
             setattr(self, 'image_plane_widget_' + axis, ipw)
+        self._update_raw_slice_actors()
+
+    def update_for_volume(self, scene_model, volume_actor, volume_data):
+        # The raw slices follow `volume_data`. The image plane widgets follow
+        # the volume's data source, so only their lookup table range is
+        # updated. The caller renders the scene.
+        self.volume_data = volume_data
+        if self.image_plane_widget_z is None:
+            return
+
+        with self._render_disabled():
+            self._update_cut_range()
+
+    def remove_actors(self, scene_model):
+        with self._render_disabled():
+            self._remove_raw_slices()
+            for axis in AXIS_NAMES:
+                ipw = self._image_plane_widget(axis)
+                if ipw is not None:
+                    ipw.remove()
+                    setattr(self, 'image_plane_widget_' + axis, None)
+        # Drop the slices and stop the reading and sampling threads. They
+        # start again if the planes are added back.
+        self.slice_cache.clear()
+        self.slice_cache.close()
+        self.reformatter.close()
 
     # -------------------------------------------------------------------------
     # Traits notifications
     # -------------------------------------------------------------------------
 
     def _slicer_alpha_changed(self, alpha):
-        for ipw in self._iter_image_plane_widgets():
-            ipw.ipw.texture_plane_property.opacity = alpha
-            ipw.render()
+        with self._render_disabled():
+            for actor in self._raw_slice_actors.values():
+                actor.property.opacity = alpha
+            for ipw in self._iter_image_plane_widgets():
+                ipw.ipw.texture_plane_property.opacity = alpha
+        self._render_throttle.request()
 
     def _selected_cut_color_map_changed(self, new):
-        for ipw in self._iter_image_plane_widgets():
-            lut_manager = ipw.module_manager.scalar_lut_manager
-            lut_manager.lut_mode = CUT_COLORMAPS[new]
-            ipw.render()
+        with self._render_disabled():
+            for ipw in self._iter_image_plane_widgets():
+                lut_manager = ipw.module_manager.scalar_lut_manager
+                lut_manager.lut_mode = CUT_COLORMAPS[new]
+            self._update_raw_lookup_table()
+        self._render_throttle.request()
+
+    def __render_throttle_default(self):
+        return RenderThrottle(callback=self._render_scene)
+
+    @on_trait_change('volume_data.raw_data,raw_source')
+    def _volume_raw_data_changed(self):
+        if self.volume_data is None:
+            self.slice_cache.data = None
+            self._update_raw_slice_actors()
+            return
+
+        source = self.raw_source
+        if source is None:
+            source = self.volume_data.raw_data
+        # Read memory mapped data on the cache's thread, not when drawing
+        self.slice_cache.load_slices = is_memory_mapped(source)
+        self.slice_cache.data = source
+        self.reformatter.data = source
+        self._raw_slice_indices = {}
+        if not self._update_raw_slice_actors():
+            self._update_raw_lookup_table()
+            for axis in self._raw_slice_actors:
+                self._update_raw_slice(axis)
+
+    def _slice_mode_changed(self, old, new):
+        if 'resampled' not in (old, new):
+            # The raw modes place their actors differently. Start afresh.
+            with self._render_disabled():
+                self._remove_raw_slices()
+        if self._update_raw_slice_actors():
+            self._render_throttle.request()
+
+    @on_trait_change('image_plane_widget_x.visible,image_plane_widget_y.'
+                     'visible,image_plane_widget_z.visible')
+    def _plane_visibility_changed(self):
+        for axis, actor in self._raw_slice_actors.items():
+            actor.visibility = self._image_plane_widget(axis).visible
 
     @on_trait_change('cut_brightness,cut_contrast,image_plane_widget_z')
     def _on_cut_brightness_contrast(self):
         if self.image_plane_widget_z is not None:
-            # This is shared between all three.
-            plane_widget = self.image_plane_widget_z
-            lut_manager = plane_widget.module_manager.scalar_lut_manager
-
-            lut_manager.use_default_range = False
-            data_low, data_high = lut_manager.default_data_range
-            data_level = (data_low + data_high) / 2
-            data_radius = (data_high - data_low) / 2
-            level = data_level - data_radius * self.cut_brightness
-            radius = data_radius * pow(2, -self.cut_contrast)
-            lut_manager.data_range = (level - radius, level + radius)
-
-            for ipw in self._iter_image_plane_widgets():
-                ipw.render()
+            with self._render_disabled():
+                self._update_cut_range()
+            self._render_throttle.request()
 
     # -------------------------------------------------------------------------
     # Private interface
     # -------------------------------------------------------------------------
 
+    def _add_raw_slice(self, renderer, axis, ipw):
+        """ Show raw slices on the plane of an image plane widget.
+        """
+        actor = tvtk.ImageActor(visibility=ipw.visible)
+        actor.property.trait_set(lookup_table=self._raw_lookup_table,
+                                 use_lookup_table_scalar_range=True,
+                                 opacity=self.slicer_alpha)
+        # Only keep the widget's outline and handles
+        ipw.ipw.texture_visibility = False
+
+        def on_interaction(obj, event):
+            self._update_raw_slice(axis)
+
+        self._raw_slice_observers[axis] = ipw.ipw.add_observer(
+            'InteractionEvent', on_interaction
+        )
+        renderer.add_actor(actor)
+        self._raw_slice_actors[axis] = actor
+        self._update_raw_lookup_table()
+        self._update_raw_slice(axis)
+
     def _find_volume_data_source(self, scene_model, volume_actor):
         volume_image_data = volume_actor.mapper.input
         for child in scene_model.mayavi_scene.children:
@@ -101,6 +262,9 @@ class VolumeCutPlanes(ABCVolumeSceneMember):
 
         return None
 
+    def _image_plane_widget(self, axis):
+        return getattr(self, 'image_plane_widget_' + axis)
+
     def _iter_image_plane_widgets(self):
         image_plane_widgets = (
             self.image_plane_widget_x, self.image_plane_widget_y,
@@ -109,3 +273,219 @@ class VolumeCutPlanes(ABCVolumeSceneMember):
         for ipw in image_plane_widgets:
             if ipw is not None:
                 yield ipw
+
+    def _update_raw_slice_actors(self):
+        """ Add or remove the raw slice actors to match `slice_mode` and
+        `volume_data`. Returns whether any actors were added or removed.
+        """
+        show_raw = (self.slice_mode != 'resampled' and
+                    self.volume_data is not None and
+                    self.image_plane_widget_z is not None)
+        if show_raw == bool(self._raw_slice_actors):
+            return False
+
+        with self._render_disabled():
+            if show_raw:
+                renderer = self._scene().renderer
+                for axis in AXIS_NAMES:
+                    self._add_raw_slice(renderer, axis,
+                                        self._image_plane_widget(axis))
+            else:
+                self._remove_raw_slices()
+        return True
+
+    def _update_cut_range(self):
+        """ Apply the brightness and contrast to the lookup tables.
+        """
+        # This is shared between all three.
+        plane_widget = self.image_plane_widget_z
+        lut_manager = plane_widget.module_manager.scalar_lut_manager
+        lut_manager.use_default_range = False
+        lut_manager.data_range = _cut_range(
+            lut_manager.default_data_range, self.cut_brightness,
+            self.cut_contrast
+        )
+        self._update_raw_lookup_table()
+
+    def _update_raw_lookup_table(self):
+        plane_widget = self.image_plane_widget_z
+        if not self._raw_slice_actors or plane_widget is None:
+            return
+
+        lut_manager = plane_widget.module_manager.scalar_lut_manager
+        self._raw_lookup_table.deep_copy(lut_manager.lut)
+        # Quantized render data covers the render window of the raw data.
+        # Otherwise the render data is in raw data units.
+        data_range = self.volume_data.render_window
+        if data_range is None:
+            data_range = lut_manager.default_data_range
+        self._raw_lookup_table.table_range = _cut_range(
+            data_range, self.cut_brightness, self.cut_contrast
+        )
+
+    @contextmanager
+    def _render_disabled(self):
+        """ Suspend the renders which Mayavi triggers for each changed
+        property while the planes are updated.
+        """
+        scene = self._scene()
+        if scene is None:
+            yield
+            return
+
+        disable_render = scene.disable_render
+        scene.disable_render = True
+        try:
+            yield
+        finally:
+            # Setting it quietly avoids an immediate render. The throttle
+            # renders instead.
+            scene.trait_setq(disable_render=disable_render)
+
+    def _render_scene(self):
+        scene = self._scene()
+        if scene is not None:
+            scene.render()
+
+    def _remove_raw_slices(self):
+        """ Remove the raw slice actors and show the image plane widgets'
+        own slices again.
+        """
+        scene = self._scene()
+        for axis, actor in self._raw_slice_actors.items():
+            scene.renderer.remove_actor(actor)
+            ipw = self._image_plane_widget(axis).ipw
+            ipw.remove_observer(self._raw_slice_observers.pop(axis))
+            ipw.texture_visibility = True
+        self._raw_slice_actors = {}
+        self._raw_slice_indices = {}
+
+    def _raw_slice_loaded(self, axis, index, array):
+        """ Replace a coarse slice once the raw slice has been read.
+        """
+        if (axis in self._raw_slice_actors and
+                self._raw_slice_indices.get(axis) == index):
+            if array is None:
+                # Reading failed. Keep the coarse slice, and read the slice
+                # again when the plane next moves to it.
+                del self._raw_slice_indices[axis]
+                return
+            self._show_slice(axis, array, index, self._raw_spacing(),
+                             self._raw_lookup_table)
+            self._render_throttle.request()
+
+    def _raw_spacing(self):
+        """ The spacing of the slices in `slice_cache`, which might have a
+        higher resolution than the raw data of `volume_data`.
+        """
+        volume_data = self.volume_data
+        return tuple(
+            spacing * size / source_size for spacing, size, source_size in
+            zip(volume_data.spacing, volume_data.raw_data.shape,
+                self.slice_cache.data.shape)
+        )
+
+    def _scene(self):
+        for ipw in self._iter_image_plane_widgets():
+            return ipw.scene
+        return None
+
+    def _show_coarse_slice(self, axis, position):
+        """ Show the render data slice nearest to `position`, which is quick
+        to get while the raw slice is read.
+        """
+        render_data = self.volume_data.render_data
+        render_array = _array_from_image_data(render_data)
+        axis_index = AXIS_NAMES.index(axis)
+        spacing = render_data.spacing
+        index = _nearest_index(position, spacing[axis_index],
+                               render_array.shape[axis_index])
+        array = extract_slice(render_array, axis_index, index)
+        # The plane widgets' lookup table is in render data units
+        ipw = self._image_plane_widget(axis)
+        lookup_table = ipw.module_manager.scalar_lut_manager.lut
+        self._show_slice(axis, array, index, spacing, lookup_table)
+
+    def _show_slice(self, axis, array, index, spacing, lookup_table):
+        image_data = _slice_image_data(array, AXIS_NAMES.index(axis), index,
+                                       spacing)
+        actor = self._raw_slice_actors[axis]
+        configure_input_data(actor.mapper, image_data)
+        actor.display_extent = image_data.extent
+        actor.property.lookup_table = lookup_table
+
+    def _update_oblique_slice(self, axis):
+        """ Sample the raw data on the plane of the widget along `axis`,
+        which might be tilted.
+        """
+        ipw = self._image_plane_widget(axis).ipw
+        origin = np.array(ipw.origin)
+        up = np.subtract(ipw.point2, origin)
+        width = np.linalg.norm(np.subtract(ipw.point1, origin))
+        height = np.linalg.norm(up)
+        # About one pixel per raw data point
+        spacing = self._raw_spacing()
+        shape = tuple(min(int(round(length / min(spacing))) + 1,
+                          OBLIQUE_SLICE_MAX_SIZE)
+                      for length in (height, width))
+
+        reformatter = self.reformatter
+        reformatter.spacing = spacing
+        image = reformatter.sample_plane(ipw.center, ipw.normal, up,
+                                         (width, height), shape)
+
+        # Place the image on the plane, as `sample_plane` sampled it
+        rows, columns = shape
+        image_data = tvtk.ImageData(
+            dimensions=(columns, rows, 1),
+            spacing=(width / max(columns - 1, 1), height / max(rows - 1, 1),
+                     1.0)
+        )
+        image_data.point_data.scalars = image.ravel()
+        right, up = plane_axes(ipw.normal, up)
+        matrix = np.identity(4)
+        matrix[:3, :3] = np.column_stack([right, up, ipw.normal])
+        matrix[:3, 3] = (np.array(ipw.center) - right * width / 2 -
+                         up * height / 2)
+        user_matrix = tvtk.Matrix4x4()
+        user_matrix.from_array(matrix)
+
+        actor = self._raw_slice_actors[axis]
+        configure_input_data(actor.mapper, image_data)
+        actor.display_extent = image_data.extent
+        actor.property.lookup_table = self._raw_lookup_table
+        actor.user_matrix = user_matrix
+
+    def _update_raw_slice(self, axis):
+        """ Show the raw slice nearest to the plane of the widget along
+        `axis`. Until a slice which is not cached has been read, the render
+        data is shown instead.
+        """
+        if self.slice_mode == 'oblique':
+            self._update_oblique_slice(axis)
+            return
+
+        axis_index = AXIS_NAMES.index(axis)
+        spacing = self._raw_spacing()
+        position = self._image_plane_widget(axis).ipw.slice_position
+        index = _nearest_index(position, spacing[axis_index],
+                               self.slice_cache.data.shape[axis_index])
+        previous = self._raw_slice_indices.get(axis)
+        if index == previous:
+            return
+        self._raw_slice_indices[axis] = index
+
+        def loaded(axis_index, index, array):
+            # Called on the reading thread
+            GUI.invoke_later(self._raw_slice_loaded, axis, index, array)
+
+        array = self.slice_cache.request_slice(axis_index, index, loaded)
+        if array is None:
+            self._show_coarse_slice(axis, position)
+        else:
+            self._show_slice(axis, array, index, spacing,
+                             self._raw_lookup_table)
+
+        # Read ahead in the direction the plane is moving
+        direction = 0 if previous is None else index - previous
+        self.slice_cache.prefetch(axis_index, index, direction)
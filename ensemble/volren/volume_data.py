@@ -1,10 +1,17 @@
 from __future__ import division, unicode_literals
 
+import math
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
 
-from traits.api import HasStrictTraits, Array, Float, Instance, Property, Tuple
+from traits.api import (HasStrictTraits, Any, Array, Either, Enum, Event,
+                        Float, Instance, Int, Property, Tuple, on_trait_change)
 from tvtk.api import tvtk
-from tvtk.common import configure_input_data, is_old_pipeline
+from tvtk.common import configure_input_data
+
+from ensemble.ctf.utils import joint_histogram
+from .volume_mask import ABCVolumeMask, LabelMask
 
 
 VolumeArray = Array(shape=(None, None, None))
@@ -12,22 +19,171 @@ VolumeArray = Array(shape=(None, None, None))
 # The point data scalars need a name for some Mayavi operations.
 POINT_DATA_SCALARS_NAME = 'VolumeData'
 
+# The number of points along each axis of the resampled render grid.
+RENDER_GRID_SIZE = 256
+
+# How many raw points on either side of a sample the cubic resampling reads.
+RESAMPLE_SUPPORT = 2
+
+# Guards against rounding down when a grid point is exactly on the edge of
+# a mask voxel.
+MASK_EDGE_EPS = 1e-9
+
+# The number of values converted at once when quantizing the raw data.
+QUANTIZE_CHUNK_SIZE = 2 ** 22
 
-def _apply_mask(volume_data, mask_data):
-    """ Mask out a portion of the data.
+# The number of threads used to compute gradients.
+GRADIENT_THREADS = 4
+
+# The largest number of slices in a slab of a gradient computation. Bounds
+# the size of the temporary arrays of each thread.
+GRADIENT_SLAB_SIZE = 16
+
+
+def _array_from_image_data(image_data):
+    """ Return a 3D view of the point scalars of an ImageData object.
     """
-    mask_image_data = _image_data_from_array(mask_data, volume_data.spacing)
-    masker = tvtk.ImageMask()
-    if is_old_pipeline():
-        masker.set_image_input(volume_data)
-        masker.set_mask_input(mask_image_data)
-    else:
-        masker.set_image_input_data(volume_data)
-        masker.set_mask_input_data(mask_image_data)
-    masker.update()
-    result = masker.output
-    result.point_data.scalars.name = POINT_DATA_SCALARS_NAME
-    return masker.output
+    flat = image_data.point_data.scalars.to_array()
+    return flat.reshape(image_data.dimensions, order='F')
+
+
+def _mask_voxel_indices(size, mask_range, grid_step, grid_size):
+    """ The index of the mask voxel containing each of `grid_size` grid points
+    spaced by `grid_step` along an axis, and whether it is inside the mask.
+    """
+    low, high = mask_range
+    voxel_step = (high - low) / size
+    positions = np.arange(grid_size) * grid_step
+    indices = np.floor((positions - low) / voxel_step +
+                       MASK_EDGE_EPS).astype(int)
+    return indices, (indices >= 0) & (indices < size)
+
+
+def _resample_labels(labels, mask_bounds, grid_steps, grid_size):
+    """ Resample a label volume onto a grid by nearest neighbor.
+
+    Only the grid points inside `mask_bounds` are resampled. Returns their
+    labels and the slices of the grid which they cover.
+    """
+    region = []
+    for axis in range(3):
+        indices, valid = _mask_voxel_indices(
+            labels.shape[axis], mask_bounds[2*axis:2*axis+2],
+            grid_steps[axis], grid_size
+        )
+        # The grid points inside the mask are contiguous
+        inside = np.flatnonzero(valid)
+        if inside.size == 0:
+            return labels[:0, :0, :0], (slice(0, 0),) * 3
+        labels = np.take(labels, indices[inside], axis=axis)
+        region.append(slice(inside[0], inside[-1] + 1))
+    return np.asfortranarray(labels), tuple(region)
+
+
+def _resample_mask_axis(mask, axis, mask_range, grid_step, grid_size, mode):
+    """ Resample a boolean mask along one axis onto a grid of `grid_size`
+    points spaced by `grid_step`, starting at zero.
+
+    `mask_range` is the (low, high) physical extent covered by the mask
+    along the axis. Grid points take the value of the mask voxel they fall
+    in. In 'max' mode, a grid point is also set if any mask voxel starting
+    between it and the next grid point is set, so thin features survive
+    downsampling.
+    """
+    low, high = mask_range
+    size = mask.shape[axis]
+    voxel_step = (high - low) / size
+
+    # Nearest neighbor: the mask voxel containing each grid point
+    indices, valid = _mask_voxel_indices(size, mask_range, grid_step,
+                                         grid_size)
+    result = np.take(mask, np.clip(indices, 0, size - 1), axis=axis)
+    if not valid.all():
+        shape = [1, 1, 1]
+        shape[axis] = grid_size
+        result &= valid.reshape(shape)
+
+    if mode == 'max':
+        # Pool every mask voxel into the grid point at or below its start.
+        starts = low + np.arange(size) * voxel_step
+        owners = np.floor(starts / grid_step + MASK_EDGE_EPS).astype(int)
+        inside = np.flatnonzero((owners >= 0) & (owners < grid_size))
+        if inside.size > 0:
+            kept = np.take(mask, inside, axis=axis)
+            owners = owners[inside]
+            starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+            pooled = np.logical_or.reduceat(kept, starts, axis=axis)
+            target = [slice(None)] * 3
+            target[axis] = owners[starts]
+            result[tuple(target)] |= pooled
+
+    return result
+
+
+def _gradient_slab(array, spacing, start, stop):
+    """ Compute the gradient magnitude of `array[..., start:stop]` with
+    central differences, reading one extra slice on either side.
+    """
+    size = array.shape[-1]
+    low, high = max(start - 1, 0), min(stop + 1, size)
+    slab = array[..., low:high].astype(np.float32)
+    keep = slice(start - low, stop - low)
+    magnitude = np.zeros(slab[..., keep].shape, dtype=np.float32)
+    for axis in range(3):
+        if slab.shape[axis] > 1:
+            component = np.gradient(slab, spacing[axis], axis=axis)[..., keep]
+            magnitude += component * component
+    np.sqrt(magnitude, out=magnitude)
+    return magnitude
+
+
+def _gradient_magnitude(array, spacing, num_threads=GRADIENT_THREADS):
+    """ Compute the gradient magnitude of a 3D array. Slabs along the last
+    axis are processed in parallel.
+    """
+    size = array.shape[-1]
+    magnitude = np.empty(array.shape, dtype=np.float32, order='F')
+    step = min(int(math.ceil(size / num_threads)), GRADIENT_SLAB_SIZE)
+    bounds = [(start, min(start + step, size))
+              for start in range(0, size, step)]
+
+    def compute(bound):
+        start, stop = bound
+        magnitude[..., start:stop] = _gradient_slab(array, spacing,
+                                                    start, stop)
+
+    pool = ThreadPool(num_threads)
+    try:
+        pool.map(compute, bounds)
+    finally:
+        pool.close()
+    return magnitude
+
+
+def _mask_image_data(image_data, mask):
+    """ Return a copy of `image_data` with the points outside of the boolean
+    array `mask` set to zero.
+    """
+    array = _array_from_image_data(image_data)
+    result = _image_data_from_array(array * mask, image_data.spacing)
+    result.origin = image_data.origin
+    return result
+
+
+def _brick_ranges(array, brick_size):
+    """ Compute the minimum and maximum of each `brick_size`^3 block of a 3D
+    array. Incomplete bricks at the upper edges are padded with edge values.
+    """
+    # Work on the C-ordered transpose so the reshape below is a view.
+    array = array.T
+    pad = [(0, -n % brick_size) for n in array.shape]
+    if any(after for _, after in pad):
+        array = np.pad(array, pad, mode='edge')
+    bz, by, bx = [n // brick_size for n in array.shape]
+    blocks = array.reshape(bz, brick_size, by, brick_size, bx, brick_size)
+    mins = blocks.min(axis=(1, 3, 5)).T
+    maxs = blocks.max(axis=(1, 3, 5)).T
+    return np.stack([mins, maxs], axis=-1)
 
 
 def _image_data_from_array(array, spacing):
@@ -42,16 +198,61 @@ def _image_data_from_array(array, spacing):
     return image_data
 
 
-def _resample_data(image_data):
+def _quantize(array, window, dtype):
+    """ Linearly map the values in `window` onto the full range of the integer
+    type `dtype`. Values outside of the window are clipped.
+    """
+    low, high = window
+    max_value = np.iinfo(dtype).max
+    scale = max_value / (high - low) if high > low else 0.0
+    result = np.empty(array.shape, dtype=dtype, order='F')
+
+    # Convert a few slabs at a time to bound the size of the float temporary.
+    chunk = max(QUANTIZE_CHUNK_SIZE // max(array[..., :1].size, 1), 1)
+    for start in range(0, array.shape[-1], chunk):
+        scaled = (array[..., start:start+chunk] - low) * scale
+        np.clip(scaled, 0, max_value, out=scaled)
+        np.rint(scaled, out=scaled)
+        result[..., start:start+chunk] = scaled
+    return result
+
+
+def _render_extent_for_region(slices, shape):
+    """ Compute the extent of the render grid which depends on the region
+    `slices` of a raw array with shape `shape`.
+    """
+    extent = []
+    last = RENDER_GRID_SIZE - 1
+    for axis, size in enumerate(shape):
+        index = slices[axis] if axis < len(slices) else slice(None)
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(size)
+        else:
+            start = index % size
+            stop = start + 1
+        scale = RENDER_GRID_SIZE / size
+        low = int(math.floor((start - RESAMPLE_SUPPORT) * scale))
+        high = int(math.ceil((stop - 1 + RESAMPLE_SUPPORT) * scale))
+        extent.extend([min(max(low, 0), last), min(max(high, 0), last)])
+    return tuple(extent)
+
+
+def _resample_data(image_data, output_extent=None):
     """ Resample data onto a uniform 256^3 grid.
+
+    If `output_extent` is given, only that part of the grid is computed.
     """
     spacing = image_data.spacing
     dims = image_data.dimensions
-    output_spacing = (spacing[0] * (dims[0] / 256),
-                      spacing[1] * (dims[1] / 256),
-                      spacing[2] * (dims[2] / 256))
+    size = RENDER_GRID_SIZE
+    output_spacing = (spacing[0] * (dims[0] / size),
+                      spacing[1] * (dims[1] / size),
+                      spacing[2] * (dims[2] / size))
+    if output_extent is None:
+        output_extent = (0, size - 1) * 3
     reslicer = tvtk.ImageReslice(interpolation_mode='cubic',
-                                 output_extent=(0, 255, 0, 255, 0, 255),
+                                 output_extent=output_extent,
+                                 output_origin=image_data.origin,
                                  output_spacing=output_spacing)
     configure_input_data(reslicer, image_data)
     reslicer.update()
@@ -71,7 +272,27 @@ class VolumeData(HasStrictTraits):
     # The mask data as a fortran array
     _mask_data = VolumeArray
 
-    # The data itself.
+    # A compact mask to apply to the data. Takes precedence over `mask_data`.
+    mask = Instance(ABCVolumeMask)
+
+    # The gradient magnitude of `render_data`. Computed on demand and cached.
+    gradient_magnitude = Property(Array)
+    _gradient_magnitude = Any
+
+    # The physical extent (xmin, xmax, ymin, ymax, zmin, zmax) covered by the
+    # mask. If None, the mask covers the same extent as the raw data, at any
+    # resolution.
+    mask_bounds = Either(None, Tuple(Float, Float, Float, Float, Float, Float))
+
+    # How masks are resampled onto the render grid. 'max' keeps a render point
+    # if any mask voxel pooled into it is set.
+    mask_resampling = Enum('nearest', 'max')
+
+    # Fired when `mask_data`, `mask` or the region selected by `mask` changes
+    mask_updated = Event
+
+    # The data itself. A Fortran ordered array is kept as it is, without a
+    # copy, so `update_region` writes into the array which was assigned.
     raw_data = Property(VolumeArray, depends_on='_raw_data')
 
     # The data as a fortran array
@@ -87,6 +308,58 @@ class VolumeData(HasStrictTraits):
     render_data = Property(Instance(tvtk.DataObject))
     _render_data = Instance(tvtk.DataObject)
 
+    # The resampled data before masking. Kept so that mask changes do not
+    # need to resample the data again.
+    _resampled_data = Instance(tvtk.DataObject)
+
+    # The mask resampled onto the render grid, or None. Cached until the mask
+    # or the raw data's shape changes.
+    _render_mask = Any
+
+    # The labels of a `LabelMask` resampled onto the render grid, with the
+    # slices of the grid which they cover, or None. Unlike `_render_mask`,
+    # these are kept when the enabled labels change.
+    _render_labels = Any
+
+    # The labels array which `_render_labels` were resampled from
+    _render_labels_source = Any
+
+    # The edge length, in grid points, of the bricks summarizing `render_data`
+    brick_size = Int(16)
+
+    # The minimum and maximum of `render_data` over each brick. The shape is
+    # (bricks_x, bricks_y, bricks_z, 2).
+    brick_ranges = Property(Array)
+    _brick_ranges = Any
+
+    # The data type of the render data. 'native' uses the raw data's type,
+    # for when exact values matter. The other settings quantize the raw
+    # values in `render_window`, which saves memory but rounds the values to
+    # 1 / 255 or 1 / 65535 of the window: 'uint8' and 'uint16' always, and
+    # 'auto' anything which is not a 1 or 2 byte integer, to uint16.
+    render_dtype = Enum('auto', 'native', 'uint8', 'uint16')
+
+    # How the window of raw values which is quantized is chosen: the full
+    # data range or the `quantization_percentiles` of the data.
+    quantization_window = Enum('minmax', 'percentile')
+
+    # The lower and upper percentiles used by the 'percentile' window.
+    quantization_percentiles = Tuple(Float(0.5), Float(99.5))
+
+    # The (low, high) raw values which map onto the full range of the render
+    # data type, or None if the render data is not quantized.
+    render_window = Property
+
+    # Cached quantization state
+    _quantized_data = Any
+    _render_window = Any
+
+    # Fired by `update_region` with a (raw_slices, render_extent) tuple, where
+    # `render_extent` is the (xmin, xmax, ymin, ymax, zmin, zmax) index range
+    # of `render_data` which was recomputed, or None if the render data will
+    # be rebuilt from scratch.
+    region_updated = Event
+
     # -------------------------------------------------------------------------
     # Public interface
     # -------------------------------------------------------------------------
@@ -96,6 +369,125 @@ class VolumeData(HasStrictTraits):
         """
         self.mask_data = np.empty((0, 0, 0), dtype='uint8')
 
+    def gradient_histogram(self, bins=(256, 128)):
+        """ Compute the joint histogram of the render data values and their
+        gradient magnitudes.
+
+        The value axis spans the raw data range and the gradient axis spans
+        zero to the largest gradient magnitude, matching the relative axes of
+        a `TransferFunction2D`.
+
+        Returns
+        -------
+        counts : array
+            Integer counts with shape `bins`.
+        ranges : tuple
+            ((value_min, value_max), (gradient_min, gradient_max)), in render
+            data units.
+        """
+        raw_data = self.raw_data
+        value_range = tuple(self.render_values([raw_data.min(),
+                                                raw_data.max()]))
+        magnitude = self.gradient_magnitude
+        values = _array_from_image_data(self.render_data)
+        ranges = (value_range, (0.0, float(magnitude.max())))
+        return joint_histogram(values, magnitude, bins=bins, ranges=ranges)
+
+    def render_values(self, values):
+        """ Map raw data values to the corresponding render data values.
+        """
+        window = self.render_window
+        if window is None:
+            return values
+
+        low, high = window
+        max_value = np.iinfo(self._render_data_type()).max
+        scale = max_value / (high - low) if high > low else 0.0
+        return (np.asarray(values, dtype=float) - low) * scale
+
+    def update_region(self, slices, values):
+        """ Write `values` into part of the raw data and update only the
+        affected region of the render data.
+
+        The values are written into `raw_data` in place. When it is the
+        Fortran ordered array which was assigned to `raw_data`, that array is
+        changed too. Assign a copy to keep the original values.
+
+        Quantized render data keeps its window unless a 'minmax' window no
+        longer covers the new values. Then the window is widened and the
+        render data is rebuilt.
+
+        Parameters
+        ----------
+        slices : tuple
+            A tuple of slices and/or integer indices selecting the region of
+            `raw_data` to overwrite.
+        values : array-like
+            The new values. Must be broadcastable to the selected region.
+        """
+        slices = slices if isinstance(slices, tuple) else (slices,)
+        self._raw_data[slices] = values
+        if self._quantized_data is not None:
+            region = self._raw_data[slices]
+            if self._region_outside_window(region):
+                # Clipping would lose the new values. Quantize the whole
+                # volume again in a window which covers them.
+                self._quantized_data = None
+                self._render_window = None
+                self._resampled_data = None
+                self._render_data = None
+            else:
+                # Keep the existing window, so the rest of the volume is valid
+                self._quantized_data[slices] = _quantize(
+                    region, self._render_window, self._quantized_data.dtype
+                )
+
+        render_extent = None
+        if self._render_data is not None:
+            render_extent = _render_extent_for_region(slices,
+                                                      self._raw_data.shape)
+            if not self._update_render_region(render_extent):
+                self._render_data = None
+                render_extent = None
+
+        self.region_updated = (slices, render_extent)
+
+    def visible_bounds(self, is_visible):
+        """ Return the bounds of the part of `render_data` which can be seen.
+
+        Parameters
+        ----------
+        is_visible : callable
+            Called with arrays of brick minimum and maximum values. Returns a
+            boolean array which is True for bricks containing visible values.
+
+        Returns
+        -------
+        bounds : tuple or None
+            (xmin, xmax, ymin, ymax, zmin, zmax) enclosing every visible
+            brick, or None if no brick is visible.
+        """
+        ranges = self.brick_ranges
+        visible = is_visible(ranges[..., 0], ranges[..., 1])
+        if not visible.any():
+            return None
+
+        render_data = self.render_data
+        size = self.brick_size
+        bounds = []
+        for axis in range(3):
+            other_axes = tuple(a for a in range(3) if a != axis)
+            indices = np.flatnonzero(visible.any(axis=other_axes))
+            last_point = render_data.dimensions[axis] - 1
+            # Pad by one grid point, since samples between a brick's edge and
+            # its neighbor interpolate values from both.
+            start = max(indices[0] * size - 1, 0)
+            stop = min((indices[-1] + 1) * size, last_point)
+            origin = render_data.origin[axis]
+            spacing = render_data.spacing[axis]
+            bounds.extend([origin + start * spacing, origin + stop * spacing])
+        return tuple(bounds)
+
     # -------------------------------------------------------------------------
     # Traits handlers
     # -------------------------------------------------------------------------
@@ -111,30 +503,228 @@ class VolumeData(HasStrictTraits):
             self._render_data = self._prepare_data()
         return self._render_data
 
+    def _get_brick_ranges(self):
+        if self._brick_ranges is None:
+            array = _array_from_image_data(self.render_data)
+            self._brick_ranges = _brick_ranges(array, self.brick_size)
+        return self._brick_ranges
+
+    @on_trait_change('_render_data,brick_size')
+    def _invalidate_brick_ranges(self):
+        self._brick_ranges = None
+
+    def _get_gradient_magnitude(self):
+        if self._gradient_magnitude is None:
+            render_data = self.render_data
+            self._gradient_magnitude = _gradient_magnitude(
+                _array_from_image_data(render_data), render_data.spacing
+            )
+        return self._gradient_magnitude
+
+    @on_trait_change('_render_data')
+    def _invalidate_gradients(self):
+        self._gradient_magnitude = None
+
+    def _get_render_window(self):
+        if self._render_data_type() is None:
+            return None
+
+        if self._render_window is None:
+            raw_data = self.raw_data
+            if self.quantization_window == 'percentile':
+                window = np.percentile(raw_data, self.quantization_percentiles)
+            else:
+                window = (raw_data.min(), raw_data.max())
+            low, high = (float(v) for v in window)
+            if high <= low:
+                # A constant window has no range to spread over the render
+                # type. Centre its value in a unit window, which keeps it
+                # apart from the zeros of masked out points.
+                low, high = low - 0.5, low + 0.5
+            self._render_window = (low, high)
+        return self._render_window
+
+    @on_trait_change('render_dtype,quantization_window,'
+                     'quantization_percentiles')
+    def _invalidate_resampled_data(self):
+        self._render_data = None
+        self._resampled_data = None
+        self._quantized_data = None
+        self._render_window = None
+
+    @on_trait_change('mask,mask:updated,mask_bounds,mask_resampling')
+    def _mask_changed(self):
+        self._invalidate_mask()
+        self.mask_updated = True
+
+    @on_trait_change('mask,mask_bounds')
+    def _invalidate_render_labels(self):
+        self._render_labels = None
+        self._render_labels_source = None
+
+    def _invalidate_mask(self):
+        self._render_data = None
+        self._render_mask = None
+
     def _get_mask_data(self):
         return self._mask_data
 
     def _set_mask_data(self, value):
-        self._render_data = None
+        self._invalidate_mask()
         self._mask_data = np.asfortranarray(value)
+        self.mask_updated = True
 
     def _get_raw_data(self):
         return self._raw_data
 
     def _set_raw_data(self, value):
-        self._render_data = None
-        self._raw_data = np.asfortranarray(value)
+        self._invalidate_resampled_data()
+        value = np.asfortranarray(value)
+        if value.shape != self._raw_data.shape:
+            self._render_mask = None
+            self._render_labels = None
+        self._raw_data = value
 
     # -------------------------------------------------------------------------
     # Private methods
     # -------------------------------------------------------------------------
 
-    def _prepare_data(self):
-        image_data = _image_data_from_array(self.raw_data, self.spacing)
-        resampled_data = _resample_data(image_data)
+    def _region_outside_window(self, region):
+        """ Whether a 'minmax' quantization window no longer covers the raw
+        values in `region`. 'percentile' windows clip values by design.
+        """
+        if self.quantization_window != 'minmax' or region.size == 0:
+            return False
+        low, high = self._render_window
+        return region.min() < low or region.max() > high
+
+    def _render_data_type(self):
+        """ The integer type to quantize to, or None to use the raw data.
+        """
+        dtype = self.render_dtype
+        if dtype == 'native':
+            return None
+        elif dtype == 'auto':
+            raw_type = self.raw_data.dtype
+            if raw_type.kind in 'iub' and raw_type.itemsize <= 2:
+                return None
+            return np.dtype('uint16')
+        return np.dtype(dtype)
+
+    def _render_source_data(self):
+        """ The array which is resampled into the render data.
+        """
+        dtype = self._render_data_type()
+        if dtype is None:
+            return self.raw_data
+
+        if self._quantized_data is None:
+            self._quantized_data = _quantize(self.raw_data, self.render_window,
+                                             dtype)
+        return self._quantized_data
+
+    def _update_render_region(self, extent):
+        """ Recompute the region `extent` of the render data in place.
+        Returns False if the region could not be updated.
+        """
+        resampled_array = _array_from_image_data(self._resampled_data)
+        if resampled_array.shape != (RENDER_GRID_SIZE,) * 3:
+            return False
+
+        image_data = _image_data_from_array(self._render_source_data(),
+                                            self.spacing)
+        region_data = _resample_data(image_data, output_extent=extent)
+        region = tuple(slice(extent[2*i], extent[2*i+1] + 1) for i in range(3))
+        values = _array_from_image_data(region_data)
+        resampled_array[region] = values
+        self._resampled_data.point_data.scalars.modified()
+
+        if self._render_data is not self._resampled_data:
+            mask = self._get_render_mask()
+            render_array = _array_from_image_data(self._render_data)
+            render_array[region] = values * mask[region]
+            self._render_data.point_data.scalars.modified()
+
+        self._brick_ranges = None
+        self._invalidate_gradients()
+        return True
+
+    def _dense_mask(self):
+        """ The mask as a dense array, or None if there is no mask.
+        """
+        if self.mask is not None:
+            return self.mask.to_array()
+        elif self.mask_data.size > 1:
+            return self.mask_data
+        return None
+
+    def _get_render_mask(self):
+        """ The mask resampled onto the render grid, or None if there is no
+        mask.
+        """
+        if self._render_mask is None:
+            if (isinstance(self.mask, LabelMask) and
+                    self.mask_resampling == 'nearest'):
+                self._render_mask = self._label_render_mask()
+                return self._render_mask
+
+            mask = self._dense_mask()
+            if mask is None:
+                return None
+
+            mask = mask if mask.dtype == bool else (mask != 0)
+            mask_bounds, grid_steps = self._mask_grid()
+            for axis in range(3):
+                mask = _resample_mask_axis(
+                    mask, axis, mask_bounds[2*axis:2*axis+2], grid_steps[axis],
+                    RENDER_GRID_SIZE, self.mask_resampling
+                )
+            self._render_mask = np.asfortranarray(mask)
+        return self._render_mask
+
+    def _label_render_mask(self):
+        """ Resample the labels of a `LabelMask` onto the render grid once,
+        and select the enabled labels there.
+        """
+        labels = self.mask.labels
+        if (self._render_labels is None or
+                self._render_labels_source is not labels):
+            mask_bounds, grid_steps = self._mask_grid()
+            self._render_labels = _resample_labels(
+                labels, mask_bounds, grid_steps, RENDER_GRID_SIZE
+            )
+            self._render_labels_source = labels
+
+        render_labels, region = self._render_labels
+        render_mask = np.zeros((RENDER_GRID_SIZE,) * 3, dtype=bool,
+                               order='F')
+        render_mask[region] = self.mask.select(render_labels)
+        return render_mask
+
+    def _mask_grid(self):
+        """ The physical bounds of the mask and the spacing of the render
+        grid along each axis.
+        """
+        raw_shape = self.raw_data.shape
+        mask_bounds = self.mask_bounds
+        if mask_bounds is None:
+            mask_bounds = sum(((0.0, self.spacing[i] * raw_shape[i])
+                               for i in range(3)), ())
+        grid_steps = tuple(
+            self.spacing[axis] * (raw_shape[axis] / RENDER_GRID_SIZE)
+            for axis in range(3)
+        )
+        return mask_bounds, grid_steps
 
-        if self.mask_data.size > 1:
-            masked_data = _apply_mask(resampled_data, self.mask_data)
-            return masked_data
+    def _prepare_data(self):
+        if self._resampled_data is None:
+            image_data = _image_data_from_array(self._render_source_data(),
+                                                self.spacing)
+            self._resampled_data = _resample_data(image_data)
+        resampled_data = self._resampled_data
+
+        render_mask = self._get_render_mask()
+        if render_mask is not None:
+            return _mask_image_data(resampled_data, render_mask)
 
         return resampled_data
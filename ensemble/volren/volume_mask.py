@@ -0,0 +1,133 @@
+from __future__ import division, unicode_literals
+from abc import abstractmethod
+
+import numpy as np
+
+from traits.api import (ABCHasStrictTraits, Any, Array, Event, Int, Property,
+                        Set, Tuple, on_trait_change)
+
+# The largest label range for which `LabelMask` selects labels with a lookup
+# table. Wider ranges of sparse label values use np.isin instead.
+LABEL_TABLE_MAX_SIZE = 2 ** 20
+
+
+class ABCVolumeMask(ABCHasStrictTraits):
+    """ An abstract base class for compact representations of a volume mask.
+    """
+
+    # The shape of the dense mask
+    shape = Property(Tuple(Int, Int, Int))
+
+    # Fired when the masked region changes
+    updated = Event
+
+    @abstractmethod
+    def to_array(self):
+        """ Return the mask as a dense, Fortran ordered boolean array.
+        """
+
+
+class BitMask(ABCVolumeMask):
+    """ A boolean mask which is stored with one bit per voxel.
+    """
+
+    # The mask bits, flattened in Fortran order and packed with np.packbits
+    packed = Array(dtype=np.uint8, shape=(None,))
+
+    # The shape of the dense mask
+    _shape = Tuple(Int, Int, Int)
+
+    @classmethod
+    def from_array(cls, array):
+        """ Create an instance from a dense array. Nonzero values are kept.
+        """
+        array = np.asarray(array)
+        bits = (array != 0).ravel(order='F')
+        return cls(packed=np.packbits(bits), _shape=array.shape)
+
+    def to_array(self):
+        """ Return the mask as a dense, Fortran ordered boolean array.
+        """
+        size = int(np.prod(self._shape))
+        bits = np.unpackbits(self.packed)[:size].view(bool)
+        return bits.reshape(self._shape, order='F')
+
+    def _get_shape(self):
+        return self._shape
+
+    @on_trait_change('packed')
+    def _mask_changed(self):
+        self.updated = True
+
+
+class LabelMask(ABCVolumeMask):
+    """ A volume of integer labels, any number of which can be enabled.
+
+    Voxels whose label is in `enabled_labels` are kept.
+    """
+
+    # The label of each voxel. Zero is conventionally background.
+    labels = Array(shape=(None, None, None))
+
+    # The labels which are shown
+    enabled_labels = Set(Int)
+
+    # The (min, max) of `labels`, cached until they change
+    _label_range = Any
+
+    @classmethod
+    def from_array(cls, array, enabled_labels=None):
+        """ Create an instance from an integer label array. By default, all
+        nonzero labels are enabled.
+        """
+        labels = np.asfortranarray(array)
+        if enabled_labels is None:
+            enabled_labels = set(np.unique(labels).tolist()) - {0}
+        return cls(labels=labels, enabled_labels=enabled_labels)
+
+    def to_array(self):
+        """ Return the mask as a dense, Fortran ordered boolean array.
+        """
+        return self.select(self.labels)
+
+    def select(self, labels):
+        """ Return a Fortran ordered boolean array which is True where the
+        values of `labels` are enabled.
+
+        `labels` holds values of `labels`, such as a resampled copy of it.
+        """
+        if labels.size == 0:
+            return np.zeros(labels.shape, dtype=bool, order='F')
+
+        low, high = self._get_label_range()
+        if high - low >= LABEL_TABLE_MAX_SIZE:
+            enabled = np.array(sorted(self.enabled_labels))
+            return np.asfortranarray(np.isin(labels, enabled))
+
+        # A lookup table over the label values is much faster than np.isin
+        table = np.zeros(high - low + 1, dtype=bool)
+        enabled = [label - low for label in self.enabled_labels
+                   if low <= label <= high]
+        table[enabled] = True
+        indices = labels
+        if low != 0:
+            # Signed label types might not hold the offsets
+            dtype = np.promote_types(labels.dtype,
+                                     np.min_scalar_type(high - low))
+            indices = np.subtract(labels, low, dtype=dtype)
+        return np.asfortranarray(table[indices])
+
+    def _get_label_range(self):
+        if self._label_range is None:
+            labels = self.labels
+            self._label_range = (int(labels.min()), int(labels.max()))
+        return self._label_range
+
+    def _get_shape(self):
+        return self.labels.shape
+
+    @on_trait_change('labels,enabled_labels,enabled_labels_items')
+    def _mask_changed(self, name, new):
+        if name == 'labels':
+            self._label_range = None
+        self.updated = True
@@ -1,14 +1,20 @@
 from __future__ import division, unicode_literals
 
+from contextlib import contextmanager
+
+import numpy as np
 from mayavi.sources.vtk_data_source import VTKDataSource
 from mayavi.tools.tools import add_dataset
-from traits.api import (HasStrictTraits, CInt, Enum, Instance, List, Property,
-                        Range, on_trait_change)
+from traits.api import (HasStrictTraits, Any, Bool, CFloat, CInt, Enum,
+                        Instance, List, Property, Range, on_trait_change)
 from tvtk.api import tvtk
 
-from ensemble.ctf.api import PiecewiseFunction
+from ensemble.ctf.api import PiecewiseFunction, TransferFunction2D
 from .volume_3d import Volume3D, volume3d
+from .render_throttle import RenderThrottle
+from .update_scheduler import UpdateScheduler
 from .volume_data import VolumeData
+from .volume_time_series import VolumeTimeSeries
 
 CLIP_MAX = 512
 QUALITY_SETTINGS = {
@@ -32,6 +38,20 @@ QUALITY_SETTINGS = {
             'shade': False
         }
     },
+    # Lit with the gradients which the mapper estimates on the fly. Costs
+    # more per frame than 'default'.
+    'shaded': {
+        'mapper': {
+            'sample_distance': 0.2,
+        },
+        'property': {
+            'shade': True,
+            'ambient': 0.4,
+            'diffuse': 0.6,
+            'specular': 0.2,
+            'specular_power': 20,
+        }
+    },
     'performance': {
         'mapper': {
             'sample_distance': 1.0,
@@ -42,11 +62,79 @@ QUALITY_SETTINGS = {
     },
 }
 
+# The (value, gradient magnitude) size of the 2D transfer function table.
+TRANSFER_FUNCTION_2D_SHAPE = (256, 128)
+
+
+def apply_render_quality(mapper, volume_property, render_quality):
+    """ Apply one of the `QUALITY_SETTINGS` to a volume mapper and property.
+    """
+    render_settings = QUALITY_SETTINGS[render_quality]
+    mapper.trait_set(**render_settings['mapper'])
+    volume_property.trait_set(**render_settings['property'])
+
+
+def build_transfer_functions(colors, opacities, lerp, global_alpha=1.0):
+    """ Build VTK transfer functions from color and opacity functions.
+
+    Parameters
+    ----------
+    colors : PiecewiseFunction
+        The color function.
+    opacities : PiecewiseFunction
+        The opacity function.
+    lerp : callable
+        Maps relative positions in the functions to values of the rendered
+        data.
+    global_alpha : float
+        A factor applied to every opacity.
+
+    Returns
+    -------
+    color_tf : tvtk.ColorTransferFunction
+    opacity_tf : tvtk.PiecewiseFunction
+    opacity_points : list
+        The (value, opacity) points of `opacity_tf`.
+    """
+    color_tf = tvtk.ColorTransferFunction()
+    for color in colors.values():
+        color_tf.add_rgb_point(lerp(color[0]), *(color[1:]))
+
+    opacity_tf = tvtk.PiecewiseFunction()
+    opacity_points = []
+    alphas = opacities.values()
+    for i, alpha in enumerate(alphas):
+        x = alpha[0]
+        if i > 0:
+            # Look back one item. VTK doesn't like exact vertical jumps, so
+            # we need to jog a value that is exactly equal by a little bit.
+            if alphas[i-1][0] == alpha[0]:
+                x += 1e-8
+        opacity_points.append((lerp(x), alpha[1] * global_alpha))
+        opacity_tf.add_point(*opacity_points[-1])
+    return color_tf, opacity_tf, opacity_points
+
+
+def _opacity_is_nonzero(points, lows, highs):
+    """ Return a boolean array which is True where the piecewise linear
+    function through `points` is nonzero somewhere in [lows, highs].
+    """
+    xs, ys = np.asarray(points, dtype=float).T
+    nonzero = (np.interp(lows, xs, ys) > 0) | (np.interp(highs, xs, ys) > 0)
+    # Also catch peaks which lie strictly between the two ends.
+    peaks = np.sort(xs[ys > 0])
+    inside = (np.searchsorted(peaks, highs, side='right') -
+              np.searchsorted(peaks, lows, side='left'))
+    return nonzero | (inside > 0)
+
 
 class VolumeRenderer(HasStrictTraits):
     # The data to plot
     data = Instance(VolumeData)
 
+    # An optional time series. If set, `data` follows its current frame.
+    time_series = Instance(VolumeTimeSeries)
+
     # The mayavi data source for the volume data
     data_source = Instance(VTKDataSource)
 
@@ -56,21 +144,49 @@ class VolumeRenderer(HasStrictTraits):
     # The tvtk.Actor for `volume`
     actor = Property(Instance(tvtk.Actor), depends_on='volume')
 
-    # The minimum and maximum displayed intensity values.
-    vmin = CInt(0)
-    vmax = CInt(255)
+    # The minimum and maximum displayed intensity values, in raw data units.
+    vmin = CFloat(0)
+    vmax = CFloat(255)
 
     # The transfer function components
     opacities = Instance(PiecewiseFunction)
     colors = Instance(PiecewiseFunction)
     global_alpha = Range(0.0, 1.0, value=1.0)
 
+    # An optional value x gradient magnitude transfer function. When set, it
+    # is used for rendering instead of `colors` and `opacities`.
+    transfer_function_2d = Instance(TransferFunction2D)
+
     # Clip plane positions
     clip_bounds = List(CInt)
 
     # Render quality setting
     render_quality = Enum('default', list(QUALITY_SETTINGS.keys()))
 
+    # If True, crop rendering to the bricks of the volume which are visible
+    # with the current opacity transfer function.
+    skip_empty_space = Bool(True)
+
+    # The opacity transfer function points, as given to VTK
+    _opacity_points = List
+
+    # The bounds of the visible part of the volume, or None if nothing shows
+    _visible_bounds = Any
+
+    # The clipping planes given to the volume mapper. Updated in place.
+    _clip_planes = List(Instance(tvtk.Plane))
+
+    # The mapper which currently holds `_clip_planes`
+    _clip_planes_mapper = Any
+
+    # Runs the updates of the volume which follow changes of the data, the
+    # transfer function and the settings, each at most once per burst of
+    # changes. Use its `batch` method to make several changes at once.
+    scheduler = Instance(UpdateScheduler)
+
+    # Limits clip plane updates to one per frame while dragging
+    _clip_throttle = Instance(RenderThrottle)
+
     # -------------------------------------------------------------------------
     # Public interface
     # -------------------------------------------------------------------------
@@ -80,34 +196,23 @@ class VolumeRenderer(HasStrictTraits):
                              figure=scene_model.mayavi_scene)
         self.data_source = source
         self.volume = volume3d(source, figure=scene_model.mayavi_scene)
-        self._setup_volume()
+        self.scheduler.invalidate('render_quality', 'transfer_function',
+                                  'clip_planes')
+
+    def flush(self):
+        """ Apply any throttled updates now, instead of waiting for the GUI
+        event loop.
+        """
+        self._clip_throttle.flush()
 
     def set_transfer_function(self, colors=None, opacities=None):
         """ Update the volume mapper's transfer function.
         """
-        lerp = lambda x: self.vmin + x * (self.vmax - self.vmin)  # noqa
-
         if colors is not None:
             self.colors = colors
         if opacities is not None:
             self.opacities = opacities
-
-        color_tf = tvtk.ColorTransferFunction()
-        for color in self.colors.values():
-            color_tf.add_rgb_point(lerp(color[0]), *(color[1:]))
-
-        opacity_tf = tvtk.PiecewiseFunction()
-        alphas = self.opacities.values()
-        for i, alpha in enumerate(alphas):
-            x = alpha[0]
-            if i > 0:
-                # Look back one item. VTK doesn't like exact vertical jumps, so
-                # we need to jog a value that is exactly equal by a little bit.
-                if alphas[i-1][0] == alpha[0]:
-                    x += 1e-8
-            opacity_tf.add_point(lerp(x), alpha[1] * self.global_alpha)
-
-        self._set_volume_ctf(color_tf, opacity_tf)
+        self.scheduler.invalidate('transfer_function')
 
     # -------------------------------------------------------------------------
     # Traits bits
@@ -116,28 +221,110 @@ class VolumeRenderer(HasStrictTraits):
     def _clip_bounds_default(self):
         return [0, CLIP_MAX, 0, CLIP_MAX, 0, CLIP_MAX]
 
+    def __clip_planes_default(self):
+        # A (min, max) pair of planes per axis, with normals pointing inward.
+        planes = []
+        for axis in range(3):
+            normal = [0.0, 0.0, 0.0]
+            normal[axis] = 1.0
+            planes.append(tvtk.Plane(normal=normal))
+            normal[axis] = -1.0
+            planes.append(tvtk.Plane(normal=normal))
+        return planes
+
+    def __clip_throttle_default(self):
+        return RenderThrottle(callback=self._update_clip_planes)
+
+    @on_trait_change('time_series.data')
+    def _time_series_frame_changed(self):
+        if self.time_series is not None:
+            self.data = self.time_series.data
+
+    def _scheduler_default(self):
+        # Each task follows the tasks whose results it uses
+        scheduler = UpdateScheduler()
+        scheduler.add_task('data_range', self._update_data_range)
+        scheduler.add_task('render_data', self._update_render_data)
+        scheduler.add_task('render_quality', self._update_render_quality)
+        scheduler.add_task('transfer_function', self._update_transfer_function,
+                           depends_on=('data_range',))
+        scheduler.add_task('transfer_function_2d', self._set_volume_ctf_2d,
+                           depends_on=('render_data', 'transfer_function'))
+        scheduler.add_task('visible_bounds', self._update_visible_bounds,
+                           depends_on=('render_data', 'transfer_function'))
+        scheduler.add_task('clip_planes', self._set_volume_clip_planes)
+        scheduler.add_task('render', self._render)
+        return scheduler
+
     @on_trait_change('data.raw_data')
     def _update_data(self):
-        self.vmin = self.data.raw_data.min()
-        self.vmax = self.data.raw_data.max()
-        self._render_data_changed()
-
-    @on_trait_change('data:mask_data')
-    def _render_data_changed(self):
-        if self.data_source is not None:
-            image_data = self.data.render_data
-            self.data_source.data = image_data
-            self.data_source.update()
-            self._setup_volume()
+        if self._fixed_range() is None:
+            self.scheduler.invalidate('data_range', 'render_data')
+        else:
+            # The frames of the time series share the transfer function
+            self.scheduler.invalidate('render_data')
+
+    @on_trait_change('time_series.fixed_range')
+    def _time_series_range_changed(self):
+        self.scheduler.invalidate('data_range')
+
+    @on_trait_change('data.bounds')
+    def _data_bounds_changed(self):
+        self.scheduler.invalidate('clip_planes')
+
+    @on_trait_change('data:mask_updated')
+    def _mask_updated(self):
+        # The mask leaves the transfer function and the clipping as they are
+        self.scheduler.invalidate('render_data')
+
+    @on_trait_change('data:[render_dtype,quantization_window,'
+                     'quantization_percentiles]')
+    def _quantization_changed(self):
+        # The transfer function maps raw values to quantized values
+        self.scheduler.invalidate('render_data', 'transfer_function')
+
+    @on_trait_change('data:region_updated')
+    def _render_region_updated(self, event):
+        raw_slices, render_extent = event
+        range_changed = False
+        if self._fixed_range() is None:
+            region = self.data.raw_data[raw_slices]
+            vmin = min(self.vmin, region.min())
+            vmax = max(self.vmax, region.max())
+            range_changed = (vmin, vmax) != (self.vmin, self.vmax)
+            self.vmin, self.vmax = vmin, vmax
+
+        scheduler = self.scheduler
+        with scheduler.batch():
+            if render_extent is None:
+                # A rebuild may have widened the quantization window, which
+                # the transfer function maps onto.
+                scheduler.invalidate('render_data', 'transfer_function')
+            elif self.data_source is not None:
+                # The image data was modified in place. Let the pipeline know,
+                # without rebuilding the volume's clipping.
+                self.data_source.update()
+                scheduler.invalidate('visible_bounds', 'render')
+            if range_changed:
+                scheduler.invalidate('transfer_function')
+
+    @on_trait_change('transfer_function_2d,transfer_function_2d:updated')
+    def _transfer_function_2d_updated(self):
+        # Edits only rebuild the small lookup table, never the volume.
+        self.scheduler.invalidate('transfer_function_2d', 'visible_bounds',
+                                  'render')
 
     def _clip_bounds_changed(self):
-        self._set_volume_clip_planes()
+        self._clip_throttle.request()
 
     def _global_alpha_changed(self):
-        self.set_transfer_function()
+        self.scheduler.invalidate('transfer_function')
 
     def _render_quality_changed(self):
-        self._setup_volume()
+        self.scheduler.invalidate('render_quality')
+
+    def _skip_empty_space_changed(self):
+        self.scheduler.invalidate('visible_bounds')
 
     def _get_actor(self):
         return self.volume.actors[0]
@@ -146,31 +333,182 @@ class VolumeRenderer(HasStrictTraits):
     # Private methods
     # -------------------------------------------------------------------------
 
-    def _setup_volume(self):
-        render_settings = QUALITY_SETTINGS[self.render_quality]
-        self.volume.volume_mapper.trait_set(**render_settings['mapper'])
-        self.volume.volume_property.trait_set(**render_settings['property'])
-        self._set_volume_clip_planes()
-        self.set_transfer_function()
+    def _render(self):
+        if self.volume is not None:
+            self.volume.render()
+
+    def _fixed_range(self):
+        """ The data range shared by the frames of `time_series`, or None.
+        """
+        if self.time_series is None:
+            return None
+        return self.time_series.fixed_range
+
+    def _update_data_range(self):
+        fixed_range = self._fixed_range()
+        if fixed_range is not None:
+            self.vmin, self.vmax = fixed_range
+        elif self.data is not None:
+            self.vmin = self.data.raw_data.min()
+            self.vmax = self.data.raw_data.max()
+
+    @contextmanager
+    def _render_disabled(self):
+        """ Suspend the renders which Mayavi triggers for each changed
+        property. The 'render' task renders once instead.
+        """
+        scene = None if self.volume is None else self.volume.scene
+        if scene is None:
+            yield
+            return
+
+        disable_render = scene.disable_render
+        scene.disable_render = True
+        try:
+            yield
+        finally:
+            # Setting it quietly avoids an immediate render
+            scene.trait_setq(disable_render=disable_render)
+        self.scheduler.invalidate('render')
+
+    def _update_render_data(self):
+        if self.data is not None and self.data_source is not None:
+            with self._render_disabled():
+                self.data_source.data = self.data.render_data
+                self.data_source.update()
+
+    def _update_render_quality(self):
+        if self.volume is not None:
+            with self._render_disabled():
+                apply_render_quality(self.volume.volume_mapper,
+                                     self.volume.volume_property,
+                                     self.render_quality)
+
+    def _update_transfer_function(self):
+        if self.colors is None or self.opacities is None:
+            return
+
+        # Map positions in the function to values in the render data, which
+        # might be quantized from the raw data values.
+        to_render = (self.data.render_values if self.data is not None
+                     else lambda value: value)
+
+        def lerp(x):
+            return to_render(self.vmin + x * (self.vmax - self.vmin))
+
+        color_tf, opacity_tf, opacity_points = build_transfer_functions(
+            self.colors, self.opacities, lerp, self.global_alpha
+        )
+        self._opacity_points = opacity_points
+        self._set_volume_ctf(color_tf, opacity_tf)
 
     def _set_volume_clip_planes(self):
-        if self.data is None:
+        if self.data is None or self.volume is None:
             return
 
-        bounds = [b//CLIP_MAX for b in self.data.bounds]
+        bounds = [b / CLIP_MAX for b in self.data.bounds]
         mn = [bounds[i]*pos for i, pos in enumerate(self.clip_bounds[::2])]
         mx = [bounds[i]*pos for i, pos in enumerate(self.clip_bounds[1::2])]
-        planes = tvtk.Planes()
-        # The planes need to be inside out to serve as clipping planes
-        planes.set_bounds(mx[0], mn[0],
-                          mx[1], mn[1],
-                          mx[2], mn[2])
-        # Set them as the clipping planes for the volume mapper
-        self.volume.volume.mapper.clipping_planes = planes
+        if self.skip_empty_space and self._visible_bounds is not None:
+            visible = self._visible_bounds
+            mn = [max(mn[i], visible[2*i]) for i in range(3)]
+            mx = [min(mx[i], visible[2*i+1]) for i in range(3)]
+        for axis in range(3):
+            min_plane, max_plane = self._clip_planes[2*axis:2*axis+2]
+            origin = [0.0, 0.0, 0.0]
+            origin[axis] = mn[axis]
+            min_plane.origin = origin
+            origin[axis] = mx[axis]
+            max_plane.origin = origin
+
+        # Hand the planes to the mapper only once. Later updates modify the
+        # planes in place, which the mapper picks up without rebuilding.
+        mapper = self.volume.volume.mapper
+        if mapper is not self._clip_planes_mapper:
+            mapper.remove_all_clipping_planes()
+            for plane in self._clip_planes:
+                mapper.add_clipping_plane(plane)
+            self._clip_planes_mapper = mapper
+
+    def _update_clip_planes(self):
+        self.scheduler.invalidate('clip_planes', 'render')
+
+    def _update_visible_bounds(self):
+        if self.data is None or self.volume is None:
+            return
+
+        visible_bounds = None
+        # Brick skipping only knows about the 1D opacity function
+        uses_1d_function = self.transfer_function_2d is None
+        if (self.skip_empty_space and uses_1d_function and
+                self._opacity_points):
+            points = self._opacity_points
+            visible_bounds = self.data.visible_bounds(
+                lambda lows, highs: _opacity_is_nonzero(points, lows, highs)
+            )
+            if visible_bounds is None:
+                # Nothing is visible. Clip everything away.
+                visible_bounds = (0.0, -1.0) * 3
+
+        if visible_bounds != self._visible_bounds:
+            self._visible_bounds = visible_bounds
+            self.scheduler.invalidate('clip_planes')
+
+    def _transfer_function_2d_axes(self):
+        """ The relative (value, gradient magnitude) coordinates of the rows
+        and columns of VTK's 2D transfer function table.
+        """
+        num_values, num_gradients = TRANSFER_FUNCTION_2D_SHAPE
+        render_data = self.data.render_data
+        low, high = render_data.point_data.scalars.range
+        func_low, func_high = self.data.render_values([self.vmin, self.vmax])
+        values = np.linspace(low, high, num_values)
+        if func_high > func_low:
+            values = (values - func_low) / (func_high - func_low)
+
+        # VTK computes gradients on the fly and scales their magnitude by the
+        # mean spacing and a quarter of the scalar range. The cached gradient
+        # volume gives the range of the function's gradient axis.
+        max_gradient = self.data.gradient_magnitude.max()
+        gradients = np.linspace(0.0, 1.0, num_gradients)
+        if max_gradient > 0:
+            spacing = np.mean(render_data.spacing)
+            gradients *= 0.25 * (high - low) / (spacing * max_gradient)
+        return values, gradients
+
+    def _transfer_function_2d_table(self):
+        """ Evaluate `transfer_function_2d` on VTK's 2D transfer function
+        table, as an RGBA array of shape `TRANSFER_FUNCTION_2D_SHAPE` + (4,).
+        """
+        function = self.transfer_function_2d
+        table = function.lookup_table(*self._transfer_function_2d_axes())
+        table[..., 3] *= self.global_alpha
+        return table
+
+    def _set_volume_ctf_2d(self):
+        if self.volume is None:
+            return
+
+        vp = tvtk.to_vtk(self.volume.volume_property)
+        if not hasattr(vp, 'SetTransferFunction2D'):
+            # Not supported by this version of VTK
+            return
+
+        function = self.transfer_function_2d
+        if function is None:
+            vp.SetTransferFunctionModeTo1D()
+            return
+
+        table = self._transfer_function_2d_table()
+        image = tvtk.ImageData(dimensions=TRANSFER_FUNCTION_2D_SHAPE + (1,))
+        # VTK images are ordered with the first axis varying fastest.
+        image.point_data.scalars = table.transpose(1, 0, 2).reshape(-1, 4)
+        vp.SetTransferFunction2D(tvtk.to_vtk(image))
+        vp.SetTransferFunctionModeTo2D()
 
     def _set_volume_ctf(self, color_tf, opacity_tf):
         if self.volume is not None:
             vp = self.volume.volume_property
             vp.set_scalar_opacity(opacity_tf)
             vp.set_color(color_tf)
-            self.volume._update_ctf_fired()
+            self.scheduler.invalidate('render')
@@ -7,9 +7,27 @@ from traits.api import ABCHasStrictTraits
 class ABCVolumeSceneMember(ABCHasStrictTraits):
     """ An abstract base class for object which contribute actors to a mayavi
     scene which contains a `Volume` actor.
+
+    Members add their actors once with `add_actors_to_scene`. Right after
+    that and whenever the data of the volume changes, `update_for_volume`
+    updates the existing actors, and `remove_actors` takes them out of the
+    scene again. Both do nothing by default, so members which only
+    implement `add_actors_to_scene` keep their actors as they are.
     """
 
     @abstractmethod
     def add_actors_to_scene(self, scene_model, volume_actor):
         """ Add actors to the mayavi scene `scene_model`.
         """
+
+    def update_for_volume(self, scene_model, volume_actor, volume_data):
+        """ Update the actors added by `add_actors_to_scene` for the
+        `VolumeData` instance `volume_data`, which `volume_actor` shows.
+        """
+        pass
+
+    def remove_actors(self, scene_model):
+        """ Remove the actors added by `add_actors_to_scene` from the mayavi
+        scene `scene_model`.
+        """
+        pass
@@ -0,0 +1,232 @@
+from __future__ import division, unicode_literals
+
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+from pyface.api import GUI
+from pyface.timer.api import Timer
+from traits.api import (HasStrictTraits, Any, Callable, Either, Enum, Float,
+                        Instance, Int, Tuple)
+
+from .volume_data import VolumeData
+
+
+def _prepare_frame(load_frame, index, spacing):
+    """ Load one frame and build its VolumeData, including the render data.
+
+    This usually runs on a worker thread.
+    """
+    volume_data = VolumeData(raw_data=load_frame(index), spacing=spacing)
+    volume_data.render_data
+    return volume_data
+
+
+class VolumeTimeSeries(HasStrictTraits):
+    """ A sequence of volumes which are played back one frame at a time.
+
+    Prepared frames are kept in a bounded LRU cache and the next frames in the
+    playback direction are prepared ahead of time on a pool of worker threads.
+    Frames are never waited for on the GUI thread. `data` keeps the last
+    prepared frame until the frame of `current_frame` is ready, and playback
+    holds at a frame until the next one is ready.
+    """
+
+    # The number of frames in the series.
+    num_frames = Int
+
+    # A callable which returns the raw array for a frame index. Frames are
+    # only loaded when needed, so this can read from disk.
+    load_frame = Callable
+
+    # The spacing between grid points in each dimension.
+    spacing = Tuple(Float, Float, Float)
+
+    # The index of the frame being displayed.
+    current_frame = Int(0)
+
+    # The data for `current_frame`, or for the previously shown frame while
+    # `current_frame` is being prepared.
+    data = Instance(VolumeData)
+
+    # The index of the frame in `data`.
+    data_frame = Int(0)
+
+    # A (min, max) data range shared by all frames, or None to use the range
+    # of each frame. Renderers map the transfer function over it, so colors
+    # do not change from frame to frame.
+    fixed_range = Either(None, Tuple(Float, Float))
+
+    # The maximum number of prepared frames to keep.
+    cache_size = Int(8)
+
+    # How many frames to prepare ahead of `current_frame`.
+    prefetch_count = Int(2)
+
+    # The playback direction.
+    direction = Enum(1, -1)
+
+    # The playback speed in frames per second.
+    frame_rate = Float(10.0)
+
+    # The number of worker threads used for prefetching.
+    num_workers = Int(2)
+
+    # Prepared frames (or pending AsyncResults) by frame index, in LRU order.
+    _cache = Instance(OrderedDict, ())
+
+    # The worker pool.
+    _pool = Any
+
+    # The playback timer.
+    _timer = Any
+
+    @classmethod
+    def from_arrays(cls, arrays, **traits):
+        """ Create a time series from a sequence of 3D arrays.
+        """
+        return cls(num_frames=len(arrays), load_frame=arrays.__getitem__,
+                   **traits)
+
+    # -------------------------------------------------------------------------
+    # Public interface
+    # -------------------------------------------------------------------------
+
+    def close(self):
+        """ Stop playback and shut down the worker pool.
+        """
+        self.stop()
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+        self._cache.clear()
+
+    def play(self):
+        """ Start advancing `current_frame` at `frame_rate`.
+        """
+        self.stop()
+        interval = max(int(round(1000 / self.frame_rate)), 1)
+        self._timer = Timer(interval, self.step)
+
+    def step(self):
+        """ Advance `current_frame` by one frame in the playback direction,
+        unless that frame is still being prepared.
+        """
+        if self.num_frames > 0:
+            frame = (self.current_frame + self.direction) % self.num_frames
+            if self._is_ready(frame):
+                self.current_frame = frame
+            else:
+                self._request(frame)
+
+    def stop(self):
+        """ Stop playback.
+        """
+        if self._timer is not None:
+            self._timer.Stop()
+            self._timer = None
+
+    # -------------------------------------------------------------------------
+    # Traits handlers
+    # -------------------------------------------------------------------------
+
+    def _spacing_default(self):
+        return (1.0, 1.0, 1.0)
+
+    def _data_default(self):
+        # There is no frame to show meanwhile, so prepare this one right away
+        index = self.current_frame
+        entry = self._cache.pop(index, None)
+        if isinstance(entry, VolumeData):
+            data = entry
+        elif entry is not None:
+            data = entry.get()
+        else:
+            data = _prepare_frame(self.load_frame, index, self.spacing)
+        self._cache[index] = data
+        self._evict()
+        self.data_frame = index
+        self._prefetch()
+        return data
+
+    def _current_frame_changed(self, new):
+        if not self.traits_inited():
+            return
+
+        self._request(new)
+        self._show_frame(new)
+        self._prefetch()
+
+    def _direction_changed(self):
+        self._prefetch()
+
+    # -------------------------------------------------------------------------
+    # Private methods
+    # -------------------------------------------------------------------------
+
+    def _frame_prepared(self, index):
+        """ Show a frame which was prepared on a worker thread, if it is
+        still the current frame.
+        """
+        if (index == self.current_frame and index in self._cache and
+                self._pool is not None):
+            self._show_frame(index)
+
+    def _is_ready(self, index):
+        entry = self._cache.get(index)
+        return (isinstance(entry, VolumeData) or
+                (entry is not None and entry.ready()))
+
+    def _prefetch(self):
+        if self.num_frames == 0:
+            return
+
+        count = min(self.prefetch_count, self.num_frames - 1)
+        for offset in range(1, count + 1):
+            index = (self.current_frame + offset * self.direction)
+            index %= self.num_frames
+            self._request(index)
+        self._evict()
+
+    def _request(self, index):
+        """ Start preparing a frame on the worker pool, unless it is cached
+        or being prepared already.
+        """
+        if index in self._cache:
+            return
+
+        if self._pool is None:
+            self._pool = ThreadPool(self.num_workers)
+
+        def prepared(volume_data):
+            # Called on the pool's result thread
+            GUI.invoke_later(self._frame_prepared, index)
+
+        self._cache[index] = self._pool.apply_async(
+            _prepare_frame, (self.load_frame, index, self.spacing),
+            callback=prepared
+        )
+
+    def _show_frame(self, index):
+        """ Move the frame to the end of the LRU order and show it in `data`
+        if it is prepared.
+        """
+        cache = self._cache
+        entry = cache.pop(index)
+        if not isinstance(entry, VolumeData) and entry.ready():
+            # Raises the error of the worker if preparing the frame failed
+            entry = entry.get()
+        cache[index] = entry
+        self._evict()
+
+        if isinstance(entry, VolumeData) and entry is not self.data:
+            self.data_frame = index
+            self.data = entry
+
+    def _evict(self):
+        cache = self._cache
+        while len(cache) > max(self.cache_size, 1):
+            index = next(iter(cache))
+            if index == self.current_frame:
+                cache[index] = cache.pop(index)
+                continue
+            del cache[index]
@@ -3,10 +3,10 @@ import numpy as np
 
 from mayavi.core.ui.api import MlabSceneModel
 from traits.api import (Bool, CInt, Dict, Event, HasTraits, Instance, List,
-                        on_trait_change, Unicode)
+                        on_trait_change, Tuple, Unicode)
 from tvtk.api import tvtk
 
-from ensemble.ctf.api import CtfEditor, get_color
+from ensemble.ctf.api import CtfEditor, CtfEditor2D, get_color
 from .volume_data import VolumeData
 from .volume_renderer import VolumeRenderer
 from .volume_scene_member import ABCVolumeSceneMember
@@ -33,6 +33,13 @@ class VolumeViewer(HasTraits):
     # Whether to show the histogram on the CTF editor.
     histogram_bins = CInt(0)
 
+    # An optional editor for a value x gradient magnitude transfer function.
+    # When given, its function is rendered instead of `ctf_editor`'s.
+    ctf_editor_2d = Instance(CtfEditor2D)
+
+    # The number of (value, gradient) bins of the 2D editor's histogram.
+    joint_histogram_bins = Tuple(CInt(256), CInt(128))
+
     # If True, the Z-axis points down
     flip_z = Bool(False)
 
@@ -42,30 +49,122 @@ class VolumeViewer(HasTraits):
     # An event fired once the scene has been initialized.
     scene_initialized = Event
 
+    # Image filters used by `screenshot`, by mode. Kept between calls.
+    _screenshot_filters = Dict
+
     # -------------------------------------------------------------------------
     # Public interface
     # -------------------------------------------------------------------------
 
-    def screenshot(self, magnification=1):
+    def screenshot(self, magnification=1, out=None, mode='rgb'):
         """ Returns an image of the rendered volume. The image will be the same
         size as the window on screen by default. For high resolution image,
         pass a magnification integer value > 1.
-        """
-        renderer = self.model.renderer
 
-        image_filter = tvtk.RenderLargeImage()
-        image_filter.input = renderer
-        image_filter.magnification = magnification
+        Parameters
+        ----------
+        magnification : int
+            The factor by which to enlarge the image.
+        out : array, optional
+            An array to write the image into, which is then returned. Its
+            shape and type must match the image. Passing the same array to
+            repeated calls avoids allocating a new image each time.
+        mode : str
+            'rgb' or 'rgba' for a (height, width, channels) uint8 image, or
+            'depth' for a (height, width) float32 image of z-buffer values.
+        """
+        image_filter = self._screenshot_filter(mode)
+        if mode == 'rgb':
+            image_filter.magnification = magnification
+        else:
+            image_filter.scale = (magnification, magnification)
+        image_filter.modified()
         image_filter.update()
 
         image_data = image_filter.output
         x, y, _ = image_data.dimensions
-        data = image_data.point_data.scalars
-        data_array = data.to_array().copy()
-        data_array.shape = (y, x, 3)
-        data_array = np.flipud(data_array)
-
-        return data_array
+        # This is a view of VTK's buffer, not a copy
+        data = image_data.point_data.scalars.to_array()
+        shape = (y, x) if mode == 'depth' else (y, x, data.shape[-1])
+        data = data.reshape(shape)
+
+        if out is None:
+            out = np.empty(shape, dtype=data.dtype)
+        elif out.shape != shape or out.dtype != data.dtype:
+            msg = 'Expected an output array of shape {} and type {}'
+            raise ValueError(msg.format(shape, data.dtype))
+
+        # VTK images start with the bottom row. Writing through a flipped view
+        # of `out` turns the image the right way up in the same copy.
+        out[::-1] = data
+        return out
+
+    def export_screenshot(self, filename, magnification, mode='rgb'):
+        """ Render a magnified image of the volume tile by tile, writing each
+        tile straight into a ``.npy`` file.
+
+        Unlike `screenshot`, only a window sized tile is held in memory at a
+        time, so the image can be larger than the available memory.
+
+        Parameters
+        ----------
+        filename : str
+            The path of the ``.npy`` file to write.
+        magnification : int
+            The factor by which to enlarge the image.
+        mode : str
+            The kind of image, as for `screenshot`.
+
+        Returns
+        -------
+        image : numpy.memmap
+            The image, memory mapped from `filename`.
+        """
+        magnification = int(magnification)
+        # Capture one tile to find the tile size and type.
+        tile = self.screenshot(mode=mode)
+        tile_height, tile_width = tile.shape[:2]
+        shape = ((tile_height * magnification, tile_width * magnification) +
+                 tile.shape[2:])
+        image = np.lib.format.open_memmap(filename, mode='w+',
+                                          dtype=tile.dtype, shape=shape)
+        del tile
+
+        camera = self.model.camera
+        window_center = camera.window_center
+        view_angle = camera.view_angle
+        parallel_scale = camera.parallel_scale
+
+        # Zoom in on one tile and move the window center from tile to tile,
+        # like tvtk.RenderLargeImage does.
+        half_angle = np.radians(view_angle / 2)
+        camera.view_angle = np.degrees(
+            2 * np.arctan(np.tan(half_angle) / magnification)
+        )
+        camera.parallel_scale = parallel_scale / magnification
+        try:
+            for y in range(magnification):
+                center_y = (2 * y + 1 -
+                            magnification * (1 - window_center[1]))
+                # Tiles are rendered from the bottom, but rows are stored
+                # from the top.
+                row = (magnification - 1 - y) * tile_height
+                rows = slice(row, row + tile_height)
+                for x in range(magnification):
+                    center_x = (2 * x + 1 -
+                                magnification * (1 - window_center[0]))
+                    camera.window_center = (center_x, center_y)
+                    column = x * tile_width
+                    columns = slice(column, column + tile_width)
+                    self.screenshot(out=image[rows, columns], mode=mode)
+        finally:
+            camera.window_center = window_center
+            camera.view_angle = view_angle
+            camera.parallel_scale = parallel_scale
+            self.model.render()
+
+        image.flush()
+        return image
 
     # -------------------------------------------------------------------------
     # Default values
@@ -76,9 +175,11 @@ class VolumeViewer(HasTraits):
 
     def _volume_renderer_default(self):
         function = self.ctf_editor.function
-        return VolumeRenderer(data=self.volume_data,
-                              colors=function.color,
-                              opacities=function.opacity)
+        renderer = VolumeRenderer(data=self.volume_data,
+                                  colors=function.color,
+                                  opacities=function.opacity)
+        self._add_update_tasks(renderer)
+        return renderer
 
     def _ctf_editor_default(self):
         return CtfEditor(prompt_color_selection=get_color)
@@ -88,7 +189,30 @@ class VolumeViewer(HasTraits):
     # -------------------------------------------------------------------------
 
     def _volume_data_changed(self):
-        self.volume_renderer.data = self.volume_data
+        scheduler = self.volume_renderer.scheduler
+        with scheduler.batch():
+            self.volume_renderer.data = self.volume_data
+            scheduler.invalidate('scene_members')
+
+    def _volume_renderer_changed(self, new):
+        self._add_update_tasks(new)
+
+    def _histogram_bins_changed(self):
+        self.volume_renderer.scheduler.invalidate('histogram')
+
+    @on_trait_change('ctf_editor_2d,joint_histogram_bins')
+    def _joint_histogram_settings_changed(self):
+        self.volume_renderer.scheduler.invalidate('joint_histogram')
+
+    def _scene_members_changed(self, old, new):
+        self._replace_scene_members(old.values(), new.values())
+
+    def _scene_members_items_changed(self, event):
+        # `changed` holds the replaced members
+        removed = list(event.removed.values()) + list(event.changed.values())
+        keys = list(event.added) + list(event.changed)
+        added = [self.scene_members[key] for key in keys]
+        self._replace_scene_members(removed, added)
 
     def _clip_bounds_changed(self):
         self.volume_renderer.clip_bounds = self.clip_bounds[:]
@@ -102,6 +226,13 @@ class VolumeViewer(HasTraits):
         function = self.ctf_editor.function
         set_ctf(function.color, function.opacity)
 
+    @on_trait_change('ctf_editor_2d.function')
+    def ctf_2d_changed(self):
+        function = None
+        if self.ctf_editor_2d is not None:
+            function = self.ctf_editor_2d.function
+        self.volume_renderer.transfer_function_2d = function
+
     # -------------------------------------------------------------------------
     # Scene activation callbacks
     # -------------------------------------------------------------------------
@@ -112,9 +243,8 @@ class VolumeViewer(HasTraits):
         self.volume_renderer.add_volume_to_scene(self.model)
 
         # Add the other members to the scene
-        volume_actor = self.volume_renderer.actor
         for member in self.scene_members.values():
-            member.add_actors_to_scene(self.model, volume_actor)
+            self._add_scene_member(member)
 
         self._setup_camera()
         self.model.scene.background = (0, 0, 0)
@@ -130,6 +260,56 @@ class VolumeViewer(HasTraits):
     # Private methods
     # -------------------------------------------------------------------------
 
+    def _add_update_tasks(self, renderer):
+        """ Add the updates which follow the volume data to the scheduler
+        of `renderer`.
+
+        The tasks use `renderer` rather than `volume_renderer`, which is
+        still being created when this is called from its default method.
+        """
+        scheduler = renderer.scheduler
+        if scheduler.has_task('histogram'):
+            return
+
+        # The histograms are recomputed with the raw data
+        scheduler.add_task('histogram',
+                           lambda: self._new_histogram(renderer),
+                           depends_on=('data_range',))
+        scheduler.add_task('joint_histogram', self._new_joint_histogram,
+                           depends_on=('data_range',))
+        scheduler.add_task('scene_members',
+                           lambda: self._update_scene_members(renderer))
+        scheduler.invalidate('histogram', 'joint_histogram')
+
+    def _replace_scene_members(self, removed, added):
+        if self.volume_renderer.volume is None:
+            # They are added once the scene is displayed
+            return
+
+        for member in removed:
+            member.remove_actors(self.model)
+        for member in added:
+            self._add_scene_member(member)
+        self.model.render()
+
+    def _screenshot_filter(self, mode):
+        image_filter = self._screenshot_filters.get(mode)
+        if image_filter is None:
+            renderer = self.model.renderer
+            if mode == 'rgb':
+                image_filter = tvtk.RenderLargeImage(input=renderer)
+            elif mode in ('rgba', 'depth'):
+                buffer_type = 'rgba' if mode == 'rgba' else 'z_buffer'
+                image_filter = tvtk.WindowToImageFilter(
+                    input=renderer.render_window,
+                    input_buffer_type=buffer_type,
+                    read_front_buffer=False,
+                )
+            else:
+                raise ValueError('Unknown screenshot mode: {}'.format(mode))
+            self._screenshot_filters[mode] = image_filter
+        return image_filter
+
     def _setup_camera(self):
         if self.flip_z:
             view_up = (0, 0, -1)
@@ -140,13 +320,51 @@ class VolumeViewer(HasTraits):
         self.model.mlab.view(40, elevation)
         self.model.camera.view_up = view_up
 
-    @on_trait_change('histogram_bins,volume_data.raw_data')
-    def _new_histogram(self):
+    def _add_scene_member(self, member):
+        """ Add the actors of a scene member and update them for the
+        current volume data.
+        """
+        volume_actor = self.volume_renderer.actor
+        member.add_actors_to_scene(self.model, volume_actor)
+        member.update_for_volume(self.model, volume_actor, self.volume_data)
+
+    def _update_scene_members(self, renderer):
+        """ Update the other members of the scene for new volume data,
+        reusing their actors.
+        """
+        if renderer.volume is None:
+            return
+
+        volume_actor = renderer.actor
+        for member in self.scene_members.values():
+            member.update_for_volume(self.model, volume_actor,
+                                     self.volume_data)
+        renderer.scheduler.invalidate('render')
+
+    def _new_histogram(self, renderer):
         if (self.histogram_bins > 0 and
                 self.volume_data is not None and
                 self.volume_data.raw_data is not None):
+            # Reuse the data range of the renderer instead of searching the
+            # data for it again.
+            data_range = None
+            if renderer.data is self.volume_data:
+                data_range = (renderer.vmin, renderer.vmax)
             self.ctf_editor.histogram = np.histogram(self.volume_data.raw_data,
                                                      bins=self.histogram_bins,
+                                                     range=data_range,
                                                      density=False)
         else:
             self.ctf_editor.histogram = None
+
+    def _new_joint_histogram(self):
+        editor = self.ctf_editor_2d
+        if editor is None:
+            return
+
+        if self.volume_data is not None and self.volume_data.raw_data.size:
+            bins = self.joint_histogram_bins
+            counts, _ = self.volume_data.gradient_histogram(bins=bins)
+            editor.histogram = counts
+        else:
+            editor.histogram = np.empty((0, 0))